@@ -0,0 +1,155 @@
+# kpi_app/bulk.py
+
+"""
+Bulk provisioning of assets and AssetKPI links.
+
+Rows are validated one by one and reported with a per-row status; the valid
+ones are written with `bulk_create` in a single transaction, with a constant
+number of queries per batch of rows rather than several per row.
+"""
+
+from django.db import transaction
+from rest_framework import serializers
+
+from ..core.routing import routing_index
+from ..models import KPI, Asset, AssetKPI
+from . import caching
+from .serializers import AssetBulkSerializer, AssetKPIBulkSerializer
+
+CREATED = 'created'
+UPDATED = 'updated'
+EXISTS = 'exists'
+ERROR = 'error'
+
+# Rows per IN (...) lookup, well below SQLite's bound parameter limit
+LOOKUP_BATCH_SIZE = 500
+
+def validate_rows(serializer_class, rows, context):
+    """Returns (validated rows, per-row errors) using one `many=True` serializer's child."""
+    child = serializer_class(many=True, context=context).child
+    validated = []
+    errors = []
+    for row in rows:
+        try:
+            validated.append(child.run_validation(row))
+            errors.append(None)
+        except serializers.ValidationError as e:
+            validated.append(None)
+            errors.append(e.detail)
+    return validated, errors
+
+def in_batches(model, field, values, *columns):
+    """Yields `values_list(*columns)` rows of `model` whose `field` is in `values`."""
+    values = list(values)
+    for i in range(0, len(values), LOOKUP_BATCH_SIZE):
+        yield from model.objects.filter(**{f'{field}__in': values[i:i + LOOKUP_BATCH_SIZE]}).values_list(*columns)
+
+def summarize(results):
+    counts = {}
+    for result in results:
+        counts[result['status']] = counts.get(result['status'], 0) + 1
+    return {'counts': counts, 'results': results}
+
+def upsert_assets(rows, context=None):
+    """
+    Creates or updates assets by `asset_id` and returns the per-row results.
+
+    Existing assets have their name updated (`bulk_create(update_conflicts=True)`);
+    an `asset_id` repeated within the request is rejected after its first row.
+    """
+    validated, errors = validate_rows(AssetBulkSerializer, rows, context)
+    results = [{'status': ERROR, 'errors': error} for error in errors]
+    pending = {}
+    for position, data in enumerate(validated):
+        if data is None:
+            continue
+        if data['asset_id'] in pending:
+            results[position] = {'status': ERROR, 'errors': {'asset_id': ["Duplicate asset_id in request."]}}
+            continue
+        pending[data['asset_id']] = position
+
+    with transaction.atomic():
+        existing = {asset_id for (asset_id,) in in_batches(Asset, 'asset_id', pending, 'asset_id')}
+        Asset.objects.bulk_create(
+            [Asset(**validated[position]) for position in pending.values()],
+            batch_size=1000, update_conflicts=True, unique_fields=['asset_id'], update_fields=['name'],
+        )
+        for asset_id, pk in in_batches(Asset, 'asset_id', pending, 'asset_id', 'id'):
+            results[pending[asset_id]] = {
+                'status': UPDATED if asset_id in existing else CREATED, 'id': pk, 'asset_id': asset_id,
+            }
+
+    if pending:
+        # bulk_create does not send signals
+        caching.invalidate(Asset)
+    return summarize(results)
+
+def create_asset_kpis(rows, context=None):
+    """
+    Creates AssetKPI links and returns the per-row results.
+
+    Links that already exist, or appear twice in the request, are reported as
+    `exists` rather than duplicated, so a provisioning run can be retried.
+    """
+    validated, errors = validate_rows(AssetKPIBulkSerializer, rows, context)
+    results = [{'status': ERROR, 'errors': error} for error in errors]
+    valid = [(position, data) for position, data in enumerate(validated) if data is not None]
+
+    with transaction.atomic():
+        assets_by_pk = {}
+        assets_by_code = {}
+        for pk, asset_id in in_batches(Asset, 'pk', {d['asset'] for _, d in valid if 'asset' in d}, 'id', 'asset_id'):
+            assets_by_pk[pk] = (pk, asset_id)
+        for pk, asset_id in in_batches(Asset, 'asset_id', {d['asset_id'] for _, d in valid if 'asset_id' in d},
+                                       'id', 'asset_id'):
+            assets_by_code[asset_id] = (pk, asset_id)
+        kpis = dict(in_batches(KPI, 'pk', {d['kpi'] for _, d in valid}, 'id', 'expression'))
+
+        resolved = []
+        for position, data in valid:
+            asset = assets_by_pk.get(data['asset']) if 'asset' in data else assets_by_code.get(data['asset_id'])
+            if asset is None:
+                results[position] = {'status': ERROR, 'errors': {'asset': ["Asset not found."]}}
+            elif data['kpi'] not in kpis:
+                results[position] = {'status': ERROR, 'errors': {'kpi': ["KPI not found."]}}
+            else:
+                resolved.append((position, asset, data['kpi'], data['attribute_id']))
+
+        existing = {}
+        for pk, asset_pk, kpi_pk, attribute_id in in_batches(
+                AssetKPI, 'asset_id', {asset[0] for _, asset, _, _ in resolved}, 'id', 'asset_id', 'kpi_id', 'attribute_id'):
+            existing[(asset_pk, kpi_pk, attribute_id)] = pk
+
+        links = []
+        for position, (asset_pk, asset_id), kpi_pk, attribute_id in resolved:
+            key = (asset_pk, kpi_pk, attribute_id)
+            if key in existing:
+                results[position] = {'status': EXISTS, 'id': existing[key]}
+                continue
+            link = AssetKPI(asset=Asset(pk=asset_pk, asset_id=asset_id),
+                            kpi=KPI(pk=kpi_pk, expression=kpis[kpi_pk]), attribute_id=attribute_id)
+            existing[key] = link
+            links.append((position, link))
+        AssetKPI.assign_output_attribute_ids([link for _, link in links])
+        AssetKPI.objects.bulk_create([link for _, link in links], batch_size=1000)
+
+    for position, link in links:
+        results[position] = {'status': CREATED, 'id': link.pk}
+    # Links repeated within the request point at the link created for their first row
+    for result in results:
+        if isinstance(result.get('id'), AssetKPI):
+            result['id'] = result['id'].pk
+
+    if links:
+        # bulk_create does not send signals: update the routing index and the response cache here
+        caching.invalidate(AssetKPI)
+        if routing_index.is_loaded:
+            transaction.on_commit(lambda: update_routing_index([link for _, link in links]))
+    return summarize(results)
+
+def update_routing_index(links):
+    if all(link.pk is not None for link in links):
+        for link in links:
+            routing_index.asset_kpi_saved(link)
+    else:
+        routing_index.load()
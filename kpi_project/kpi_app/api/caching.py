@@ -0,0 +1,102 @@
+# kpi_app/caching.py
+
+"""
+Server-side response cache and conditional GETs for the configuration endpoints.
+
+Every cached model has a version entry in Django's cache, replaced by the model
+signals on each save or delete. A response's ETag is derived from the versions
+of the models it depends on and from the request URL, so:
+
+- a poll with a matching `If-None-Match` gets a 304 after reading only the
+  version entries, and
+- any other GET is served from the cached response data when present, without
+  querying the database or running the serializer.
+
+Version entries expire with the responses (`API_CACHE_TIMEOUT`), which bounds
+staleness when writes happen in a process whose signals cannot reach this
+cache, e.g. with the per-process local-memory backend.
+
+`Last-Modified` is sent for information only. It has a one-second
+resolution, so a write in the same second as a read would leave an
+`If-Modified-Since` poll with a stale 304; those polls get a full response.
+"""
+
+import hashlib
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from rest_framework.response import Response
+
+def cache_timeout():
+    return getattr(settings, 'API_CACHE_TIMEOUT', 300)
+
+def version_key(model):
+    return f"kpi_app:api-version:{model._meta.label_lower}"
+
+def new_version():
+    """Returns a (token, last_modified) pair for a table that just changed."""
+    return uuid.uuid4().hex, int(time.time())
+
+def table_versions(models):
+    """Returns the current version of each model, creating missing ones."""
+    keys = [version_key(model) for model in models]
+    versions = cache.get_many(keys)
+    missing = [key for key in keys if key not in versions]
+    if missing:
+        for key in missing:
+            cache.add(key, new_version(), cache_timeout())
+        versions.update(cache.get_many(missing))
+    # An entry evicted between add() and get_many() only costs a cache miss
+    return [versions.get(key) or new_version() for key in keys]
+
+def invalidate(model):
+    """
+    Replaces a model's version so every cached response depending on it is stale.
+
+    The version is replaced immediately, so this process reads its own writes,
+    and once more on commit, so a request that cached the old rows while the
+    transaction was open does not keep serving them.
+    """
+    key = version_key(model)
+    cache.set(key, new_version(), cache_timeout())
+    transaction.on_commit(lambda: cache.set(key, new_version(), cache_timeout()))
+
+class CachedResponseMixin:
+    """
+    Caches `list` and `retrieve` responses of a viewset and answers conditional
+    GETs with 304. `cache_dependencies` lists the models whose changes must
+    invalidate the responses.
+    """
+    cache_dependencies = ()
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(super().retrieve, request, *args, **kwargs)
+
+    def cached_response(self, handler, request, *args, **kwargs):
+        versions = table_versions(self.cache_dependencies)
+        fingerprint = repr(([token for token, _ in versions], request.get_full_path(), request.accepted_media_type))
+        etag = quote_etag(hashlib.sha1(fingerprint.encode()).hexdigest())
+        last_modified = max(modified for _, modified in versions)
+
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response_key = f"kpi_app:api-response:{etag}"
+            data = cache.get(response_key)
+            if data is None:
+                response = handler(request, *args, **kwargs)
+                if response.status_code != 200:
+                    return response
+                cache.set(response_key, response.data, cache_timeout())
+            else:
+                response = Response(data)
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified)
+        return response
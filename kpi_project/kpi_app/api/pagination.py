@@ -0,0 +1,138 @@
+# kpi_app/pagination.py
+
+import base64
+import heapq
+import json
+from collections import OrderedDict
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+class KeysetPagination(BasePagination):
+    """
+    Keyset (seek) pagination over (timestamp, id).
+
+    Each page is fetched with `WHERE (timestamp, id) > (cursor)` ordered by the
+    same columns, so with a matching index its cost does not depend on how deep
+    the client has paged, unlike OFFSET-based pagination. Views can page on a
+    different datetime column by setting `keyset_field`, and can add rows kept
+    outside the queryset by defining `extra_rows(cursor, limit)`, which returns
+    up to `limit` such rows after the cursor in the same order.
+    """
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    page_size = 100
+    max_page_size = 1000
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size_value = self.get_page_size(request)
+        self.field = getattr(view, 'keyset_field', 'timestamp')
+        queryset = self.order(queryset)
+
+        cursor = self.decode_cursor(request)
+        if cursor is not None:
+            queryset = self.seek(queryset, cursor)
+
+        # Fetch one extra row to know whether there is a next page
+        rows = list(queryset[:self.page_size_value + 1])
+        extra_rows = getattr(view, 'extra_rows', None)
+        if extra_rows is not None:
+            extra = extra_rows(cursor, self.page_size_value + 1)
+            if extra:
+                rows = list(heapq.merge(rows, extra, key=self.sort_key))[:self.page_size_value + 1]
+        self.has_next = len(rows) > self.page_size_value
+        rows = rows[:self.page_size_value]
+        self.last = rows[-1] if rows else None
+        return rows
+
+    def order(self, queryset):
+        return queryset.order_by(self.field, 'id')
+
+    def sort_key(self, row):
+        return getattr(row, self.field), row.pk
+
+    def seek(self, queryset, cursor):
+        """Filters the queryset to the rows after `cursor`."""
+        timestamp, pk = cursor
+        return queryset.filter(Q(**{f'{self.field}__gt': timestamp}) | Q(**{self.field: timestamp, 'id__gt': pk}))
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('results', data),
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except ValueError:
+            raise ValidationError({self.page_size_query_param: "Must be an integer."})
+        return max(1, min(size, self.max_page_size))
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        return replace_query_param(
+            self.request.build_absolute_uri(), self.cursor_query_param, self.encode_cursor(self.last)
+        )
+
+    def encode_cursor(self, row):
+        payload = json.dumps(self.cursor_values(row)).encode('utf-8')
+        return base64.urlsafe_b64encode(payload).decode('ascii')
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            return self.parse_cursor(json.loads(base64.urlsafe_b64decode(encoded.encode('ascii'))))
+        except (ValueError, TypeError):
+            raise ValidationError({self.cursor_query_param: "Invalid cursor."})
+
+    def cursor_values(self, row):
+        return [getattr(row, self.field).isoformat(), row.pk]
+
+    def parse_cursor(self, values):
+        timestamp, pk = values
+        timestamp = parse_datetime(timestamp)
+        if timestamp is None or not isinstance(pk, int):
+            raise ValueError
+        return timestamp, pk
+
+class IdKeysetPagination(KeysetPagination):
+    """
+    Keyset pagination on the primary key alone, for tables without a time
+    column such as KPIs, assets and their links. New rows always appear on the
+    last page, so a client can page through a table that is being written to
+    without skipping or repeating rows.
+    """
+
+    def order(self, queryset):
+        return queryset.order_by('id')
+
+    def seek(self, queryset, cursor):
+        return queryset.filter(id__gt=cursor)
+
+    def cursor_values(self, row):
+        return [row.pk]
+
+    def parse_cursor(self, values):
+        (pk,) = values
+        if not isinstance(pk, int):
+            raise ValueError
+        return pk
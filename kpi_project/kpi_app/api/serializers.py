@@ -1,25 +1,130 @@
 # kpi_app/serializers.py
 
 from rest_framework import serializers
-from ..models import KPI, Asset, AssetKPI
-from kpi_app.models.asset_kpi import AssetKPI
-from kpi_app.models.kpi import KPI
-from kpi_app.models.asset import Asset
+from ..models import KPI, Asset, AssetKPI, EvaluationLog, EvaluationRollup, RetentionPolicy
+from ..core.interpreter import CustomInterpreter
 
-class KPISerializer(serializers.ModelSerializer):
+def query_list(request, name):
+    """Returns the comma-separated values of a query parameter as a list."""
+    if request is None:
+        return []
+    return [item.strip() for item in request.query_params.get(name, '').split(',') if item.strip()]
+
+def expand_param(request, expandable):
+    """Returns the relations named in `?expand=`, rejecting unknown ones."""
+    requested = query_list(request, 'expand')
+    unknown = sorted(set(requested) - set(expandable))
+    if unknown:
+        raise serializers.ValidationError({'expand': f"Unknown relation(s): {', '.join(unknown)}"})
+    return requested
+
+class SparseFieldsMixin:
+    """
+    Limits the serialized fields to those named in `?fields=` on read requests.
+
+    Only the top-level serializer of a request is trimmed: nested serializers
+    are built without the request context, so they keep all their fields.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        request = self.context.get('request')
+        if request is None or request.method not in ('GET', 'HEAD'):
+            return
+        requested = query_list(request, 'fields')
+        if not requested:
+            return
+        unknown = sorted(set(requested) - set(self.fields))
+        if unknown:
+            raise serializers.ValidationError({'fields': f"Unknown field(s): {', '.join(unknown)}"})
+        for name in set(self.fields) - set(requested):
+            self.fields.pop(name)
+
+class KPISerializer(SparseFieldsMixin, serializers.ModelSerializer):
     """Serializes the KPI model for API responses"""
     class Meta:
         model = KPI
         fields = ['id', 'name', 'expression', 'description']
 
-class AssetSerializer(serializers.ModelSerializer):
+    def validate_expression(self, value):
+        """Compiles the expression so syntax errors and bad regex patterns fail at save time."""
+        try:
+            CustomInterpreter().get_compiled(value)
+        except ValueError as e:
+            raise serializers.ValidationError(str(e))
+        return value
+
+class AssetSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     """Serializes the Asset model for API responses"""
     class Meta:
         model = Asset
         fields = ['id', 'asset_id', 'name']
 
-class AssetKPISerializer(serializers.ModelSerializer):
-    """Serializes the AssetKPI model for API responses"""
+class AssetKPISerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    """
+    Serializes the AssetKPI model for API responses. `?expand=asset,kpi`
+    replaces the related IDs with the related objects on read requests.
+    """
+    expandable_fields = {
+        'asset': AssetSerializer,
+        'kpi': KPISerializer,
+    }
+
     class Meta:
         model = AssetKPI
-        fields = ['id', 'kpi', 'asset', 'attribute_id']
+        fields = ['id', 'kpi', 'asset', 'attribute_id', 'output_attribute_id']
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        request = self.context.get('request')
+        if request is None or request.method not in ('GET', 'HEAD'):
+            return
+        for name in expand_param(request, self.expandable_fields):
+            if name in self.fields:
+                self.fields[name] = self.expandable_fields[name](read_only=True)
+
+class AssetBulkSerializer(serializers.ModelSerializer):
+    """
+    Validates one row of a bulk asset upsert. The unique check on `asset_id`
+    is left out: existing assets are updated instead of rejected.
+    """
+    class Meta:
+        model = Asset
+        fields = ['asset_id', 'name']
+        extra_kwargs = {'asset_id': {'validators': []}}
+
+class AssetKPIBulkSerializer(serializers.Serializer):
+    """
+    Validates one row of a bulk AssetKPI creation. The asset is given by its
+    primary key (`asset`) or its `asset_id`; references are resolved for the
+    whole batch at once instead of one query per row.
+    """
+    asset = serializers.IntegerField(required=False)
+    asset_id = serializers.CharField(max_length=100, required=False)
+    kpi = serializers.IntegerField()
+    attribute_id = serializers.CharField(max_length=100)
+
+    def validate(self, data):
+        if ('asset' in data) == ('asset_id' in data):
+            raise serializers.ValidationError("Provide exactly one of 'asset' and 'asset_id'.")
+        return data
+
+class EvaluationLogSerializer(serializers.ModelSerializer):
+    """Serializes the EvaluationLog model for API responses"""
+    class Meta:
+        model = EvaluationLog
+        fields = ['id', 'asset_id', 'attribute_id', 'timestamp', 'result']
+
+class EvaluationRollupSerializer(serializers.ModelSerializer):
+    """Serializes the EvaluationRollup model for API responses"""
+    avg = serializers.FloatField(read_only=True)
+
+    class Meta:
+        model = EvaluationRollup
+        fields = ['bucket_start', 'count', 'min', 'max', 'avg']
+
+class RetentionPolicySerializer(serializers.ModelSerializer):
+    """Serializes the RetentionPolicy model for API requests and responses"""
+    class Meta:
+        model = RetentionPolicy
+        fields = ['id', 'asset_id', 'attribute_id', 'raw_days', 'minute_days', 'hour_days', 'day_days']
@@ -2,13 +2,19 @@
 
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import KPIViewSet, AssetViewSet, AssetKPIViewSet
+from .views import (
+    KPIViewSet, AssetViewSet, AssetKPIViewSet, EvaluationLogViewSet, EvaluationRollupViewSet,
+    RetentionPolicyViewSet,
+)
 
 # Factory Pattern: using a router to create and register viewsets.
 router = DefaultRouter()
 router.register(r'kpis', KPIViewSet)
 router.register(r'assets', AssetViewSet)
 router.register(r'asset-kpis', AssetKPIViewSet)
+router.register(r'evaluation-logs', EvaluationLogViewSet)
+router.register(r'evaluation-rollups', EvaluationRollupViewSet)
+router.register(r'retention-policies', RetentionPolicyViewSet)
 
 urlpatterns = [
     path('', include(router.urls)),
@@ -1,21 +1,99 @@
-from rest_framework import viewsets
+from django.http import Http404, HttpResponse
+from django.utils.dateparse import parse_datetime
+from rest_framework import status, viewsets
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
-from ..models import KPI, Asset, AssetKPI
-from .serializers import KPISerializer, AssetSerializer, AssetKPISerializer
+from ..models import KPI, Asset, AssetKPI, EvaluationLog, EvaluationRollup, RetentionPolicy
+from .bulk import create_asset_kpis, upsert_assets
+from .caching import CachedResponseMixin
+from .pagination import IdKeysetPagination, KeysetPagination
+from .serializers import (
+    KPISerializer, AssetSerializer, AssetKPISerializer, EvaluationLogSerializer, EvaluationRollupSerializer,
+    AssetBulkSerializer, AssetKPIBulkSerializer, RetentionPolicySerializer, expand_param,
+)
+from ..core.archive import ArchiveReader
 from ..core.interpreter import CustomInterpreter  
+from ..core.metrics import CONTENT_TYPE, WEB_METRICS, registry
 from drf_yasg.utils import swagger_auto_schema
 from drf_yasg import openapi
 
-class KPIViewSet(viewsets.ModelViewSet):
+ERROR_SCHEMA = openapi.Schema(
+    type=openapi.TYPE_OBJECT,
+    properties={
+        'error': openapi.Schema(type=openapi.TYPE_STRING, description="An error message if the request is invalid.")
+    }
+)
+
+FIELDS_PARAMETER = openapi.Parameter(
+    'fields', openapi.IN_QUERY, type=openapi.TYPE_STRING,
+    description="Comma-separated list of fields to return, e.g. `id,name`. All fields by default."
+)
+
+EXPAND_PARAMETER = openapi.Parameter(
+    'expand', openapi.IN_QUERY, type=openapi.TYPE_STRING,
+    description="Comma-separated relations to return as objects instead of IDs: `asset`, `kpi`."
+)
+
+PAGE_PARAMETERS = [
+    openapi.Parameter('cursor', openapi.IN_QUERY, type=openapi.TYPE_STRING,
+                      description="Pagination cursor taken from a previous `next` link."),
+    openapi.Parameter('page_size', openapi.IN_QUERY, type=openapi.TYPE_INTEGER,
+                      description="Number of results per page (default 100, max 1000)."),
+]
+
+BULK_RESULT_SCHEMA = openapi.Schema(
+    type=openapi.TYPE_OBJECT,
+    properties={
+        'counts': openapi.Schema(
+            type=openapi.TYPE_OBJECT, additional_properties=openapi.Schema(type=openapi.TYPE_INTEGER),
+            description="Number of rows per status."
+        ),
+        'results': openapi.Schema(
+            type=openapi.TYPE_ARRAY,
+            items=openapi.Schema(
+                type=openapi.TYPE_OBJECT,
+                properties={
+                    'status': openapi.Schema(type=openapi.TYPE_STRING,
+                                             enum=['created', 'updated', 'exists', 'error']),
+                    'id': openapi.Schema(type=openapi.TYPE_INTEGER),
+                    'errors': openapi.Schema(type=openapi.TYPE_OBJECT, description="Validation errors of the row."),
+                }
+            ),
+            description="One result per input row, in input order."
+        ),
+    }
+)
+
+BATCH_RESULT_SCHEMA = openapi.Schema(
+    type=openapi.TYPE_OBJECT,
+    properties={
+        'results': openapi.Schema(
+            type=openapi.TYPE_ARRAY, items=openapi.Schema(type=openapi.TYPE_STRING),
+            description="Evaluation results in input order; null where the item failed."
+        ),
+        'errors': openapi.Schema(
+            type=openapi.TYPE_ARRAY, items=openapi.Schema(type=openapi.TYPE_STRING),
+            description="Error messages in input order; null where the item succeeded."
+        ),
+    }
+)
+
+class KPIViewSet(CachedResponseMixin, viewsets.ModelViewSet):
     """
     Viewset for managing Key Performance Indicators (KPIs), allowing users to create, retrieve, update, and delete KPIs.
     """
     queryset = KPI.objects.all()
     serializer_class = KPISerializer
+    pagination_class = IdKeysetPagination
+    cache_dependencies = (KPI,)
 
     @swagger_auto_schema(
-        operation_description="Retrieve a list of all KPIs. Each KPI includes a name, expression, and optional description.",
+        operation_description=(
+            "Retrieve a page of KPIs ordered by ID. Each KPI includes a name, expression, and optional description. "
+            "Follow the `next` link to fetch the following page."
+        ),
+        manual_parameters=[FIELDS_PARAMETER] + PAGE_PARAMETERS,
         responses={200: KPISerializer(many=True)}
     )
     def list(self, request, *args, **kwargs):
@@ -31,6 +109,7 @@ class KPIViewSet(viewsets.ModelViewSet):
 
     @swagger_auto_schema(
         operation_description="Retrieve a specific KPI by its unique ID. Returns the name, expression, and description of the KPI.",
+        manual_parameters=[FIELDS_PARAMETER],
         responses={200: KPISerializer, 404: 'Not Found'}
     )
     def retrieve(self, request, *args, **kwargs):
@@ -52,15 +131,22 @@ class KPIViewSet(viewsets.ModelViewSet):
         return super().destroy(request, *args, **kwargs)
 
 
-class AssetViewSet(viewsets.ModelViewSet):
+class AssetViewSet(CachedResponseMixin, viewsets.ModelViewSet):
     """
     Viewset for managing Assets, allowing users to create, retrieve, update, and delete assets.
     """
     queryset = Asset.objects.all()
     serializer_class = AssetSerializer
+    pagination_class = IdKeysetPagination
+    cache_dependencies = (Asset,)
+    max_bulk_size = 50000
 
     @swagger_auto_schema(
-        operation_description="Retrieve a list of all assets. Each asset has a unique asset ID and name.",
+        operation_description=(
+            "Retrieve a page of assets ordered by ID. Each asset has a unique asset ID and name. "
+            "Follow the `next` link to fetch the following page."
+        ),
+        manual_parameters=[FIELDS_PARAMETER] + PAGE_PARAMETERS,
         responses={200: AssetSerializer(many=True)}
     )
     def list(self, request, *args, **kwargs):
@@ -76,6 +162,7 @@ class AssetViewSet(viewsets.ModelViewSet):
 
     @swagger_auto_schema(
         operation_description="Retrieve an asset by its unique ID. Returns the asset ID and name.",
+        manual_parameters=[FIELDS_PARAMETER],
         responses={200: AssetSerializer, 404: 'Not Found'}
     )
     def retrieve(self, request, *args, **kwargs):
@@ -96,16 +183,55 @@ class AssetViewSet(viewsets.ModelViewSet):
     def destroy(self, request, *args, **kwargs):
         return super().destroy(request, *args, **kwargs)
 
+    @swagger_auto_schema(
+        operation_description=(
+            "Create or update many assets in one transaction. Assets are matched by `asset_id`: existing ones "
+            "have their name updated. Invalid rows are reported and skipped; the others are saved."
+        ),
+        request_body=AssetBulkSerializer(many=True),
+        responses={200: BULK_RESULT_SCHEMA, 400: ERROR_SCHEMA}
+    )
+    @action(detail=False, methods=['post'])
+    def bulk(self, request):
+        """
+        Custom action to upsert assets in bulk.
+        - **Parameters**:
+          - A list of `{asset_id, name}` objects.
+        - **Returns**:
+          - Per-row `status` (`created`, `updated` or `error`) with the asset `id` or the row's `errors`.
+        """
+        error = check_bulk_body(request.data, self.max_bulk_size)
+        if error:
+            return Response({"error": error}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(upsert_assets(request.data, self.get_serializer_context()))
 
-class AssetKPIViewSet(viewsets.ModelViewSet):
+
+class AssetKPIViewSet(CachedResponseMixin, viewsets.ModelViewSet):
     """
     Viewset for managing the relationships between Assets and KPIs, allowing creation, retrieval, updating, and deletion.
     """
     queryset = AssetKPI.objects.all()
     serializer_class = AssetKPISerializer
+    pagination_class = IdKeysetPagination
+    cache_dependencies = (AssetKPI, Asset, KPI)
+    max_batch_size = 10000
+    max_bulk_size = 50000
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action in ('list', 'retrieve'):
+            # Expanded relations are fetched in the same query instead of one query per row
+            expand = expand_param(self.request, AssetKPISerializer.expandable_fields)
+            if expand:
+                queryset = queryset.select_related(*expand)
+        return queryset
 
     @swagger_auto_schema(
-        operation_description="Retrieve a list of all Asset-KPI relationships. Each entry links an asset to a KPI and has an attribute ID.",
+        operation_description=(
+            "Retrieve a page of Asset-KPI relationships ordered by ID. Each entry links an asset to a KPI and has an "
+            "attribute ID. Follow the `next` link to fetch the following page."
+        ),
+        manual_parameters=[FIELDS_PARAMETER, EXPAND_PARAMETER] + PAGE_PARAMETERS,
         responses={200: AssetKPISerializer(many=True)}
     )
     def list(self, request, *args, **kwargs):
@@ -121,6 +247,7 @@ class AssetKPIViewSet(viewsets.ModelViewSet):
 
     @swagger_auto_schema(
         operation_description="Retrieve a specific Asset-KPI relationship by its unique ID. Returns associated asset, KPI, and attribute ID.",
+        manual_parameters=[FIELDS_PARAMETER, EXPAND_PARAMETER],
         responses={200: AssetKPISerializer, 404: 'Not Found'}
     )
     def retrieve(self, request, *args, **kwargs):
@@ -141,6 +268,29 @@ class AssetKPIViewSet(viewsets.ModelViewSet):
     def destroy(self, request, *args, **kwargs):
         return super().destroy(request, *args, **kwargs)
 
+    @swagger_auto_schema(
+        operation_description=(
+            "Create many Asset-KPI relationships in one transaction. Each row names the asset by its ID (`asset`) "
+            "or its `asset_id`, plus a KPI ID and an attribute ID. Links that already exist are reported as "
+            "`exists` instead of being duplicated; invalid rows are reported and skipped."
+        ),
+        request_body=AssetKPIBulkSerializer(many=True),
+        responses={200: BULK_RESULT_SCHEMA, 400: ERROR_SCHEMA}
+    )
+    @action(detail=False, methods=['post'])
+    def bulk(self, request):
+        """
+        Custom action to create Asset-KPI relationships in bulk.
+        - **Parameters**:
+          - A list of `{asset or asset_id, kpi, attribute_id}` objects.
+        - **Returns**:
+          - Per-row `status` (`created`, `exists` or `error`) with the link `id` or the row's `errors`.
+        """
+        error = check_bulk_body(request.data, self.max_bulk_size)
+        if error:
+            return Response({"error": error}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(create_asset_kpis(request.data, self.get_serializer_context()))
+
     @swagger_auto_schema(
         operation_description=(
             "Evaluate the KPI expression for a given Asset-KPI relationship. "
@@ -190,3 +340,386 @@ class AssetKPIViewSet(viewsets.ModelViewSet):
             return Response({"result": result})
         except Exception as e:
             return Response({"error": str(e)}, status=400)
+
+    @swagger_auto_schema(
+        operation_description=(
+            "Evaluate the KPI expression of one Asset-KPI relationship for many values in a single request. "
+            "The expression is compiled once and results are returned in input order; a value that fails "
+            "to evaluate yields a null result and an error message at the same position."
+        ),
+        request_body=openapi.Schema(
+            type=openapi.TYPE_OBJECT,
+            properties={
+                'values': openapi.Schema(
+                    type=openapi.TYPE_ARRAY,
+                    items=openapi.Schema(type=openapi.TYPE_STRING),
+                    description="The numeric or text inputs to evaluate, each replacing 'ATTR' in the expression."
+                )
+            },
+            required=['values']
+        ),
+        responses={200: BATCH_RESULT_SCHEMA, 400: ERROR_SCHEMA}
+    )
+    @action(detail=True, methods=['post'], url_path='evaluate-batch')
+    def evaluate_batch(self, request, pk=None):
+        """
+        Custom action to evaluate the KPI expression of one Asset-KPI relationship for many values.
+        - **Parameters**:
+          - `values` (array): The input values to evaluate in the expression.
+        - **Returns**:
+          - Columnar `results` and `errors` arrays aligned with `values`.
+        """
+        asset_kpi = self.get_object()
+        values = request.data.get("values")
+        if not isinstance(values, list):
+            return Response({"error": "'values' must be a list."}, status=status.HTTP_400_BAD_REQUEST)
+        if len(values) > self.max_batch_size:
+            return Response({"error": f"At most {self.max_batch_size} values can be evaluated per request."},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            compiled = CustomInterpreter().get_compiled(asset_kpi.kpi.expression)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(evaluate_values(compiled, values))
+
+    @swagger_auto_schema(
+        operation_description=(
+            "Evaluate values across many Asset-KPI relationships in a single request. Accepts either a list of "
+            "`{asset_kpi, value}` items or the compact columnar form `{asset_kpi: [...], value: [...]}`. Each KPI "
+            "expression is compiled once; results are returned in input order with per-item errors."
+        ),
+        request_body=openapi.Schema(
+            type=openapi.TYPE_OBJECT,
+            properties={
+                'items': openapi.Schema(
+                    type=openapi.TYPE_ARRAY,
+                    items=openapi.Schema(
+                        type=openapi.TYPE_OBJECT,
+                        properties={
+                            'asset_kpi': openapi.Schema(type=openapi.TYPE_INTEGER),
+                            'value': openapi.Schema(type=openapi.TYPE_STRING),
+                        }
+                    ),
+                    description="Row form: one object per evaluation."
+                ),
+                'asset_kpi': openapi.Schema(
+                    type=openapi.TYPE_ARRAY, items=openapi.Schema(type=openapi.TYPE_INTEGER),
+                    description="Columnar form: Asset-KPI IDs, aligned with 'value'."
+                ),
+                'value': openapi.Schema(
+                    type=openapi.TYPE_ARRAY, items=openapi.Schema(type=openapi.TYPE_STRING),
+                    description="Columnar form: input values, aligned with 'asset_kpi'."
+                ),
+            }
+        ),
+        responses={200: BATCH_RESULT_SCHEMA, 400: ERROR_SCHEMA}
+    )
+    @action(detail=False, methods=['post'], url_path='evaluate-batch')
+    def bulk_evaluate(self, request):
+        """
+        Custom action to evaluate values across many Asset-KPI relationships.
+        - **Parameters**:
+          - `items` (array) of `{asset_kpi, value}`, or the columnar `asset_kpi` and `value` arrays.
+        - **Returns**:
+          - Columnar `results` and `errors` arrays aligned with the input.
+        """
+        try:
+            asset_kpi_ids, values = parse_batch_items(request.data)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        if len(values) > self.max_batch_size:
+            return Response({"error": f"At most {self.max_batch_size} values can be evaluated per request."},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        # One query for every referenced AssetKPI, one compile per distinct expression
+        interpreter = CustomInterpreter()
+        expressions = dict(
+            self.get_queryset().filter(pk__in=set(asset_kpi_ids)).values_list('pk', 'kpi__expression')
+        )
+        results = [None] * len(values)
+        errors = [None] * len(values)
+        positions = {}
+        for position, asset_kpi_id in enumerate(asset_kpi_ids):
+            positions.setdefault(asset_kpi_id, []).append(position)
+
+        for asset_kpi_id, indexes in positions.items():
+            if asset_kpi_id not in expressions:
+                for i in indexes:
+                    errors[i] = f"AssetKPI {asset_kpi_id} not found."
+                continue
+            try:
+                compiled = interpreter.get_compiled(expressions[asset_kpi_id])
+            except ValueError as e:
+                for i in indexes:
+                    errors[i] = str(e)
+                continue
+            evaluated = evaluate_values(compiled, [values[i] for i in indexes])
+            for i, result, error in zip(indexes, evaluated["results"], evaluated["errors"]):
+                results[i] = result
+                errors[i] = error
+
+        return Response({"results": results, "errors": errors})
+
+
+class EvaluationLogViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    Viewset for reading evaluation results, filtered by asset, attribute and time window.
+
+    Rows moved to the columnar archive by `archive_evaluations` are merged
+    back into the results, so clients see one series whichever store holds it.
+    """
+    queryset = EvaluationLog.objects.all()
+    serializer_class = EvaluationLogSerializer
+    pagination_class = KeysetPagination
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action != 'list':
+            return queryset
+        asset_id, attribute_id, window_start, window_end = self.list_filters()
+        if asset_id:
+            queryset = queryset.filter(asset_id=asset_id)
+        if attribute_id:
+            queryset = queryset.filter(attribute_id=attribute_id)
+        if window_start is not None:
+            queryset = queryset.filter(timestamp__gte=window_start)
+        if window_end is not None:
+            queryset = queryset.filter(timestamp__lt=window_end)
+        return queryset
+
+    def list_filters(self):
+        """Returns the (asset_id, attribute_id, from, to) filters of a list request."""
+        params = self.request.query_params
+        return (
+            params.get('asset_id') or None,
+            params.get('attribute_id') or None,
+            parse_time_param(params, 'from'),
+            parse_time_param(params, 'to'),
+        )
+
+    def extra_rows(self, cursor, limit):
+        """Archived rows after `cursor` matching the list filters; merged into the page by the paginator."""
+        reader = ArchiveReader()
+        if not reader.has_segments():
+            return []
+        asset_id, attribute_id, window_start, window_end = self.list_filters()
+        return reader.read(asset_id, attribute_id, window_start, window_end, after=cursor, limit=limit).to_logs()
+
+    def get_object(self):
+        try:
+            return super().get_object()
+        except Http404:
+            pk = self.kwargs[self.lookup_url_kwarg or self.lookup_field]
+            reader = ArchiveReader()
+            row = reader.find(int(pk)) if pk.isdigit() and reader.has_segments() else None
+            if row is None:
+                raise
+            return row
+
+    @swagger_auto_schema(
+        operation_description=(
+            "Retrieve evaluation results ordered by timestamp, optionally filtered by asset ID, attribute ID "
+            "and a [from, to) time window. Archived results are included. Results are paginated with an opaque "
+            "cursor: follow the `next` link to fetch the following page."
+        ),
+        manual_parameters=[
+            openapi.Parameter('asset_id', openapi.IN_QUERY, type=openapi.TYPE_STRING, description="Asset ID."),
+            openapi.Parameter('attribute_id', openapi.IN_QUERY, type=openapi.TYPE_STRING,
+                              description="Output attribute ID, e.g. output_Temp."),
+            openapi.Parameter('from', openapi.IN_QUERY, type=openapi.TYPE_STRING, format=openapi.FORMAT_DATETIME,
+                              description="Inclusive start of the time window (ISO 8601)."),
+            openapi.Parameter('to', openapi.IN_QUERY, type=openapi.TYPE_STRING, format=openapi.FORMAT_DATETIME,
+                              description="Exclusive end of the time window (ISO 8601)."),
+            openapi.Parameter('cursor', openapi.IN_QUERY, type=openapi.TYPE_STRING,
+                              description="Pagination cursor taken from a previous `next` link."),
+            openapi.Parameter('page_size', openapi.IN_QUERY, type=openapi.TYPE_INTEGER,
+                              description="Number of results per page (max 1000)."),
+        ]
+    )
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+    @swagger_auto_schema(
+        operation_description="Retrieve a single evaluation result by its unique ID.",
+        responses={200: EvaluationLogSerializer, 404: 'Not Found'}
+    )
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+
+
+class EvaluationRollupViewSet(viewsets.GenericViewSet):
+    """
+    Viewset serving pre-aggregated min/max/avg/count series of evaluation results.
+    """
+    queryset = EvaluationRollup.objects.all()
+    serializer_class = EvaluationRollupSerializer
+    pagination_class = KeysetPagination
+    keyset_field = 'bucket_start'
+
+    def get_queryset(self):
+        params = self.request.query_params
+        missing = [name for name in ('asset_id', 'attribute_id') if not params.get(name)]
+        if missing:
+            raise ValidationError({name: "This query parameter is required." for name in missing})
+        resolution = params.get('resolution', EvaluationRollup.HOUR)
+        if resolution not in dict(EvaluationRollup.RESOLUTIONS):
+            raise ValidationError({'resolution': f"Must be one of: {', '.join(dict(EvaluationRollup.RESOLUTIONS))}."})
+
+        queryset = super().get_queryset().filter(
+            asset_id=params['asset_id'], attribute_id=params['attribute_id'], resolution=resolution
+        )
+        window_start = parse_time_param(params, 'from')
+        window_end = parse_time_param(params, 'to')
+        if window_start is not None:
+            queryset = queryset.filter(bucket_start__gte=window_start)
+        if window_end is not None:
+            queryset = queryset.filter(bucket_start__lt=window_end)
+        return queryset
+
+    @swagger_auto_schema(
+        operation_description=(
+            "Retrieve the time series of pre-aggregated evaluation results for one asset attribute, one bucket "
+            "per minute, hour or day, each with count, min, max and avg. Buckets are built by the "
+            "`build_rollups` command or by `process_messages --rollups`."
+        ),
+        manual_parameters=[
+            openapi.Parameter('asset_id', openapi.IN_QUERY, type=openapi.TYPE_STRING, required=True,
+                              description="Asset ID."),
+            openapi.Parameter('attribute_id', openapi.IN_QUERY, type=openapi.TYPE_STRING, required=True,
+                              description="Output attribute ID, e.g. output_Temp."),
+            openapi.Parameter('resolution', openapi.IN_QUERY, type=openapi.TYPE_STRING,
+                              enum=[value for value, _ in EvaluationRollup.RESOLUTIONS],
+                              description="Bucket size (default: hour)."),
+            openapi.Parameter('from', openapi.IN_QUERY, type=openapi.TYPE_STRING, format=openapi.FORMAT_DATETIME,
+                              description="Inclusive start of the time window (ISO 8601)."),
+            openapi.Parameter('to', openapi.IN_QUERY, type=openapi.TYPE_STRING, format=openapi.FORMAT_DATETIME,
+                              description="Exclusive end of the time window (ISO 8601)."),
+            openapi.Parameter('cursor', openapi.IN_QUERY, type=openapi.TYPE_STRING,
+                              description="Pagination cursor taken from a previous `next` link."),
+            openapi.Parameter('page_size', openapi.IN_QUERY, type=openapi.TYPE_INTEGER,
+                              description="Number of buckets per page (max 1000)."),
+        ]
+    )
+    def list(self, request, *args, **kwargs):
+        page = self.paginate_queryset(self.get_queryset())
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
+
+class RetentionPolicyViewSet(viewsets.ModelViewSet):
+    """
+    Viewset for managing how long evaluation results are kept, applied by the `purge_evaluations` command.
+    """
+    queryset = RetentionPolicy.objects.all()
+    serializer_class = RetentionPolicySerializer
+    pagination_class = IdKeysetPagination
+
+    @swagger_auto_schema(
+        operation_description="Retrieve a page of retention policies ordered by ID.",
+        manual_parameters=PAGE_PARAMETERS,
+        responses={200: RetentionPolicySerializer(many=True)}
+    )
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+    @swagger_auto_schema(
+        operation_description=(
+            "Create a retention policy for an asset ID and output attribute ID. A blank ID matches any value and "
+            "the most specific policy applies. Each period is a number of days: `raw_days` for raw evaluation "
+            "results (including archived ones) and `minute_days`, `hour_days`, `day_days` for the rollups. A "
+            "null period keeps that data forever."
+        ),
+        request_body=RetentionPolicySerializer,
+        responses={201: RetentionPolicySerializer}
+    )
+    def create(self, request, *args, **kwargs):
+        return super().create(request, *args, **kwargs)
+
+    @swagger_auto_schema(
+        operation_description="Retrieve a retention policy by its unique ID.",
+        responses={200: RetentionPolicySerializer, 404: 'Not Found'}
+    )
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+
+    @swagger_auto_schema(
+        operation_description="Update a retention policy by its unique ID.",
+        request_body=RetentionPolicySerializer,
+        responses={200: RetentionPolicySerializer, 404: 'Not Found'}
+    )
+    def update(self, request, *args, **kwargs):
+        return super().update(request, *args, **kwargs)
+
+    @swagger_auto_schema(
+        operation_description="Delete a retention policy by its unique ID.",
+        responses={204: 'No Content', 404: 'Not Found'}
+    )
+    def destroy(self, request, *args, **kwargs):
+        return super().destroy(request, *args, **kwargs)
+
+
+def parse_time_param(params, name):
+    """Parses an optional ISO 8601 query parameter, rejecting malformed values."""
+    value = params.get(name)
+    if not value:
+        return None
+    try:
+        parsed = parse_datetime(value)
+    except ValueError:
+        parsed = None
+    if parsed is None:
+        raise ValidationError({name: "Must be an ISO 8601 datetime."})
+    return parsed
+
+
+def evaluate_values(compiled, values):
+    """Evaluates a compiled expression for each value, collecting per-item errors."""
+    results = []
+    errors = []
+    for value in values:
+        try:
+            results.append(compiled.evaluate(value))
+            errors.append(None)
+        except ValueError as e:
+            results.append(None)
+            errors.append(str(e))
+    return {"results": results, "errors": errors}
+
+
+def check_bulk_body(data, max_size):
+    """Returns an error message if a bulk request body is not a list of at most `max_size` objects."""
+    if not isinstance(data, list) or not all(isinstance(row, dict) for row in data):
+        return "Request body must be a list of objects."
+    if len(data) > max_size:
+        return f"At most {max_size} rows can be sent per request."
+    return None
+
+def parse_batch_items(data):
+    """Normalizes a row-form or columnar batch body into aligned id and value lists."""
+    if not isinstance(data, dict):
+        raise ValueError("Request body must be a JSON object.")
+    if "items" in data:
+        items = data["items"]
+        if not isinstance(items, list) or not all(isinstance(item, dict) for item in items):
+            raise ValueError("'items' must be a list of objects.")
+        asset_kpi_ids = [item.get("asset_kpi") for item in items]
+        values = [item.get("value") for item in items]
+    else:
+        asset_kpi_ids = data.get("asset_kpi")
+        values = data.get("value")
+        if not isinstance(asset_kpi_ids, list) or not isinstance(values, list):
+            raise ValueError("Provide 'items', or 'asset_kpi' and 'value' lists.")
+        if len(asset_kpi_ids) != len(values):
+            raise ValueError("'asset_kpi' and 'value' must have the same length.")
+    if not all(isinstance(pk, int) and not isinstance(pk, bool) for pk in asset_kpi_ids):
+        raise ValueError("Every 'asset_kpi' must be an integer ID.")
+    return asset_kpi_ids, values
+
+
+def metrics(request):
+    """
+    Serves the metrics of the web process in the Prometheus text format. Pipeline
+    metrics live in the ingest processes; see `process_messages --metrics-port`.
+    """
+    return HttpResponse(registry.render(WEB_METRICS), content_type=CONTENT_TYPE)
@@ -4,3 +4,9 @@ from django.apps import AppConfig
 class KpiAppConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'kpi_app'
+
+    def ready(self):
+        # Register the signal handlers that keep the routing index in sync
+        from . import signals  # noqa: F401
+        # Register the system check that lists KPIs whose expression does not compile
+        from . import checks  # noqa: F401
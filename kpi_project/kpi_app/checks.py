@@ -0,0 +1,35 @@
+# kpi_app/checks.py
+
+from django.core.checks import Tags, Warning, register
+from django.db import DatabaseError
+
+from .core.interpreter import CustomInterpreter
+from .models import KPI
+
+# Only run when a database is selected (`migrate`, `check --database default`),
+# so plain startup checks never query the KPI table.
+
+@register(Tags.database)
+def check_kpi_expressions(app_configs, databases=None, **kwargs):
+    """Warns about stored KPIs whose expression no longer compiles."""
+    if not databases:
+        return []
+    interpreter = CustomInterpreter()
+    warnings = []
+    for database in databases:
+        try:
+            kpis = list(KPI.objects.using(database).only('id', 'name', 'expression').order_by('id'))
+        except DatabaseError:
+            # The KPI table does not exist yet, e.g. before the first migrate
+            continue
+        for kpi in kpis:
+            try:
+                interpreter.compile(kpi.expression)
+            except ValueError as e:
+                warnings.append(Warning(
+                    f"KPI {kpi.id} ({kpi.name}) has an expression that does not compile: {kpi.expression!r}",
+                    hint=f"{e}. Messages routed to it fail until the expression is fixed.",
+                    obj=kpi,
+                    id='kpi_app.W001',
+                ))
+    return warnings
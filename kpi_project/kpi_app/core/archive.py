@@ -0,0 +1,594 @@
+# kpi_app/archive.py
+
+"""
+Columnar archive for historical EvaluationLog rows.
+
+`Archiver` moves closed days of EvaluationLog into segment files, one per
+asset, output attribute and UTC day:
+
+    <EVALUATION_ARCHIVE_DIR>/<asset_id>/<attribute_id>/<YYYY-MM-DD>.seg
+
+Ids are percent-encoded, and a leading dot is encoded too, so no id can name
+a directory outside the archive or clash with `.index.jsonl`, the index of
+every segment kept next to them (see `ArchiveIndex`).
+
+A segment starts with a magic string, the length of a JSON header and the
+header itself, followed by one block per column:
+
+- `timestamp`: microseconds since the epoch, delta-encoded from a base value
+  in the header and stored in the narrowest integer type that fits;
+- `id`: the original EvaluationLog ids, delta-encoded the same way;
+- `result`: float64 results.
+
+The asset and attribute ids are stored once in the header instead of once
+per row. Blocks are either raw, and then read straight from a memory map, or
+compressed with zlib or lzma. The header also holds the row count, time and id
+bounds and the min/max/sum of the results, so aggregates over whole segments
+never touch their data.
+
+`ArchiveReader` answers range and aggregate queries over the segments with
+NumPy. NumPy is an optional dependency; it is only needed once segments exist.
+"""
+
+import json
+import lzma
+import mmap
+import os
+import struct
+import threading
+import zlib
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from urllib.parse import quote
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - exercised only without numpy installed
+    np = None
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models.functions import TruncDay
+
+from kpi_app.models.evaluation_log import EvaluationLog
+from kpi_app.models.evaluation_rollup import RollupWatermark
+
+MAGIC = b'KPISEG1\n'
+SEGMENT_SUFFIX = '.seg'
+INDEX_NAME = '.index.jsonl'
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+ONE_DAY = timedelta(days=1)
+
+# name: (compress, decompress); None stores raw blocks that are memory-mapped
+CODECS = {
+    'none': None,
+    'zlib': (zlib.compress, zlib.decompress),
+    'lzma': (lzma.compress, lzma.decompress),
+}
+
+def require_numpy():
+    if np is None:
+        raise ImportError("The evaluation archive requires numpy; install it with `pip install numpy`.")
+
+def to_micros(value):
+    """Converts a datetime to microseconds since the epoch; naive values are taken as UTC."""
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return (value - EPOCH) // timedelta(microseconds=1)
+
+def from_micros(value):
+    return EPOCH + timedelta(microseconds=int(value))
+
+def day_start(value):
+    """Returns the start of the UTC day containing `value`."""
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    value = value.astimezone(timezone.utc)
+    return value.replace(hour=0, minute=0, second=0, microsecond=0)
+
+def archive_root():
+    return Path(getattr(settings, 'EVALUATION_ARCHIVE_DIR', settings.BASE_DIR / 'archive'))
+
+def path_component(value):
+    """Encodes an asset or attribute id as one directory name that cannot be `.`, `..` or hidden."""
+    name = quote(value, safe='')
+    if not name:
+        raise ValueError("Archived asset and attribute ids must not be empty.")
+    if name.startswith('.'):
+        name = '%2E' + name[1:]
+    return name
+
+def _narrow(values):
+    """Returns the smallest signed integer dtype that holds every value."""
+    if not len(values):
+        return '<i8'
+    low, high = int(values.min()), int(values.max())
+    for dtype in ('<i2', '<i4'):
+        info = np.iinfo(dtype)
+        if info.min <= low and high <= info.max:
+            return dtype
+    return '<i8'
+
+def _deltas(values):
+    deltas = np.diff(values, prepend=values[:1])
+    return deltas.astype(_narrow(deltas))
+
+def write_segment(path, asset_id, attribute_id, ids, timestamps, results, codec='none'):
+    """
+    Writes one segment from aligned id, timestamp (microseconds) and result
+    arrays and returns its header. Rows are sorted by (timestamp, id) first.
+    The file is written next to `path`, fsynced and renamed into place, so
+    readers never see a partial segment.
+    """
+    require_numpy()
+    if codec not in CODECS:
+        raise ValueError(f"Unknown codec {codec!r}; expected one of: {', '.join(CODECS)}.")
+    ids = np.asarray(ids, dtype=np.int64)
+    timestamps = np.asarray(timestamps, dtype=np.int64)
+    results = np.asarray(results, dtype=np.float64)
+    if not len(ids):
+        raise ValueError("A segment needs at least one row.")
+    order = np.lexsort((ids, timestamps))
+    ids, timestamps, results = ids[order], timestamps[order], results[order]
+
+    blocks = []
+    columns = {}
+    offset = 0
+    for name, array in (('timestamp', _deltas(timestamps)), ('id', _deltas(ids)), ('result', results)):
+        data = array.tobytes()
+        if CODECS[codec] is not None:
+            data = CODECS[codec][0](data)
+        columns[name] = {'dtype': array.dtype.str, 'offset': offset, 'length': len(data)}
+        # Keep raw blocks 8-byte aligned so they can be viewed in place
+        padding = -len(data) % 8
+        blocks.append(data + b'\0' * padding)
+        offset += len(data) + padding
+
+    header = {
+        'version': 1,
+        'asset_id': asset_id,
+        'attribute_id': attribute_id,
+        'count': len(ids),
+        'codec': codec,
+        'timestamp_base': int(timestamps[0]),
+        'id_base': int(ids[0]),
+        'start': int(timestamps[0]),
+        'end': int(timestamps[-1]),
+        'min_id': int(ids.min()),
+        'max_id': int(ids.max()),
+        'min': float(results.min()),
+        'max': float(results.max()),
+        'sum': float(results.sum()),
+        'columns': columns,
+    }
+    encoded = json.dumps(header).encode('utf-8')
+    prefix = MAGIC + struct.pack('<I', len(encoded)) + encoded
+    prefix += b'\0' * (-len(prefix) % 8)
+
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temporary = path.with_name(path.name + '.tmp')
+    with open(temporary, 'wb') as file:
+        file.write(prefix)
+        for block in blocks:
+            file.write(block)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temporary, path)
+    return header
+
+class Segment:
+    """
+    A memory-mapped segment file. Column accessors return arrays that do not
+    reference the map, so the segment can be closed while they are in use.
+    """
+
+    def __init__(self, path):
+        require_numpy()
+        self.path = Path(path)
+        with open(self.path, 'rb') as file:
+            self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._map[:len(MAGIC)] != MAGIC:
+            self._map.close()
+            raise ValueError(f"{self.path} is not an evaluation archive segment.")
+        (length,) = struct.unpack_from('<I', self._map, len(MAGIC))
+        start = len(MAGIC) + 4
+        self.header = json.loads(self._map[start:start + length])
+        self._data_start = start + length + (-(start + length) % 8)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self._map.close()
+
+    def __len__(self):
+        return self.header['count']
+
+    def _column(self, name):
+        spec = self.header['columns'][name]
+        offset = self._data_start + spec['offset']
+        codec = CODECS[self.header['codec']]
+        if codec is None:
+            view = np.frombuffer(self._map, dtype=spec['dtype'], count=len(self), offset=offset)
+            # Decoding or copying here keeps no view of the map alive
+            return view.astype(np.int64) if name != 'result' else view.copy()
+        array = np.frombuffer(codec[1](self._map[offset:offset + spec['length']]), dtype=spec['dtype'])
+        return array.astype(np.int64) if name != 'result' else array
+
+    def timestamps(self):
+        """Row timestamps in microseconds since the epoch, ascending."""
+        return self.header['timestamp_base'] + np.cumsum(self._column('timestamp'))
+
+    def ids(self):
+        return self.header['id_base'] + np.cumsum(self._column('id'))
+
+    def results(self):
+        return self._column('result')
+
+    def covered_by(self, start=None, end=None):
+        """Whether every row of the segment lies in the [start, end) microsecond range."""
+        return ((start is None or self.header['start'] >= start)
+                and (end is None or self.header['end'] < end))
+
+    def read(self, start=None, end=None):
+        """Returns the (ids, timestamps, results) arrays of the rows in the [start, end) range."""
+        timestamps = self.timestamps()
+        low = 0 if start is None else np.searchsorted(timestamps, start, side='left')
+        high = len(timestamps) if end is None else np.searchsorted(timestamps, end, side='left')
+        return self.ids()[low:high], timestamps[low:high], self.results()[low:high]
+
+class ArchiveBlock:
+    """
+    Archived rows in (timestamp, id) order. Rows from several series are
+    dictionary-encoded: `series` lists the (asset_id, attribute_id) pairs and
+    `codes[i]` indexes it for row `i`.
+    """
+
+    def __init__(self, series, codes, ids, timestamps, results):
+        self.series = series
+        self.codes = codes
+        self.ids = ids
+        self.timestamps = timestamps
+        self.results = results
+
+    @classmethod
+    def empty(cls):
+        require_numpy()
+        return cls([], np.empty(0, np.int64), np.empty(0, np.int64), np.empty(0, np.int64), np.empty(0))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def to_logs(self):
+        """Returns the rows as unsaved EvaluationLog instances carrying their original ids."""
+        return [
+            EvaluationLog(id=pk, asset_id=self.series[code][0], attribute_id=self.series[code][1],
+                          timestamp=from_micros(timestamp), result=result)
+            for code, pk, timestamp, result in zip(
+                self.codes.tolist(), self.ids.tolist(), self.timestamps.tolist(), self.results.tolist()
+            )
+        ]
+
+def _parse_day(name):
+    return datetime.strptime(name, '%Y-%m-%d').replace(tzinfo=timezone.utc)
+
+class ArchiveIndex:
+    """
+    Append-only log of the segments under an archive root: one JSON line per
+    segment written, with its series, day, row count and time and id bounds,
+    and one per segment deleted. Each process keeps the log in memory and only
+    reads the lines appended since it last looked, so queries never walk the
+    directory tree and id lookups only open segments whose id range holds the
+    id. An archive without an index is indexed from its segment headers the
+    first time it is read.
+    """
+
+    # root: (inode, bytes read, {relative path: entry})
+    _cache = {}
+    _lock = threading.Lock()
+
+    def __init__(self, root):
+        self.root = Path(root)
+        self.path = self.root / INDEX_NAME
+
+    def entries(self):
+        """Returns {relative path: entry} for the indexed segments; entries hold the day as a datetime."""
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            if not self.root.is_dir():
+                return {}
+            self.rebuild(replace=False)
+            stat = os.stat(self.path)
+        with self._lock:
+            inode, offset, entries = self._cache.get(self.path, (None, 0, {}))
+            if inode != stat.st_ino or stat.st_size < offset:
+                inode, offset, entries = stat.st_ino, 0, {}
+            if stat.st_size > offset:
+                with open(self.path, 'rb') as file:
+                    file.seek(offset)
+                    data = file.read()
+                # A line still being appended is picked up next time
+                complete = data.rfind(b'\n') + 1
+                # Copied, so callers iterating the previous dict are not disturbed
+                entries = dict(entries)
+                for line in data[:complete].splitlines():
+                    record = json.loads(line)
+                    if record.get('deleted'):
+                        entries.pop(record['path'], None)
+                    else:
+                        record['day'] = _parse_day(record['day'])
+                        entries[record['path']] = record
+                offset += complete
+                self._cache[self.path] = (inode, offset, entries)
+            return entries
+
+    def add(self, path, header):
+        """Records the segment written to `path` with `header`, as returned by `write_segment`."""
+        # Index an archive from before the index first, or its older segments would be lost from view
+        self.entries()
+        self._append([self._entry(path, header)])
+
+    def remove(self, path):
+        """Records that the segment at `path` is being deleted."""
+        self.entries()
+        self._append([{'path': self._relative(path), 'deleted': True}])
+
+    def rebuild(self, replace=True):
+        """
+        Indexes every segment from its header, e.g. after segments were copied
+        in by hand, and returns how many there are. With `replace=False` an
+        index created meanwhile by another process is kept instead.
+        """
+        self.root.mkdir(parents=True, exist_ok=True)
+        lines = []
+        for asset_dir in sorted(self.root.iterdir()):
+            if not asset_dir.is_dir():
+                continue
+            for attribute_dir in sorted(asset_dir.iterdir()):
+                if not attribute_dir.is_dir():
+                    continue
+                for path in sorted(attribute_dir.glob('*' + SEGMENT_SUFFIX)):
+                    try:
+                        _parse_day(path.stem)
+                        with Segment(path) as segment:
+                            lines.append(self._entry(path, segment.header))
+                    except ValueError:
+                        continue
+        temporary = self.path.with_name(f"{INDEX_NAME}.{os.getpid()}.tmp")
+        with open(temporary, 'w', encoding='utf-8') as file:
+            file.write(''.join(json.dumps(line) + '\n' for line in lines))
+            file.flush()
+            os.fsync(file.fileno())
+        if replace:
+            os.replace(temporary, self.path)
+        else:
+            try:
+                os.link(temporary, self.path)
+            except FileExistsError:
+                pass
+            os.remove(temporary)
+        return len(lines)
+
+    def _relative(self, path):
+        return Path(path).relative_to(self.root).as_posix()
+
+    def _entry(self, path, header):
+        return {
+            'path': self._relative(path),
+            'asset_id': header['asset_id'],
+            'attribute_id': header['attribute_id'],
+            'day': Path(path).stem,
+            **{key: header[key] for key in ('count', 'start', 'end', 'min_id', 'max_id')},
+        }
+
+    def _append(self, lines):
+        self.root.mkdir(parents=True, exist_ok=True)
+        with open(self.path, 'a', encoding='utf-8') as file:
+            file.write(''.join(json.dumps(line) + '\n' for line in lines))
+            file.flush()
+            os.fsync(file.fileno())
+
+class ArchiveReader:
+    """
+    Range and aggregate queries over the segments under `root`. Asset,
+    attribute and time filters are matched against the index, so a query only
+    maps the segments it needs.
+    """
+
+    def __init__(self, root=None):
+        self.root = Path(root) if root is not None else archive_root()
+        self.index = ArchiveIndex(self.root)
+
+    def segment_path(self, asset_id, attribute_id, day):
+        return self.root / path_component(asset_id) / path_component(attribute_id) / f"{day:%Y-%m-%d}{SEGMENT_SUFFIX}"
+
+    def segment_paths(self, asset_id=None, attribute_id=None, start=None, end=None):
+        """
+        Returns (day, asset_id, attribute_id, path) for the segments that may
+        hold rows in [start, end), ordered by day and series.
+        """
+        first_day = day_start(start) if start is not None else None
+        matches = []
+        for entry in self.index.entries().values():
+            if (asset_id is not None and entry['asset_id'] != asset_id) or (
+                    attribute_id is not None and entry['attribute_id'] != attribute_id):
+                continue
+            day = entry['day']
+            if (first_day is not None and day < first_day) or (end is not None and day >= end):
+                continue
+            matches.append((day, entry['asset_id'], entry['attribute_id'], self.root / entry['path']))
+        matches.sort()
+        return matches
+
+    def read(self, asset_id=None, attribute_id=None, start=None, end=None, after=None, limit=None):
+        """
+        Returns the archived rows in [start, end) as an ArchiveBlock ordered by
+        (timestamp, id). `after` is a (timestamp, id) keyset cursor. With
+        `limit`, days are read in order and reading stops as soon as a day
+        completes the page.
+        """
+        require_numpy()
+        start_us = to_micros(start) if start is not None else None
+        end_us = to_micros(end) if end is not None else None
+        if after is not None:
+            after_us = to_micros(after[0])
+            start_us = after_us if start_us is None else max(start_us, after_us)
+
+        days = {}
+        for day, asset, attribute, path in self.segment_paths(asset_id, attribute_id, start, end):
+            if start_us is not None and day + ONE_DAY <= from_micros(start_us):
+                continue
+            days.setdefault(day, []).append((asset, attribute, path))
+
+        series, codes, ids, timestamps, results = [], [], [], [], []
+        found = 0
+        for day in sorted(days):
+            for asset, attribute, path in days[day]:
+                with Segment(path) as segment:
+                    segment_ids, segment_timestamps, segment_results = segment.read(start_us, end_us)
+                if after is not None:
+                    keep = (segment_timestamps > after_us) | (
+                        (segment_timestamps == after_us) & (segment_ids > after[1]))
+                    segment_ids = segment_ids[keep]
+                    segment_timestamps = segment_timestamps[keep]
+                    segment_results = segment_results[keep]
+                if not len(segment_ids):
+                    continue
+                codes.append(np.full(len(segment_ids), len(series), dtype=np.int64))
+                series.append((asset, attribute))
+                ids.append(segment_ids)
+                timestamps.append(segment_timestamps)
+                results.append(segment_results)
+                found += len(segment_ids)
+            if limit is not None and found >= limit:
+                break
+
+        if not ids:
+            return ArchiveBlock.empty()
+        ids = np.concatenate(ids)
+        timestamps = np.concatenate(timestamps)
+        order = np.lexsort((ids, timestamps))[:limit]
+        return ArchiveBlock(series, np.concatenate(codes)[order], ids[order], timestamps[order],
+                            np.concatenate(results)[order])
+
+    def aggregate(self, asset_id=None, attribute_id=None, start=None, end=None):
+        """
+        Returns count, sum, min, max and avg of the archived results in
+        [start, end). Segments entirely inside the range are summarized from
+        their headers without reading their data.
+        """
+        require_numpy()
+        start_us = to_micros(start) if start is not None else None
+        end_us = to_micros(end) if end is not None else None
+        count, total, low, high = 0, 0.0, None, None
+        for _, _, _, path in self.segment_paths(asset_id, attribute_id, start, end):
+            with Segment(path) as segment:
+                if segment.covered_by(start_us, end_us):
+                    header = segment.header
+                    part = (header['count'], header['sum'], header['min'], header['max'])
+                else:
+                    _, _, results = segment.read(start_us, end_us)
+                    if not len(results):
+                        continue
+                    part = (len(results), float(results.sum()), float(results.min()), float(results.max()))
+            count += part[0]
+            total += part[1]
+            low = part[2] if low is None else min(low, part[2])
+            high = part[3] if high is None else max(high, part[3])
+        return {'count': count, 'sum': total, 'min': low, 'max': high, 'avg': total / count if count else None}
+
+    def find(self, pk):
+        """Returns the archived row with EvaluationLog id `pk` as an unsaved instance, or None."""
+        for entry in self.index.entries().values():
+            if not entry['min_id'] <= pk <= entry['max_id']:
+                continue
+            asset, attribute = entry['asset_id'], entry['attribute_id']
+            with Segment(self.root / entry['path']) as segment:
+                ids = segment.ids()
+                matches = np.flatnonzero(ids == pk)
+                if len(matches):
+                    position = matches[0]
+                    return EvaluationLog(id=pk, asset_id=asset, attribute_id=attribute,
+                                         timestamp=from_micros(segment.timestamps()[position]),
+                                         result=float(segment.results()[position]))
+        return None
+
+    def has_segments(self):
+        return bool(self.index.entries())
+
+class Archiver:
+    """
+    Moves EvaluationLog rows of closed UTC days into the archive.
+
+    Each (asset, attribute, day) is written as one segment, which is merged
+    with the existing segment for that day if there is one, and only then are
+    its rows deleted. A run interrupted between the two steps is completed by
+    the next one, which skips rows the segment already holds.
+    """
+
+    delete_batch_size = 500
+
+    def __init__(self, root=None, codec='none'):
+        if codec not in CODECS:
+            raise ValueError(f"Unknown codec {codec!r}; expected one of: {', '.join(CODECS)}.")
+        self.reader = ArchiveReader(root)
+        self.codec = codec
+
+    def archive(self, before):
+        """
+        Archives every row older than the start of the UTC day containing
+        `before`. Returns (rows archived, segments written).
+        """
+        require_numpy()
+        cutoff = day_start(before)
+        if RollupWatermark.objects.exists():
+            # Rollups are built from EvaluationLog; fold pending rows in before they leave the table
+            from .rollups import RollupBuilder
+            RollupBuilder().build()
+
+        closed = EvaluationLog.objects.filter(timestamp__lt=cutoff)
+        days = (
+            closed.annotate(day=TruncDay('timestamp', tzinfo=timezone.utc))
+            .values_list('asset_id', 'attribute_id', 'day').distinct().order_by('asset_id', 'attribute_id', 'day')
+        )
+        rows = segments = 0
+        for asset_id, attribute_id, day in list(days):
+            rows += self.archive_day(asset_id, attribute_id, day)
+            segments += 1
+        return rows, segments
+
+    def archive_day(self, asset_id, attribute_id, day):
+        """Moves one asset attribute's rows for one day into its segment; returns the number of rows moved."""
+        rows = list(
+            EvaluationLog.objects.filter(
+                asset_id=asset_id, attribute_id=attribute_id, timestamp__gte=day, timestamp__lt=day + ONE_DAY,
+            ).order_by('timestamp', 'id').values_list('id', 'timestamp', 'result')
+        )
+        if not rows:
+            return 0
+        ids = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+        timestamps = np.fromiter((to_micros(row[1]) for row in rows), dtype=np.int64, count=len(rows))
+        results = np.fromiter((row[2] for row in rows), dtype=np.float64, count=len(rows))
+
+        path = self.reader.segment_path(asset_id, attribute_id, day)
+        if path.exists():
+            with Segment(path) as segment:
+                archived_ids, archived_timestamps, archived_results = segment.read()
+            new = ~np.isin(ids, archived_ids)
+            ids = np.concatenate([archived_ids, ids[new]])
+            timestamps = np.concatenate([archived_timestamps, timestamps[new]])
+            results = np.concatenate([archived_results, results[new]])
+        header = write_segment(path, asset_id, attribute_id, ids, timestamps, results, codec=self.codec)
+        # Rows only leave the table once readers can find their segment
+        self.reader.index.add(path, header)
+
+        moved = [row[0] for row in rows]
+        with transaction.atomic():
+            for i in range(0, len(moved), self.delete_batch_size):
+                EvaluationLog.objects.filter(id__in=moved[i:i + self.delete_batch_size]).delete()
+        return len(moved)
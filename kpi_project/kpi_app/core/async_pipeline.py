@@ -0,0 +1,130 @@
+# kpi_app/async_pipeline.py
+
+"""
+Asyncio ingest pipeline with concurrent read, evaluate and write stages.
+
+    source --> [messages queue] --> N evaluators --> [rows queue] --> writer --> sink
+
+Both queues are bounded, so a slow sink pushes back on the evaluators and the
+reader instead of buffering without limit, while a slow read or a slow INSERT
+no longer stalls the other stages.
+"""
+
+import asyncio
+from time import perf_counter
+
+from asgiref.sync import sync_to_async
+
+from kpi_app.models.dead_letter import DeadLetter
+
+from .metrics import QUEUE_DEPTH, SINK_WRITE, STAGE_SECONDS
+from .pipeline import FAILED, PROCESSED
+
+# Marks the end of a queue's stream
+_DONE = object()
+
+class AsyncPipeline:
+    """Runs a MessageProcessor's evaluation and its sink writes as overlapping asyncio stages."""
+
+    def __init__(self, processor, evaluators=4, queue_size=1000, write_batch_size=500, pace=None,
+                 idle_flush_interval=1.0):
+        if evaluators < 1:
+            raise ValueError("evaluators must be at least 1")
+        self.processor = processor
+        self.evaluators = evaluators
+        self.queue_size = queue_size
+        self.write_batch_size = write_batch_size
+        self.pace = pace
+        self.idle_flush_interval = idle_flush_interval
+
+    async def run(self, source):
+        """Processes every message from `source` and returns the processor's report."""
+        messages = asyncio.Queue(maxsize=self.queue_size)
+        rows = asyncio.Queue(maxsize=self.queue_size)
+
+        QUEUE_DEPTH.track(messages.qsize, 'messages')
+        QUEUE_DEPTH.track(rows.qsize, 'rows')
+        evaluators = [asyncio.create_task(self.evaluate(messages, rows)) for _ in range(self.evaluators)]
+        writer = asyncio.create_task(self.write(rows))
+        try:
+            await self.read(source, messages)
+            await asyncio.gather(*evaluators)
+            await rows.put(_DONE)
+            await writer
+        except BaseException:
+            for task in evaluators + [writer]:
+                task.cancel()
+            raise
+        finally:
+            QUEUE_DEPTH.untrack('messages')
+            QUEUE_DEPTH.untrack('rows')
+            await sync_to_async(self.processor.close)()
+        return self.processor.report()
+
+    async def read(self, source, messages):
+        async for message in source.aread_data():
+            if self.pace is not None:
+                await self.pace(message)
+            await messages.put(message)
+        for _ in range(self.evaluators):
+            await messages.put(_DONE)
+
+    async def evaluate(self, messages, rows):
+        processor = self.processor
+        while True:
+            message = await messages.get()
+            if message is _DONE:
+                return
+            status, results = processor.evaluate(message)
+            if results:
+                # One item per message; the writer records its status once the rows are written
+                await rows.put((message, results))
+            else:
+                processor.record(status)
+            # Let the other stages run between CPU-bound evaluations
+            await asyncio.sleep(0)
+
+    async def write(self, rows):
+        processor = self.processor
+        done = False
+        while not done:
+            try:
+                item = await asyncio.wait_for(rows.get(), timeout=self.idle_flush_interval)
+            except asyncio.TimeoutError:
+                # Quiet stream: give buffered sinks a chance to write what they hold
+                await sync_to_async(processor.flush_if_due)()
+                await sync_to_async(processor.routing.refresh_if_due)()
+                continue
+            messages = [item]
+            size = len(item[1]) if item is not _DONE else 0
+            # Take whatever else is already queued, up to one batch of rows
+            while size < self.write_batch_size and not rows.empty() and messages[-1] is not _DONE:
+                item = rows.get_nowait()
+                messages.append(item)
+                size += len(item[1]) if item is not _DONE else 0
+            if messages[-1] is _DONE:
+                messages.pop()
+                done = True
+            batch = [row for _, results in messages for row in results]
+            if not batch:
+                continue
+            started = perf_counter()
+            sources = [message for message, results in messages for _ in results]
+            failures = await processor.data_sink.awrite_many(batch, sources)
+            STAGE_SECONDS.observe(perf_counter() - started, SINK_WRITE)
+            if failures:
+                owners = {id(row): message for message, results in messages for row in results}
+                for row, error in failures:
+                    message = owners[id(row)]
+                    processor.fail(error, row[0], message.get('attribute_id'), message, DeadLetter.WRITE, row[1])
+            rejected = processor.record_rejected()
+            if processor.dead_letters is not None:
+                await sync_to_async(processor.dead_letters.flush_if_due)()
+            # The evaluators keep routing with the old index until the reload swaps it in
+            await sync_to_async(processor.routing.refresh_if_due)()
+            failed = {id(row) for row, _ in failures} | {id(row) for row, _, _ in rejected}
+            for _, results in messages:
+                if failed and all(id(row) in failed for row in results):
+                    processor.record(FAILED)
+                else:
+                    processor.record(PROCESSED)
@@ -0,0 +1,408 @@
+# kpi_app/benchmark.py
+
+"""
+Synthetic workloads and stage benchmarks for the ingest pipeline.
+
+A `Workload` describes a message stream (asset and attribute cardinality,
+value distribution, share of regex KPIs, malformed lines) and can both write
+it as JSONL in the `process_messages` format and create the matching KPIs,
+assets and links. `run_benchmarks` then measures each stage on its own and
+the whole ingest path, and returns a JSON-serializable report.
+"""
+
+import contextlib
+import json
+import logging
+import os
+import platform
+import random
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+ARITHMETIC_EXPRESSIONS = [
+    "(ATTR - 32) * 5 / 9",
+    "(ATTR - 32) * 5 / 9 + 273.15",
+    "ATTR * 2 - 1",
+    "ATTR / 10 + 1",
+]
+REGEX_EXPRESSION = "Regex(ATTR, '[A-Z]{2}\\d{3}')"
+DISTRIBUTIONS = ('uniform', 'normal', 'exponential')
+STAGES = ('decode', 'interpreter', 'routing', 'sink', 'end_to_end')
+BENCH_PREFIX = "BENCH"
+
+class Workload:
+    """Parameters of a synthetic message stream; the same seed always yields the same stream."""
+
+    def __init__(self, messages=100000, assets=100, attributes=5, kpis_per_attribute=1, regex_ratio=0.2,
+                 malformed_ratio=0.001, distribution='uniform', seed=0):
+        if distribution not in DISTRIBUTIONS:
+            raise ValueError(f"distribution must be one of {', '.join(DISTRIBUTIONS)}")
+        if not 0 <= regex_ratio <= 1 or not 0 <= malformed_ratio <= 1:
+            raise ValueError("ratios must be between 0 and 1")
+        if min(messages, assets, attributes, kpis_per_attribute) < 1:
+            raise ValueError("messages, assets, attributes and kpis_per_attribute must be at least 1")
+        self.messages = messages
+        self.assets = assets
+        self.attributes = attributes
+        self.kpis_per_attribute = kpis_per_attribute
+        self.regex_ratio = regex_ratio
+        self.malformed_ratio = malformed_ratio
+        self.distribution = distribution
+        self.seed = seed
+
+    def as_dict(self):
+        return dict(vars(self))
+
+    def asset_id(self, index):
+        return f"{BENCH_PREFIX}{index:06d}"
+
+    def attribute_id(self, index):
+        return f"attr{index}"
+
+    def is_regex(self, attribute_index):
+        """The first `regex_ratio` share of the attributes are matched by a regex KPI."""
+        return attribute_index < round(self.attributes * self.regex_ratio)
+
+    def expressions(self, attribute_index):
+        """Returns the expressions of the KPIs linked to an attribute."""
+        if self.is_regex(attribute_index):
+            return [REGEX_EXPRESSION]
+        count = min(self.kpis_per_attribute, len(ARITHMETIC_EXPRESSIONS))
+        return ARITHMETIC_EXPRESSIONS[:count]
+
+    def lines(self):
+        """Yields the stream as JSONL lines, malformed ones included."""
+        rng = random.Random(self.seed)
+        start = datetime(2024, 10, 31, tzinfo=timezone.utc)
+        for i in range(self.messages):
+            if rng.random() < self.malformed_ratio:
+                yield '{"asset_id": "BENCH000000", "value": \n'
+                continue
+            attribute = rng.randrange(self.attributes)
+            message = {
+                "asset_id": self.asset_id(rng.randrange(self.assets)),
+                "attribute_id": self.attribute_id(attribute),
+                "timestamp": (start + timedelta(seconds=i)).isoformat().replace('+00:00', 'Z'),
+                "value": self.regex_value(rng) if self.is_regex(attribute) else self.numeric_value(rng),
+            }
+            yield json.dumps(message) + '\n'
+
+    def numeric_value(self, rng):
+        if self.distribution == 'normal':
+            value = rng.gauss(50, 15)
+        elif self.distribution == 'exponential':
+            value = rng.expovariate(1 / 50)
+        else:
+            value = rng.uniform(0, 1000)
+        # Sent as a string, like the sample messages
+        return f"{value:.2f}"
+
+    def regex_value(self, rng):
+        if rng.random() < 0.5:
+            return f"{rng.choice('ABCDEFGH')}{rng.choice('ABCDEFGH')}{rng.randrange(1000):03d}"
+        return f"x{rng.randrange(1000)}"
+
+    def write(self, path):
+        """Writes the stream to `path` and returns the number of bytes written."""
+        with open(path, 'w', encoding='utf-8') as file:
+            for line in self.lines():
+                file.write(line)
+        return os.path.getsize(path)
+
+    def create_fixtures(self):
+        """
+        Creates the KPIs, assets and links the stream is routed to, reusing any
+        that already exist (e.g. left by an interrupted run). Returns the primary
+        keys of what it created, for `remove_fixtures`.
+        """
+        from kpi_app.models import KPI, Asset, AssetKPI
+
+        created = {'kpis': [], 'assets': [], 'links': []}
+        kpis = {}
+        for expression in ARITHMETIC_EXPRESSIONS + [REGEX_EXPRESSION]:
+            kpi = KPI.objects.filter(name=f"bench {expression}", expression=expression).order_by('pk').first()
+            if kpi is None:
+                kpi = KPI.objects.create(name=f"bench {expression}", expression=expression)
+                created['kpis'].append(kpi.pk)
+            kpis[expression] = kpi
+
+        asset_ids = [self.asset_id(i) for i in range(self.assets)]
+        bench_assets = Asset.objects.filter(asset_id__startswith=BENCH_PREFIX)
+        existing = set(bench_assets.values_list('asset_id', flat=True))
+        Asset.objects.bulk_create(
+            [Asset(asset_id=asset_id, name=f"Bench asset {i}") for i, asset_id in enumerate(asset_ids)
+             if asset_id not in existing],
+            batch_size=1000, ignore_conflicts=True,
+        )
+        wanted = set(asset_ids)
+        assets = [asset for asset in bench_assets.order_by('asset_id') if asset.asset_id in wanted]
+        created['assets'] = [asset.pk for asset in assets if asset.asset_id not in existing]
+
+        existing_links = AssetKPI.objects.filter(asset__asset_id__startswith=BENCH_PREFIX)
+        linked = {(link.asset_id, link.kpi_id, link.attribute_id): link.pk for link in existing_links}
+        links = [
+            AssetKPI(asset=asset, kpi=kpis[expression], attribute_id=self.attribute_id(attribute))
+            for asset in assets
+            for attribute in range(self.attributes)
+            for expression in self.expressions(attribute)
+            if (asset.pk, kpis[expression].pk, self.attribute_id(attribute)) not in linked
+        ]
+        AssetKPI.assign_output_attribute_ids(links)
+        AssetKPI.objects.bulk_create(links, batch_size=1000)
+        old_links = set(linked.values())
+        created['links'] = [pk for pk in existing_links.values_list('pk', flat=True) if pk not in old_links]
+        return created
+
+    def remove_fixtures(self, created, since_id=0):
+        """
+        Deletes what `create_fixtures` created and the evaluation rows the
+        benchmark wrote for the workload's assets after row `since_id`.
+        """
+        from kpi_app.models import KPI, Asset, AssetKPI, EvaluationLog
+
+        EvaluationLog.objects.filter(id__gt=since_id, asset_id__startswith=BENCH_PREFIX).delete()
+        for model, key in ((AssetKPI, 'links'), (Asset, 'assets'), (KPI, 'kpis')):
+            pks = created[key]
+            for start in range(0, len(pks), 1000):
+                model.objects.filter(pk__in=pks[start:start + 1000]).delete()
+
+def add_workload_arguments(parser):
+    """Adds the Workload parameters to a management command's parser."""
+    parser.add_argument('--messages', type=int, default=100000, help="Number of lines to generate")
+    parser.add_argument('--assets', type=int, default=100, help="Number of distinct asset IDs")
+    parser.add_argument('--attributes', type=int, default=5, help="Number of distinct attribute IDs per asset")
+    parser.add_argument('--kpis-per-attribute', type=int, default=1,
+                        help=f"KPIs linked to each arithmetic attribute (at most {len(ARITHMETIC_EXPRESSIONS)})")
+    parser.add_argument('--regex-ratio', type=float, default=0.2,
+                        help="Share of attributes evaluated by a regex KPI instead of arithmetic ones")
+    parser.add_argument('--malformed-ratio', type=float, default=0.001, help="Share of lines that are not valid JSON")
+    parser.add_argument('--distribution', choices=DISTRIBUTIONS, default='uniform',
+                        help="Distribution of the numeric values")
+    parser.add_argument('--seed', type=int, default=0, help="Random seed; the same seed gives the same stream")
+
+def workload_from_options(options):
+    return Workload(
+        messages=options['messages'],
+        assets=options['assets'],
+        attributes=options['attributes'],
+        kpis_per_attribute=options['kpis_per_attribute'],
+        regex_ratio=options['regex_ratio'],
+        malformed_ratio=options['malformed_ratio'],
+        distribution=options['distribution'],
+        seed=options['seed'],
+    )
+
+def percentile(ordered, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    if not ordered:
+        return None
+    index = max(0, min(len(ordered) - 1, round(fraction * len(ordered)) - 1))
+    return ordered[index]
+
+def peak_rss_bytes():
+    """Peak resident set size of this process so far, or None where it cannot be read."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+def current_rss_bytes():
+    """Current resident set size of this process, or None where /proc is not available."""
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+class StageTimer:
+    """
+    Collects per-operation latencies of one stage and how much the resident
+    set grew while it ran. The peak RSS only ever grows over a run, so it is
+    reported once for the whole benchmark instead.
+    """
+
+    def __init__(self):
+        self.latencies = []
+        self.started = None
+        self.seconds = None
+        self.rss_before = None
+        self.rss_delta = None
+
+    def __enter__(self):
+        self.rss_before = current_rss_bytes()
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.seconds = time.perf_counter() - self.started
+        rss_after = current_rss_bytes()
+        if self.rss_before is not None and rss_after is not None:
+            self.rss_delta = rss_after - self.rss_before
+
+    def timed(self, function, *args):
+        start = time.perf_counter_ns()
+        result = function(*args)
+        self.latencies.append(time.perf_counter_ns() - start)
+        return result
+
+    def report(self, operations=None, **extra):
+        operations = len(self.latencies) if operations is None else operations
+        ordered = sorted(self.latencies)
+        report = {
+            'operations': operations,
+            'seconds': round(self.seconds, 6),
+            'throughput_per_sec': round(operations / self.seconds, 1) if self.seconds else None,
+            'latency_us': {
+                'p50': _micros(percentile(ordered, 0.50)),
+                'p99': _micros(percentile(ordered, 0.99)),
+                'max': _micros(ordered[-1] if ordered else None),
+            },
+            'rss_delta_bytes': self.rss_delta,
+        }
+        report.update(extra)
+        return report
+
+def _micros(nanoseconds):
+    return None if nanoseconds is None else round(nanoseconds / 1000, 3)
+
+def load_messages(path):
+    from .data_sources import MappedFileDataSource
+    messages = []
+    for batch in MappedFileDataSource(path).read_batches():
+        messages.extend(batch)
+    return messages
+
+@contextlib.contextmanager
+def _logging_disabled():
+    logging.disable(logging.CRITICAL)
+    try:
+        yield
+    finally:
+        logging.disable(logging.NOTSET)
+
+@contextlib.contextmanager
+def scratch_fixtures(workload):
+    """
+    Commits the workload's fixtures for the duration of the block, then deletes
+    them and every evaluation row written for them meanwhile.
+    """
+    from django.db import transaction
+    from django.db.models import Max
+    from kpi_app.models import EvaluationLog
+
+    since_id = EvaluationLog.objects.aggregate(last=Max('id'))['last'] or 0
+    with transaction.atomic():
+        created = workload.create_fixtures()
+    try:
+        yield
+    finally:
+        workload.remove_fixtures(created, since_id)
+
+def run_benchmarks(workload, path, stages=STAGES, batch_size=500):
+    """
+    Runs the selected stages over the workload file at `path` and returns the report.
+
+    The database stages write through `CopyDataSink` and commit every batch,
+    as ingest does, so their timings include the commit. Callers should run
+    this inside `scratch_fixtures` to remove the rows afterwards.
+    """
+    import django
+    from django.db import connection
+    from .data_sinks import CopyDataSink
+    from .data_sources import MappedFileDataSource
+    from .interpreter import CustomInterpreter, cache_info
+    from .pipeline import MessageProcessor
+    from .routing import RoutingIndex
+
+    report = {
+        'workload': workload.as_dict(),
+        'environment': {
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': connection.vendor,
+            'platform': platform.platform(),
+        },
+        'stages': {},
+    }
+    routing = RoutingIndex().load()
+    messages = load_messages(path) if set(stages) - {'decode'} else []
+    valid = [m for m in messages if isinstance(m, dict) and m.get('asset_id') and m.get('attribute_id')]
+
+    # Measure the pipeline, not the console: failures would otherwise be logged one by one
+    with _logging_disabled():
+        if 'decode' in stages:
+            source = MappedFileDataSource(path, batch_size=1024)
+            batches = source.read_batches()
+            decoded = 0
+            with StageTimer() as timer:
+                while True:
+                    batch = timer.timed(next, batches, None)
+                    if batch is None:
+                        break
+                    decoded += len(batch)
+            report['stages']['decode'] = timer.report(
+                operations=decoded, unit='message (latency per batch of 1024)', malformed=source.malformed,
+                bytes=os.path.getsize(path),
+            )
+
+        if 'interpreter' in stages:
+            interpreter = CustomInterpreter()
+            work = []
+            for message in valid:
+                for route in routing.lookup(message['asset_id'], message['attribute_id']):
+                    work.append((interpreter.get_compiled(route.expression), message['value']))
+            errors = 0
+            with StageTimer() as timer:
+                for compiled, value in work:
+                    try:
+                        timer.timed(compiled.evaluate, value)
+                    except ValueError:
+                        errors += 1
+            report['stages']['interpreter'] = timer.report(unit='evaluation', errors=errors,
+                                                           cache=cache_info())
+
+        if 'routing' in stages:
+            keys = [(m['asset_id'], m['attribute_id']) for m in valid]
+            with StageTimer() as timer:
+                for asset_id, attribute_id in keys:
+                    timer.timed(routing.fanout, asset_id, attribute_id)
+            report['stages']['routing'] = timer.report(unit='lookup', routes=len(routing))
+
+        if 'sink' in stages:
+            processor = MessageProcessor(routing, None)
+            rows = []
+            for message in valid:
+                rows.extend(processor.evaluate(message)[1])
+            sink = CopyDataSink(batch_size=batch_size, max_latency=float('inf'))
+            chunks = [rows[i:i + batch_size] for i in range(0, len(rows), batch_size)]
+            rejected = 0
+            with StageTimer() as timer:
+                for chunk in chunks:
+                    rejected += len(timer.timed(sink.write_many, chunk))
+                timer.timed(sink.close)
+            rejected += len(sink.take_rejected())
+            report['stages']['sink'] = timer.report(operations=len(rows),
+                                                    unit=f'row (latency per call of {batch_size})',
+                                                    rows_written=sink.rows_written, rejected=rejected)
+
+        if 'end_to_end' in stages:
+            sink = CopyDataSink(batch_size=batch_size)
+            processor = MessageProcessor(RoutingIndex().load(), sink)
+            source = MappedFileDataSource(path, batch_size=1024)
+            with StageTimer() as timer:
+                for batch in source.read_batches():
+                    for message in batch:
+                        timer.timed(processor.process, message)
+                sink.close()
+            report['stages']['end_to_end'] = timer.report(unit='message', malformed=source.malformed,
+                                                          **processor.report())
+
+    report['peak_rss_bytes'] = peak_rss_bytes()
+    return report
@@ -0,0 +1,277 @@
+# kpi_app/dead_letters.py
+
+"""
+Dead-letter stores for messages the pipeline could not turn into results.
+
+A line that is not JSON, a message with missing fields, an asset attribute
+without AssetKPI links, a KPI that fails to evaluate or a result the sink
+rejects is recorded with the raw message, an error class and the reason,
+instead of being logged and dropped.
+
+Entries are buffered and written in batches. `add()` only appends under a
+lock, so sources decoding in a worker thread and the asyncio pipeline may
+call it; the owner of the store writes them with `flush_if_due()` and
+`close()` from a thread where database access is allowed.
+
+`Replayer` re-runs stored messages once KPIs, assets or links have been
+fixed; see the `replay_dead_letters` command.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from pathlib import Path
+
+from django.db import transaction
+from django.utils import timezone
+
+from kpi_app.models.dead_letter import DeadLetter
+
+from .metrics import DEAD_LETTERS
+
+logger = logging.getLogger(__name__)
+
+# Error classes of problems that are not exceptions
+MALFORMED_JSON = 'MalformedJSON'
+INVALID_MESSAGE = 'InvalidMessage'
+MISSING_FIELDS = 'MissingFields'
+NO_ROUTE = 'NoRoute'
+INVALID_VALUE = 'InvalidValue'
+NO_RESULT = 'NoResult'
+
+def encode_message(message):
+    """Returns the message as stored: raw lines as text, decoded messages as JSON."""
+    if isinstance(message, bytes):
+        return message.decode('utf-8', 'replace')
+    if isinstance(message, str):
+        return message
+    try:
+        return json.dumps(message, ensure_ascii=False)
+    except (TypeError, ValueError):
+        return repr(message)
+
+class DeadLetterStore(ABC):
+    """
+    Buffers dead letters and writes them `batch_size` at a time, or once the
+    oldest has waited `max_latency` seconds. Subclasses implement `write_batch`.
+    Entries that fail to be written stay buffered for the next flush.
+    """
+
+    def __init__(self, batch_size=500, max_latency=1.0):
+        self.batch_size = batch_size
+        self.max_latency = max_latency
+        self.buffer = []
+        self.written = 0
+        self._lock = threading.Lock()
+        self._first_buffered_at = None
+
+    def add(self, message, error_class, reason='', stage=DeadLetter.EVALUATE, output_attribute_id=''):
+        """Records one message that could not be processed."""
+        entry = {
+            'message': encode_message(message),
+            'error_class': error_class,
+            'reason': str(reason),
+            'stage': stage,
+            'output_attribute_id': output_attribute_id or '',
+            'created_at': timezone.now(),
+        }
+        DEAD_LETTERS.inc(1, error_class)
+        with self._lock:
+            self.buffer.append(entry)
+            if self._first_buffered_at is None:
+                self._first_buffered_at = time.monotonic()
+
+    def add_malformed(self, line, error):
+        """Records an input line that could not be decoded."""
+        self.add(line, MALFORMED_JSON, error, DeadLetter.DECODE)
+
+    def pending(self):
+        return len(self.buffer)
+
+    def take(self):
+        """Empties the buffer and returns its entries."""
+        with self._lock:
+            batch, self.buffer = self.buffer, []
+            self._first_buffered_at = None
+        return batch
+
+    def flush_if_due(self):
+        """Writes the buffer if it holds a full batch or its oldest entry has waited `max_latency`."""
+        if len(self.buffer) >= self.batch_size or (
+                self._first_buffered_at is not None
+                and time.monotonic() - self._first_buffered_at >= self.max_latency):
+            try:
+                self.flush()
+            except Exception as e:
+                # Don't stop the pipeline over the dead letters; close() raises if they still can't be written
+                logger.warning("Writing dead letters failed, will retry: %s", e)
+
+    def flush(self):
+        first_buffered_at = self._first_buffered_at
+        batch = self.take()
+        if batch:
+            try:
+                self.write_batch(batch)
+            except Exception:
+                with self._lock:
+                    self.buffer[:0] = batch
+                    self._first_buffered_at = first_buffered_at
+                raise
+            self.written += len(batch)
+
+    def close(self):
+        self.flush()
+
+    @abstractmethod
+    def write_batch(self, batch):
+        """Writes a batch of entries built by `add`."""
+        pass
+
+class DatabaseDeadLetterStore(DeadLetterStore):
+    """Writes dead letters to the DeadLetter table with one bulk INSERT per batch."""
+
+    def write_batch(self, batch):
+        with transaction.atomic():
+            DeadLetter.objects.bulk_create([DeadLetter(**entry) for entry in batch], batch_size=self.batch_size)
+
+class FileDeadLetterStore(DeadLetterStore):
+    """Appends dead letters as JSON lines to an append-only file, fsynced on close."""
+
+    def __init__(self, path, batch_size=500, max_latency=1.0):
+        super().__init__(batch_size, max_latency)
+        self.path = Path(path)
+        self.file = None
+
+    def write_batch(self, batch):
+        if self.file is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self.file = open(self.path, 'a', encoding='utf-8')
+        self.file.write(''.join(encode_entry(entry) for entry in batch))
+        self.file.flush()
+
+    def close(self):
+        self.flush()
+        if self.file is not None:
+            os.fsync(self.file.fileno())
+            self.file.close()
+            self.file = None
+
+def encode_entry(entry):
+    entry = dict(entry, created_at=entry['created_at'].isoformat())
+    entry.setdefault('attempts', 0)
+    return json.dumps(entry, ensure_ascii=False) + '\n'
+
+def read_dead_letter_file(path):
+    """Returns the entries of a dead-letter file as dicts."""
+    entries = []
+    with open(path, 'r', encoding='utf-8') as file:
+        for line in file:
+            if line.strip():
+                entries.append(json.loads(line))
+    return entries
+
+def write_dead_letter_file(path, entries):
+    """Replaces a dead-letter file with `entries`, atomically."""
+    path = Path(path)
+    temporary = path.with_name(path.name + '.tmp')
+    with open(temporary, 'w', encoding='utf-8') as file:
+        for entry in entries:
+            file.write(json.dumps(entry, ensure_ascii=False) + '\n')
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temporary, path)
+
+def open_dead_letter_store(spec, batch_size=500, max_latency=1.0):
+    """Builds the store for a `--dead-letters` spec: `db`, `file:PATH` or `none`."""
+    scheme, _, target = spec.partition(':')
+    if scheme == 'none' and not target:
+        return None
+    if scheme == 'db' and not target:
+        return DatabaseDeadLetterStore(batch_size, max_latency)
+    if scheme == 'file' and target:
+        return FileDeadLetterStore(target, batch_size, max_latency)
+    raise ValueError(f"Unknown dead-letter store {spec!r}; expected db, file:PATH or none.")
+
+class _Collector(DeadLetterStore):
+    """Keeps the dead letters of a replay in memory for the Replayer to inspect."""
+
+    def flush_if_due(self):
+        pass
+
+    def write_batch(self, batch):
+        # The Replayer takes entries straight from the buffer; there is nowhere to write them
+        pass
+
+class Replayer:
+    """
+    Re-runs dead letters through a MessageProcessor and its sink.
+
+    A dead letter that names an output attribute only rewrites that KPI's
+    result, so the KPIs linked to the same attribute that succeeded the first
+    time are not written twice.
+
+    When the sink fails, rows it already flushed are committed and only the
+    entries whose rows were still buffered, or that the backend rejected,
+    count as failed. A sink whose `batch_size` and `max_latency` never
+    trigger a flush inside `write_many` writes each replayed chunk in one
+    flush.
+    """
+
+    def __init__(self, processor):
+        self.processor = processor
+        self.collector = _Collector()
+        processor.dead_letters = self.collector
+
+    def replay(self, entries):
+        """
+        Replays (key, message, output_attribute_id) entries. Returns the keys
+        that were written and a {key: (error_class, reason, stage)} dict of
+        those that failed again.
+        """
+        failed = {}
+        rows = []
+        for key, text, output_attribute_id in entries:
+            try:
+                message = json.loads(text)
+            except ValueError as e:
+                failed[key] = (MALFORMED_JSON, str(e), DeadLetter.DECODE)
+                continue
+            self.collector.take()
+            _, results = self.processor.evaluate(message)
+            letters = self.collector.take()
+            if output_attribute_id:
+                results = [row for row in results if row[1] == output_attribute_id]
+                letters = [letter for letter in letters if letter['output_attribute_id'] in ('', output_attribute_id)]
+            if letters:
+                letter = letters[0]
+                failed[key] = (letter['error_class'], letter['reason'], letter['stage'])
+            elif not results:
+                failed[key] = (NO_RESULT, "The message produced no results.", DeadLetter.EVALUATE)
+            else:
+                rows.extend((key, row) for row in results)
+
+        if rows:
+            sink = self.processor.data_sink
+            owners = {id(row): key for key, row in rows}
+            refused = set()
+            try:
+                for row, error in sink.write_many([row for _, row in rows], [key for key, _ in rows]):
+                    refused.add(id(row))
+                    failed.setdefault(owners[id(row)], (type(error).__name__, str(error), DeadLetter.WRITE))
+                # Dead letters are only removed once their rows are written
+                sink.flush()
+            except Exception as e:
+                # The sink keeps the rows it could not write at the end of its buffer, in order
+                accepted = [row for _, row in rows if id(row) not in refused]
+                unwritten = sink.discard()
+                for row in accepted[max(0, len(accepted) - unwritten):]:
+                    failed.setdefault(owners[id(row)], (type(e).__name__, str(e), DeadLetter.WRITE))
+            finally:
+                # Rows the backend rejected one by one; the rest of their chunk was written
+                for _, error, key in sink.take_rejected():
+                    failed.setdefault(key, (type(error).__name__, str(error), DeadLetter.WRITE))
+        replayed = [key for key, _, _ in entries if key not in failed]
+        return replayed, failed
@@ -0,0 +1,161 @@
+# kpi_app/fanout.py
+
+"""
+Evaluation of every KPI linked to one asset attribute from a single message.
+
+The arithmetic ASTs of all linked KPIs are merged into one plan in which
+structurally identical subtrees (e.g. `(ATTR - 32) * 5 / 9` used by several
+KPIs) are computed once per message. The plan is a flat list of steps over
+value slots, so one KPI failing (say, dividing by zero) yields a `Failure`
+that propagates only into the outputs depending on it.
+"""
+
+import operator
+
+from .interpreter import BINARY_OPERATORS, Attr, BinOp, Num, UnaryOp, check_finite, to_number
+
+class Failure:
+    """
+    Result of a failed step. Any arithmetic with a Failure returns the same
+    Failure, so errors flow to the dependent outputs without checks per step.
+    """
+
+    def __init__(self, error):
+        self.error = error
+
+    def _propagate(self, *args):
+        return self
+
+    __add__ = __radd__ = __sub__ = __rsub__ = _propagate
+    __mul__ = __rmul__ = __truediv__ = __rtruediv__ = _propagate
+    __floordiv__ = __rfloordiv__ = __pow__ = __rpow__ = _propagate
+    __neg__ = __pos__ = _propagate
+
+    def __eq__(self, other):
+        return False
+
+    __hash__ = object.__hash__
+
+ATTR_SLOT = 0
+
+class SharedPlan:
+    """Evaluates several arithmetic ASTs over one ATTR value, computing common subtrees once."""
+
+    def __init__(self, asts):
+        self.initial = [None]      # slot values before evaluation; constants are filled in
+        self.steps = []            # (slot, function, argument slots)
+        self._slots = {}           # structural key -> slot
+        self._constants = set()
+        self.outputs = [self._plan(ast) for ast in asts]
+
+    def evaluate(self, attr_value):
+        """Returns one result per AST, with Failure instances for the ones that failed."""
+        values = self.initial.copy()
+        values[ATTR_SLOT] = attr_value
+        for slot, function, arguments in self.steps:
+            try:
+                values[slot] = function(*[values[i] for i in arguments])
+            except Exception as e:
+                values[slot] = Failure(e)
+        return [values[slot] for slot in self.outputs]
+
+    def _plan(self, node):
+        """Returns the slot holding `node`'s value, adding steps for subtrees not planned yet."""
+        if isinstance(node, Attr):
+            return ATTR_SLOT
+        if isinstance(node, Num):
+            return self._constant(('num', node.value), node.value)
+        if isinstance(node, UnaryOp):
+            operand = self._plan(node.expr)
+            if node.op != '-':
+                return operand
+            return self._step(('neg', operand), operator.neg, (operand,))
+        if isinstance(node, BinOp):
+            left = self._plan(node.left)
+            right = self._plan(node.right)
+            return self._step((node.op, left, right), BINARY_OPERATORS[node.op], (left, right))
+        raise ValueError(f"Unknown AST node: {type(node)}")
+
+    def _constant(self, key, value):
+        slot = self._slots.get(key)
+        if slot is None:
+            slot = self._slots[key] = len(self.initial)
+            self.initial.append(value)
+            self._constants.add(slot)
+        return slot
+
+    def _step(self, key, function, arguments):
+        slot = self._slots.get(key)
+        if slot is not None:
+            return slot
+        if all(i in self._constants for i in arguments):
+            # Fold constant subtrees; they cannot fail here since every AST already compiled
+            return self._constant(key, function(*[self.initial[i] for i in arguments]))
+        slot = self._slots[key] = len(self.initial)
+        self.initial.append(None)
+        self.steps.append((slot, function, arguments))
+        return slot
+
+class FanOut:
+    """
+    All routes of one (asset_id, attribute_id), evaluated together.
+
+    Regex KPIs match the raw value; arithmetic KPIs share one parsed number
+    and one SharedPlan. Routes whose expression failed to compile report that
+    error for every message, as with a single route.
+    """
+
+    def __init__(self, routes):
+        self.routes = routes
+        self.regex_routes = []
+        arithmetic = []
+        for route in routes:
+            if route.compiled is None:
+                continue
+            if route.compiled.is_regex:
+                self.regex_routes.append(route)
+            else:
+                arithmetic.append(route)
+        self.arithmetic_routes = arithmetic
+        self.plan = SharedPlan([route.compiled.ast for route in arithmetic]) if len(arithmetic) > 1 else None
+
+    def evaluate(self, value):
+        """
+        Evaluates every route for one value and returns (route, result, error)
+        triples; exactly one of result and error is None.
+
+        The value is converted to a number once for all arithmetic routes; when
+        it is not numeric those routes are left out of the outcomes.
+        """
+        outcomes = [(route, None, route.error) for route in self.routes if route.compiled is None]
+        for route in self.regex_routes:
+            outcomes.append(self._single(route, value))
+        if not self.arithmetic_routes:
+            return outcomes
+
+        try:
+            number = to_number(value)
+        except ValueError:
+            return outcomes
+
+        if self.plan is None:
+            outcomes.append(self._single(self.arithmetic_routes[0], number))
+            return outcomes
+        for route, result in zip(self.arithmetic_routes, self.plan.evaluate(number)):
+            if not isinstance(result, Failure):
+                try:
+                    result = check_finite(result)
+                except ValueError as e:
+                    result = Failure(e)
+            if isinstance(result, Failure):
+                outcomes.append((route, None, ValueError(f"Error evaluating expression: {result.error}")))
+            else:
+                outcomes.append((route, result, None))
+        return outcomes
+
+    @staticmethod
+    def _single(route, value):
+        try:
+            return route, route.evaluate(value), None
+        except ValueError as e:
+            return route, None, e
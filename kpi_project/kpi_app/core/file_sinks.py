@@ -0,0 +1,218 @@
+# kpi_app/file_sinks.py
+
+"""
+File sinks that ship evaluation results to downstream consumers without
+reading them back out of the database.
+
+Rows are buffered like the database sink and appended one batch at a time
+through a large write buffer, so a flush is a single write call. Timestamps
+are normalized to ISO 8601 with the same conversion as the database sink,
+and results are written as numbers when they are numeric (regex KPIs produce
+"True"/"False" strings, which are kept as they are).
+"""
+
+import csv
+import io
+import json
+import os
+import time
+from abc import abstractmethod
+from pathlib import Path
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - exercised only without orjson installed
+    orjson = None
+
+from kpi_app.models.evaluation_log import EvaluationLog
+
+from .data_sinks import BufferedSink
+
+FIELDS = ('asset_id', 'attribute_id', 'timestamp', 'result')
+
+def encode_json(value):
+    """Encodes one object as a JSON line, with orjson when it is installed."""
+    if orjson is not None:
+        return orjson.dumps(value).decode('utf-8') + '\n'
+    return json.dumps(value, separators=(',', ':')) + '\n'
+
+def normalize(asset_id, attribute_id, timestamp, result):
+    """Returns the row with an ISO 8601 timestamp and a numeric result where possible."""
+    timestamp = EvaluationLog._meta.get_field('timestamp').to_python(timestamp)
+    if timestamp is None:
+        raise ValueError("A timestamp is required.")
+    if not isinstance(result, (int, float, str)) or isinstance(result, bool):
+        result = str(result)
+    return asset_id, attribute_id, timestamp.isoformat(), result
+
+def complete_length(file, chunk_size=1 << 16):
+    """Returns the length of `file` up to and including its last newline, leaving the position there."""
+    end = file.seek(0, os.SEEK_END)
+    while end > 0:
+        start = max(0, end - chunk_size)
+        file.seek(start)
+        newline = file.read(end - start).rfind(b'\n')
+        if newline >= 0:
+            return file.seek(start + newline + 1)
+        end = start
+    return file.seek(0)
+
+class BufferedFileSink(BufferedSink):
+    """
+    Appends batches of encoded rows to a file opened with a `buffer_size`
+    write buffer. Every flush hands the batch to the operating system; with
+    `fsync_interval`, the file is also fsynced at most that often.
+    """
+
+    def __init__(self, path, batch_size=500, max_latency=1.0, buffer_size=1 << 20, fsync_interval=None):
+        super().__init__(batch_size, max_latency)
+        self.path = Path(path)
+        self.buffer_size = buffer_size
+        self.fsync_interval = fsync_interval
+        self._last_fsync = time.monotonic()
+        self.file = None
+
+    def open(self, path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.file = open(path, 'ab', buffering=self.buffer_size)
+        if self.file.tell() == 0:
+            header = self.header()
+            if header:
+                self.file.write(header.encode('utf-8'))
+
+    def header(self):
+        """Text written at the start of a new file."""
+        return ''
+
+    @abstractmethod
+    def encode(self, batch):
+        """Encodes a batch of built rows into text."""
+        pass
+
+    def write_batch(self, batch):
+        if self.file is None:
+            self.open(self.path)
+        self.file.write(self.encode(batch).encode('utf-8'))
+        self.file.flush()
+        self.sync_if_due()
+
+    def sync_if_due(self):
+        if self.fsync_interval is not None and time.monotonic() - self._last_fsync >= self.fsync_interval:
+            self.sync()
+
+    def sync(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self._last_fsync = time.monotonic()
+
+    def close(self):
+        self.flush()
+        if self.file is not None:
+            if self.fsync_interval is not None:
+                self.sync()
+            self.file.close()
+            self.file = None
+
+class NDJSONFileSink(BufferedFileSink):
+    """Appends one JSON object per result to a newline-delimited JSON file."""
+
+    def build_row(self, asset_id, attribute_id, timestamp, result):
+        return encode_json(dict(zip(FIELDS, normalize(asset_id, attribute_id, timestamp, result))))
+
+    def encode(self, batch):
+        return ''.join(batch)
+
+class CSVFileSink(BufferedFileSink):
+    """Appends results to a CSV file, writing the header when the file is new."""
+
+    def build_row(self, asset_id, attribute_id, timestamp, result):
+        return normalize(asset_id, attribute_id, timestamp, result)
+
+    def header(self):
+        return ','.join(FIELDS) + '\n'
+
+    def encode(self, batch):
+        text = io.StringIO()
+        csv.writer(text, lineterminator='\n').writerows(batch)
+        return text.getvalue()
+
+class SegmentFileSink(NDJSONFileSink):
+    """
+    Writes NDJSON into a directory of size-capped segments named
+    `<prefix>-<sequence>.ndjson`. The segment being written carries a `.part`
+    suffix; the write that brings it to `max_bytes` fsyncs and renames it, so
+    consumers can pick up every `*.ndjson` file as complete. The open segment
+    is fsynced every `fsync_interval` seconds. Numbering continues after the
+    segments already in the directory, and a `.part` segment left behind by a
+    run that did not close the sink is published on start-up, without a
+    trailing partial line.
+    """
+
+    suffix = '.ndjson'
+
+    def __init__(self, directory, batch_size=500, max_latency=1.0, max_bytes=64 << 20, buffer_size=4 << 20,
+                 fsync_interval=1.0, prefix='evaluations'):
+        if max_bytes < 1:
+            raise ValueError("max_bytes must be at least 1")
+        super().__init__(directory, batch_size, max_latency, buffer_size, fsync_interval)
+        self.max_bytes = max_bytes
+        self.prefix = prefix
+        self.sequence = self.last_sequence()
+        self.segments = []
+        self.publish_leftovers()
+
+    def last_sequence(self):
+        last = 0
+        for path in self.path.glob(f'{self.prefix}-*{self.suffix}*'):
+            number = path.name[len(self.prefix) + 1:].split('.', 1)[0]
+            if number.isdigit():
+                last = max(last, int(number))
+        return last
+
+    def publish_leftovers(self):
+        """Publishes the `.part` segments of an earlier run; empty ones are removed."""
+        for part in sorted(self.path.glob(f'{self.prefix}-*{self.suffix}.part')):
+            with open(part, 'r+b') as file:
+                file.truncate(complete_length(file))
+                size = file.tell()
+                file.flush()
+                os.fsync(file.fileno())
+            if size:
+                final = part.with_name(part.name[:-len('.part')])
+                os.replace(part, final)
+                self.segments.append(final)
+            else:
+                part.unlink()
+
+    def segment_path(self):
+        return self.path / f'{self.prefix}-{self.sequence:06d}{self.suffix}'
+
+    def part_path(self):
+        return self.path / f'{self.prefix}-{self.sequence:06d}{self.suffix}.part'
+
+    def write_batch(self, batch):
+        data = self.encode(batch).encode('utf-8')
+        if self.file is not None and self.file.tell() > 0 and self.file.tell() + len(data) > self.max_bytes:
+            self.rotate()
+        if self.file is None:
+            self.sequence += 1
+            self.open(self.part_path())
+        self.file.write(data)
+        self.file.flush()
+        if self.file.tell() >= self.max_bytes:
+            self.rotate()
+        else:
+            self.sync_if_due()
+
+    def rotate(self):
+        """Closes the open segment and publishes it under its final name."""
+        self.sync()
+        self.file.close()
+        self.file = None
+        os.replace(self.part_path(), self.segment_path())
+        self.segments.append(self.segment_path())
+
+    def close(self):
+        self.flush()
+        if self.file is not None:
+            self.rotate()
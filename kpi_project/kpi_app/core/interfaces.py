@@ -1,15 +1,35 @@
 # kpi_app/interfaces.py
 
+import asyncio
 from abc import ABC, abstractmethod
+from itertools import islice
+
+from asgiref.sync import sync_to_async
 
 class DataSource(ABC):
     """Abstract base class for data sources."""
-    
+
+    # Optional dead-letter store that receives the lines that cannot be decoded
+    dead_letters = None
+
     @abstractmethod
     def read_data(self):
         """Reads data from the source."""
         pass
 
+    async def aread_data(self, batch_size=256):
+        """
+        Async variant of read_data. The default pulls batches from the blocking
+        generator in a worker thread so file I/O never stalls the event loop.
+        """
+        iterator = iter(self.read_data())
+        while True:
+            batch = await asyncio.to_thread(lambda: list(islice(iterator, batch_size)))
+            if not batch:
+                return
+            for message in batch:
+                yield message
+
 class DataSink(ABC):
     """Abstract base class for data sinks."""
 
@@ -18,6 +38,74 @@ class DataSink(ABC):
         """Writes data to the sink."""
         pass
 
+    def flush(self):
+        """Persists any buffered data. Unbuffered sinks have nothing to do."""
+        pass
+
+    def flush_if_due(self):
+        """Flushes if buffered data has waited too long. Called periodically by long-running pipelines."""
+        pass
+
+    def pending(self):
+        """Number of results buffered but not written yet."""
+        return 0
+
+    def discard(self):
+        """Drops buffered results without writing them and returns how many there were."""
+        return 0
+
+    def take_rejected(self):
+        """
+        Returns and forgets the (row, error, source) triples of buffered rows
+        that a flush had to drop because the backend rejected them, with the
+        source passed to `write_many` for each. Unbuffered sinks reject rows
+        in `write_many` itself, so they have none.
+        """
+        return []
+
+    def close(self):
+        """Flushes and releases the sink."""
+        self.flush()
+
+    def write_many(self, rows, sources=None):
+        """
+        Writes (asset_id, attribute_id, timestamp, result) rows one by one and
+        returns the (row, error) pairs of the rows that could not be written.
+        `sources` optionally names where each row came from, e.g. its message,
+        for buffered sinks to report with rows rejected by a later flush.
+        """
+        failures = []
+        for row in rows:
+            try:
+                self.write_data(*row)
+            except Exception as e:
+                failures.append((row, e))
+        return failures
+
+    # Async variants run the blocking methods on Django's thread-sensitive
+    # executor: one thread, so a sink's buffer and database connection are
+    # never used concurrently.
+
+    async def awrite_data(self, asset_id, attribute_id, timestamp, result):
+        """Async variant of write_data."""
+        await sync_to_async(self.write_data)(asset_id, attribute_id, timestamp, result)
+
+    async def awrite_many(self, rows, sources=None):
+        """Async variant of write_many."""
+        return await sync_to_async(self.write_many)(rows, sources)
+
+    async def aflush(self):
+        """Async variant of flush."""
+        await sync_to_async(self.flush)()
+
+    async def aflush_if_due(self):
+        """Async variant of flush_if_due."""
+        await sync_to_async(self.flush_if_due)()
+
+    async def aclose(self):
+        """Async variant of close."""
+        await sync_to_async(self.close)()
+
 class ExpressionEvaluator(ABC):
     """Abstract base class for expression evaluators."""
 
@@ -1,9 +1,52 @@
 # kpi_app/interpreter.py
 
+"""
+The KPI expression engine.
+
+Expressions are tokenized by `Lexer`, parsed into an AST with `ATTR` as a
+variable node, and compiled once into a tree of Python closures. Evaluating a
+compiled expression is then a chain of direct function calls: no re-parsing,
+no node-type dispatch and no `eval` of user-supplied text.
+
+Grammar:
+    expression := term (('+' | '-') term)*
+    term       := unary (('*' | '/' | '//') unary)*
+    unary      := ('-' | '+') unary | power
+    power      := primary ('**' unary)?
+    primary    := NUMBER | 'ATTR' | '(' expression ')'
+    regex      := 'Regex' '(' 'ATTR' ',' STRING ')'    (only as a whole expression)
+
+As in Python, `**` binds tighter than unary minus on its left and is right
+associative, so `-ATTR ** 2` is `-(ATTR ** 2)` and `2 ** 3 ** 2` is `2 ** 9`.
+In a whole-expression `Regex(...)` the pattern runs from the first to the last
+quote, so patterns written before the lexer existed, like `'it's'`, still work.
+"""
+
+import math
+import operator
 import re
-import shlex
+from .cache import LRUCache
 from .interfaces import ExpressionEvaluator
 
+# Compiled expressions are shared by every interpreter in the process, so the
+# management command and the API both pay the parsing cost once per expression.
+DEFAULT_CACHE_SIZE = 1024
+expression_cache = LRUCache(maxsize=DEFAULT_CACHE_SIZE)
+
+# Compiled re.Pattern objects for Regex(...) KPIs, keyed by pattern text. The
+# `re` module's own cache only holds a few hundred entries and is shared with
+# every other regex user in the process, so it thrashes with many regex KPIs.
+DEFAULT_REGEX_CACHE_SIZE = 4096
+regex_cache = LRUCache(maxsize=DEFAULT_REGEX_CACHE_SIZE)
+
+def compile_pattern(pattern):
+    """Returns the compiled regex for `pattern` from the shared pattern cache."""
+    return regex_cache.get_or_create(pattern, re.compile)
+
+def cache_info():
+    """Returns hit/miss/size statistics of the expression and regex caches."""
+    return {'expressions': expression_cache.info(), 'regex': regex_cache.info()}
+
 class ASTNode:
     """Base class for AST nodes."""
     pass
@@ -26,112 +69,328 @@ class Num(ASTNode):
     def __init__(self, value):
         self.value = value
 
+class Attr(ASTNode):
+    """AST node for the ATTR placeholder, bound to the input value at evaluation time."""
+    pass
+
 class RegexOp(ASTNode):
     """AST node for regex matching."""
     def __init__(self, pattern):
         self.pattern = pattern
 
-class CustomInterpreter(ExpressionEvaluator):
-    """Interpreter that evaluates arithmetic and regex expressions with AST support."""
+class Token:
+    """A lexical token with its position in the expression, for error messages."""
 
-    def __init__(self):
-        # Define operator precedence
-        self.precedence = {
-            '+': 1,
-            '-': 1,
-            '*': 2,
-            '/': 2
-        }
+    def __init__(self, kind, text, position):
+        self.kind = kind
+        self.text = text
+        self.position = position
 
-    def evaluate_expression(self, expression, attr_value):
-        """Entry point to evaluate expressions with ATTR replacement."""
+    def __repr__(self):
+        return f"Token({self.kind}, {self.text!r}, {self.position})"
+
+class Lexer:
+    """Splits an expression into NUMBER, NAME, STRING and operator tokens."""
+
+    TOKEN_SPEC = [
+        ('NUMBER', r'\d+\.\d*|\.\d+|\d+'),
+        ('NAME', r'[A-Za-z_]\w*'),
+        ('STRING', r"'(?:\\.|[^'\\])*'"),
+        ('OP', r'\*\*|//|[-+*/(),]'),
+        ('SPACE', r'\s+'),
+        ('MISMATCH', r'.'),
+    ]
+    PATTERN = re.compile('|'.join(f'(?P<{kind}>{regex})' for kind, regex in TOKEN_SPEC))
+    REGEX_CALL = re.compile(r"\s*(Regex)\s*(\()\s*(ATTR)\s*(,)\s*'(.*)'\s*(\))\s*", re.DOTALL)
+
+    def tokenize(self, expression):
+        call = self.REGEX_CALL.fullmatch(expression)
+        if call is not None:
+            kinds = ('NAME', 'OP', 'NAME', 'OP', 'STRING', 'OP')
+            return [Token(kind, call.group(i).replace("\\'", "'") if kind == 'STRING' else call.group(i),
+                          call.start(i))
+                    for i, kind in enumerate(kinds, start=1)]
+        tokens = []
+        for match in self.PATTERN.finditer(expression):
+            kind = match.lastgroup
+            text = match.group()
+            if kind == 'SPACE':
+                continue
+            if kind == 'MISMATCH':
+                if text == "'":
+                    raise ValueError(f"Unterminated string at position {match.start()}")
+                raise ValueError(f"Unexpected character {text!r} at position {match.start()}")
+            if kind == 'STRING':
+                # Only \' is an escape; other backslashes belong to the regex
+                text = text[1:-1].replace("\\'", "'")
+            tokens.append(Token(kind, text, match.start()))
+        return tokens
+
+class Parser:
+    """Recursive-descent parser producing the AST for one expression."""
+
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.index = 0
+
+    def parse(self):
+        if not self.tokens:
+            raise ValueError("Empty expression")
+        if self.peek().kind == 'NAME' and self.peek().text == 'Regex':
+            node = self.parse_regex()
+        else:
+            node = self.parse_expression()
+        if self.index < len(self.tokens):
+            token = self.tokens[self.index]
+            raise ValueError(f"Unexpected token {token.text!r} at position {token.position}")
+        return node
+
+    def peek(self):
+        return self.tokens[self.index] if self.index < len(self.tokens) else None
+
+    def take(self):
+        token = self.peek()
+        if token is None:
+            raise ValueError("Unexpected end of expression")
+        self.index += 1
+        return token
+
+    def expect(self, text, kind='OP'):
+        token = self.take()
+        if token.kind != kind or token.text != text:
+            raise ValueError(f"Expected {text!r} at position {token.position}, found {token.text!r}")
+        return token
+
+    def accept(self, *ops):
+        token = self.peek()
+        if token is not None and token.kind == 'OP' and token.text in ops:
+            self.index += 1
+            return token.text
+        return None
+
+    def parse_expression(self):
+        node = self.parse_term()
+        while True:
+            op = self.accept('+', '-')
+            if op is None:
+                return node
+            node = BinOp(left=node, op=op, right=self.parse_term())
+
+    def parse_term(self):
+        node = self.parse_unary()
+        while True:
+            op = self.accept('*', '/', '//')
+            if op is None:
+                return node
+            node = BinOp(left=node, op=op, right=self.parse_unary())
+
+    def parse_unary(self):
+        op = self.accept('-', '+')
+        if op is not None:
+            return UnaryOp(op, self.parse_unary())
+        return self.parse_power()
+
+    def parse_power(self):
+        node = self.parse_primary()
+        if self.accept('**'):
+            return BinOp(left=node, op='**', right=self.parse_unary())
+        return node
+
+    def parse_primary(self):
+        token = self.take()
+        if token.kind == 'NUMBER':
+            return Num(float(token.text) if '.' in token.text else int(token.text))
+        if token.kind == 'NAME' and token.text == 'ATTR':
+            return Attr()
+        if token.kind == 'OP' and token.text == '(':
+            node = self.parse_expression()
+            if not self.accept(')'):
+                raise ValueError("Mismatched parentheses")
+            return node
+        if token.kind == 'NAME' and token.text == 'Regex':
+            raise ValueError(f"Regex(...) must be the whole expression (position {token.position})")
+        raise ValueError(f"Unexpected token {token.text!r} at position {token.position}")
+
+    def parse_regex(self):
+        self.expect('Regex', kind='NAME')
+        self.expect('(')
+        self.expect('ATTR', kind='NAME')
+        self.expect(',')
+        token = self.take()
+        if token.kind != 'STRING' or not token.text:
+            raise ValueError(f"Expected a non-empty regex pattern at position {token.position}")
+        self.expect(')')
         try:
-            # Check if expression includes 'Regex'
-            if "Regex(" in expression:
-                return self.evaluate_regex(expression, attr_value)
-            
-            # Handle arithmetic by replacing ATTR and tokenizing
-            expression = expression.replace("ATTR", str(attr_value))
-            if re.match(r"^[\d+\-*/().\s]+$", expression):  # Simplify if expression is basic arithmetic
-                return eval(expression)
-
-            # Otherwise, parse and evaluate with AST
-            tokens = self.tokenize(expression)
-            ast = self.parse(tokens)
-            return self.evaluate_ast(ast)
+            compile_pattern(token.text)
+        except re.error as e:
+            raise ValueError(f"Invalid regex pattern: {token.text} - {e}")
+        return RegexOp(token.text)
+
+def divide(left, right):
+    if right == 0:
+        raise ValueError("Division by zero error")
+    return left / right
+
+def floor_divide(left, right):
+    if right == 0:
+        raise ValueError("Division by zero error")
+    return left // right
+
+# Integer powers are exact in Python, so `ATTR ** 1000000` would happily build
+# a million-bit number. Refuse any power that cannot end up as a finite float
+# before computing it, as float overflow would for the same expression.
+MAX_POWER_BITS = 1024
+
+def power(base, exponent):
+    if (type(base) is int and type(exponent) is int and exponent > 0 and abs(base) > 1
+            and (abs(base).bit_length() - 1) * exponent >= MAX_POWER_BITS):
+        raise ValueError(f"Result is not a finite number: {base} ** {exponent} is too large")
+    try:
+        result = base ** exponent
+    except OverflowError:
+        raise ValueError(f"Result is not a finite number: {base} ** {exponent} is too large")
+    if type(result) is complex:
+        raise ValueError(f"Result is not a real number: {base} ** {exponent}")
+    if type(result) is int and result.bit_length() > MAX_POWER_BITS:
+        raise ValueError(f"Result is not a finite number: {base} ** {exponent} is too large")
+    return result
+
+BINARY_OPERATORS = {
+    '+': operator.add,
+    '-': operator.sub,
+    '*': operator.mul,
+    '/': divide,
+    '//': floor_divide,
+    '**': power,
+}
+
+def compile_ast(node):
+    """
+    Compiles an AST into a closure taking the ATTR value.
 
+    Node types are dispatched once here, at compile time; constant subtrees are
+    folded so that e.g. `ATTR * (60 / 2)` evaluates as `ATTR * 30.0`.
+    """
+    constant, function = _compile(node)
+    if function is None:
+        return lambda attr: constant
+    return function
+
+def _compile(node):
+    """Returns (constant, None) for constant subtrees and (None, function) otherwise."""
+    if isinstance(node, Num):
+        return node.value, None
+    if isinstance(node, Attr):
+        return None, lambda attr: attr
+    if isinstance(node, UnaryOp):
+        constant, function = _compile(node.expr)
+        if node.op != '-':
+            return constant, function
+        if function is None:
+            return -constant, None
+        return None, lambda attr: -function(attr)
+    if isinstance(node, BinOp):
+        op = BINARY_OPERATORS.get(node.op)
+        if op is None:
+            raise ValueError(f"Unknown operator: {node.op}")
+        left_const, left = _compile(node.left)
+        right_const, right = _compile(node.right)
+        if left is None and right is None:
+            return op(left_const, right_const), None
+        if left is None:
+            return None, lambda attr: op(left_const, right(attr))
+        if right is None:
+            return None, lambda attr: op(left(attr), right_const)
+        return None, lambda attr: op(left(attr), right(attr))
+    if isinstance(node, RegexOp):
+        fullmatch = compile_pattern(node.pattern).fullmatch
+        return None, lambda attr: "True" if fullmatch(str(attr)) else "False"
+    raise ValueError(f"Unknown AST node: {type(node)}")
+
+class CompiledExpression:
+    """A parsed KPI expression that can be evaluated repeatedly for different ATTR values."""
+
+    def __init__(self, expression, ast):
+        self.expression = expression
+        self.ast = ast
+        self.is_regex = isinstance(ast, RegexOp)
+        self.function = compile_ast(ast)
+
+    def evaluate(self, attr_value):
+        """Evaluates the expression with ATTR bound to `attr_value`."""
+        try:
+            if self.is_regex:
+                return self.function(attr_value)
+            return check_finite(self.function(to_number(attr_value)))
         except Exception as e:
             raise ValueError(f"Error evaluating expression: {e}")
 
-    def evaluate_regex(self, expression, attr_value):
-        """Evaluate regex expressions with full regex support."""
-        match = re.match(r"Regex\(ATTR, '(.+?)'\)", expression)
-        if match:
-            pattern = match.group(1)
-            try:
-                regex_ast = RegexOp(pattern)
-                return self.evaluate_ast(regex_ast, attr_value)
-            except re.error as e:
-                raise ValueError(f"Invalid regex pattern: {pattern} - {e}")
-        raise ValueError("Invalid regex expression format")
+def to_number(value):
+    """Converts an ATTR value to int or float, keeping integers exact."""
+    value_type = type(value)
+    if value_type is int:
+        return value
+    if isinstance(value, bool):
+        raise ValueError(f"Invalid numeric value: {value}")
+    if isinstance(value, int):
+        return value
+    if isinstance(value, float):
+        number = value
+    else:
+        text = str(value).strip()
+        try:
+            return int(text)
+        except ValueError:
+            pass
+        try:
+            number = float(text)
+        except ValueError:
+            raise ValueError(f"Invalid numeric value: {value}")
+    # NaN, infinities and overflowing literals such as "1e400" are not numbers a KPI can use
+    if not math.isfinite(number):
+        raise ValueError(f"Invalid numeric value: {value}")
+    return number
+
+def check_finite(result):
+    """Returns an arithmetic result, rejecting NaN and infinities (e.g. from overflow)."""
+    if type(result) is float and not math.isfinite(result):
+        raise ValueError(f"Result is not a finite number: {result}")
+    return result
+
+class CustomInterpreter(ExpressionEvaluator):
+    """Interpreter that compiles arithmetic and regex expressions once and evaluates them many times."""
+
+    def __init__(self, cache=None):
+        self.lexer = Lexer()
+        self.cache = expression_cache if cache is None else cache
+
+    def evaluate_expression(self, expression, attr_value):
+        """Entry point to evaluate expressions with ATTR bound to the given value."""
+        return self.get_compiled(expression).evaluate(attr_value)
+
+    def evaluate_many(self, expression, values):
+        """
+        Evaluates an expression over a sequence of values with NumPy, returning a
+        BatchResult whose `errors` mask flags rows that could not be evaluated.
+        """
+        from .vectorized import evaluate_many
+        return evaluate_many(self.get_compiled(expression), values)
+
+    def get_compiled(self, expression):
+        """Returns the compiled form of `expression`, compiling it on a cache miss."""
+        return self.cache.get_or_create(expression, self.compile)
+
+    def compile(self, expression):
+        """Tokenize, parse and compile an expression into a reusable CompiledExpression."""
+        try:
+            return CompiledExpression(expression, self.parse(self.tokenize(expression)))
+        except Exception as e:
+            raise ValueError(f"Error evaluating expression: {e}")
 
     def tokenize(self, expression):
-        """Tokenize the expression into numbers, operators, and parentheses."""
-        tokens = shlex.split(expression)
-        return [token for token in tokens if token]
+        """Tokenize the expression into numbers, names, strings, operators and parentheses."""
+        return self.lexer.tokenize(expression)
 
     def parse(self, tokens):
         """Parse tokens into an AST with precedence handling."""
-        def parse_expression(precedence=0):
-            node = parse_primary()
-            while tokens and tokens[0] in self.precedence and self.precedence[tokens[0]] >= precedence:
-                op = tokens.pop(0)
-                next_precedence = self.precedence[op] + 1
-                right = parse_expression(next_precedence)
-                node = BinOp(left=node, op=op, right=right)
-            return node
-
-        def parse_primary():
-            if not tokens:
-                raise ValueError("Unexpected end of expression")
-            token = tokens.pop(0)
-            if token.isdigit() or '.' in token:
-                return Num(float(token))
-            elif token == '(':
-                node = parse_expression()
-                if not tokens or tokens.pop(0) != ')':
-                    raise ValueError("Mismatched parentheses")
-                return node
-            elif token == '-':
-                return UnaryOp('-', parse_primary())
-            else:
-                raise ValueError(f"Unexpected token: {token}")
-
-        return parse_expression()
-
-    def evaluate_ast(self, node, attr_value=None):
-        """Evaluate the AST recursively based on node type."""
-        if isinstance(node, Num):
-            return node.value
-        elif isinstance(node, UnaryOp):
-            expr_val = self.evaluate_ast(node.expr)
-            return -expr_val if node.op == '-' else expr_val
-        elif isinstance(node, BinOp):
-            left_val = self.evaluate_ast(node.left)
-            right_val = self.evaluate_ast(node.right)
-            if node.op == '+':
-                return left_val + right_val
-            elif node.op == '-':
-                return left_val - right_val
-            elif node.op == '*':
-                return left_val * right_val
-            elif node.op == '/':
-                if right_val == 0:
-                    raise ValueError("Division by zero error")
-                return left_val / right_val
-            else:
-                raise ValueError(f"Unknown operator: {node.op}")
-        elif isinstance(node, RegexOp):
-            return "True" if re.fullmatch(node.pattern, str(attr_value)) else "False"
-        else:
-            raise ValueError(f"Unknown AST node: {type(node)}")
+        return Parser(tokens).parse()
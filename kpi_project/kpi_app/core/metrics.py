@@ -0,0 +1,313 @@
+# kpi_app/metrics.py
+
+"""
+In-process metrics for the ingest pipeline, rendered in the Prometheus text
+exposition format.
+
+Counters and histograms are updated on the hot path, so they are plain
+objects guarded by one lock each and nothing more. Values that already live
+elsewhere (cache statistics, queue sizes) are read through callbacks when the
+metrics are rendered instead of being copied on every change.
+
+Metrics are per process: `process_messages` serves all of its own with
+`--metrics-port`. The web server never runs the pipeline, so its `/metrics`
+view only serves the `WEB_METRICS` that its API requests update.
+"""
+
+import logging
+import threading
+import time
+from bisect import bisect_left
+
+logger = logging.getLogger(__name__)
+
+# Seconds; covers sub-microsecond lookups up to slow bulk inserts
+DEFAULT_BUCKETS = (
+    0.000001, 0.0000025, 0.000005, 0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005,
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5,
+)
+
+def _labels_text(labelnames, values):
+    if not labelnames:
+        return ''
+    pairs = ','.join(f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values))
+    return '{' + pairs + '}'
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def header(self):
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+class Counter(Metric):
+    """A monotonically increasing count, optionally split by labels."""
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values = {}
+
+    def inc(self, amount=1, *labels):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels):
+        return self._values.get(labels, 0)
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        return [(self.name, self.labelnames, labels, value) for labels, value in sorted(values.items())]
+
+class Histogram(Metric):
+    """Distribution of observed durations over fixed buckets, one series per label set."""
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}
+
+    def observe(self, value, *labels):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0, 0.0]
+            series[0][index] += 1
+            series[1] += 1
+            series[2] += value
+
+    def observe_many(self, total, count, *labels):
+        """
+        Records `count` operations that took `total` seconds together, each as
+        the average; for hot loops where timing every operation costs too much.
+        """
+        if count <= 0:
+            return
+        value = total / count
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0, 0.0]
+            series[0][index] += count
+            series[1] += count
+            series[2] += total
+
+    def snapshot(self, *labels):
+        """Returns (count, sum, per-bucket counts) for one label set."""
+        with self._lock:
+            counts, count, total = self._series.get(labels, ([0] * (len(self.buckets) + 1), 0, 0.0))
+            return count, total, list(counts)
+
+    def quantile(self, fraction, *labels):
+        """Upper bound of the bucket holding the given quantile, or None without observations."""
+        count, _, counts = self.snapshot(*labels)
+        if not count:
+            return None
+        rank = fraction * count
+        seen = 0
+        for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+            seen += bucket_count
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+    def samples(self):
+        with self._lock:
+            series = {labels: (list(counts), count, total) for labels, (counts, count, total) in self._series.items()}
+        samples = []
+        for labels, (counts, count, total) in sorted(series.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                samples.append((f"{self.name}_bucket", self.labelnames + ('le',), labels + (_number(bound),),
+                                cumulative))
+            samples.append((f"{self.name}_count", self.labelnames, labels, count))
+            samples.append((f"{self.name}_sum", self.labelnames, labels, total))
+        return samples
+
+class Gauge(Metric):
+    """Values read from callbacks at render time, e.g. the size of a live queue."""
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._callbacks = {}
+
+    def track(self, function, *labels):
+        """Reports `function()` for these labels until `untrack` is called."""
+        with self._lock:
+            self._callbacks[labels] = function
+
+    def untrack(self, *labels):
+        with self._lock:
+            self._callbacks.pop(labels, None)
+
+    def samples(self):
+        with self._lock:
+            callbacks = dict(self._callbacks)
+        samples = []
+        for labels, function in sorted(callbacks.items()):
+            try:
+                samples.append((self.name, self.labelnames, labels, function()))
+            except Exception:
+                logger.exception("Metric callback for %s%s failed", self.name, labels)
+        return samples
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self, metrics=None):
+        """Returns all metrics, or only `metrics`, in the Prometheus text exposition format."""
+        lines = []
+        for metric in self.metrics if metrics is None else metrics:
+            lines.extend(metric.header())
+            for name, labelnames, labels, value in metric.samples():
+                lines.append(f"{name}{_labels_text(labelnames, labels)} {_number(value)}")
+        return '\n'.join(lines) + '\n'
+
+registry = Registry()
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+MESSAGES = registry.register(Counter(
+    'kpi_messages_total', "Messages handled by the pipeline, by outcome.", ['status']))
+MALFORMED_LINES = registry.register(Counter(
+    'kpi_malformed_lines_total', "Input lines that could not be decoded as JSON."))
+FAILURES = registry.register(Counter(
+    'kpi_failures_total', "Failed evaluations and writes, by error class.", ['error']))
+DEAD_LETTERS = registry.register(Counter(
+    'kpi_dead_letters_total', "Messages recorded in the dead-letter store, by error class.", ['error']))
+ROWS_WRITTEN = registry.register(Counter(
+    'kpi_rows_written_total', "Evaluation results written by the database sinks."))
+STAGE_SECONDS = registry.register(Histogram(
+    'kpi_stage_seconds', "Time spent per operation in each pipeline stage.", ['stage']))
+CACHE_EVENTS = registry.register(Gauge(
+    'kpi_cache_events', "Hits and misses of the expression and regex caches since they were last cleared.",
+    ['cache', 'event']))
+CACHE_HIT_RATIO = registry.register(Gauge(
+    'kpi_cache_hit_ratio', "Share of cache lookups that were hits.", ['cache']))
+QUEUE_DEPTH = registry.register(Gauge(
+    'kpi_queue_depth', "Items waiting in the pipeline's queues and buffers.", ['queue']))
+
+# What the web server's /metrics view exports: the API evaluates expressions
+# through the shared caches, but pipeline series would only ever read zero there
+WEB_METRICS = (CACHE_EVENTS, CACHE_HIT_RATIO)
+
+# Stage names used with STAGE_SECONDS
+PARSE = 'parse'
+ROUTE = 'route'
+EVALUATE = 'evaluate'
+SINK_WRITE = 'sink_write'
+STAGES = (PARSE, ROUTE, EVALUATE, SINK_WRITE)
+
+def _track_caches():
+    from .interpreter import expression_cache, regex_cache
+
+    for name, cache in (('expressions', expression_cache), ('regex', regex_cache)):
+        CACHE_EVENTS.track(lambda cache=cache: cache.hits, name, 'hit')
+        CACHE_EVENTS.track(lambda cache=cache: cache.misses, name, 'miss')
+        CACHE_HIT_RATIO.track(lambda cache=cache: cache.hits / max(1, cache.hits + cache.misses), name)
+
+_track_caches()
+
+class SummaryLogger:
+    """
+    Background thread that logs one summary line every `interval` seconds:
+    message counts and rate since the previous line, stage p99s and cache hit
+    ratios.
+    """
+
+    def __init__(self, interval=10.0, log=None):
+        self.interval = interval
+        self.log = log or logger
+        self._stop = threading.Event()
+        self._thread = None
+        self._last = None
+
+    def start(self):
+        self._last = (time.monotonic(), self.processed())
+        self._thread = threading.Thread(target=self._run, name='kpi-metrics-summary', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    @staticmethod
+    def processed():
+        return sum(MESSAGES.value(status) for status in ('processed', 'skipped', 'failed'))
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.log.info(self.summary())
+
+    def summary(self):
+        now, total = time.monotonic(), self.processed()
+        last_time, last_total = self._last
+        self._last = (now, total)
+        rate = (total - last_total) / (now - last_time) if now > last_time else 0.0
+        p99s = ' '.join(
+            f"{stage}_p99={_format_seconds(STAGE_SECONDS.quantile(0.99, stage))}" for stage in STAGES
+        )
+        ratios = ' '.join(
+            f"{labels[0]}_cache_hit_ratio={value:.3f}" for _, _, labels, value in CACHE_HIT_RATIO.samples()
+        )
+        return (
+            f"processed={MESSAGES.value('processed')} skipped={MESSAGES.value('skipped')} "
+            f"failed={MESSAGES.value('failed')} malformed={MALFORMED_LINES.value()} "
+            f"rate={rate:.1f}/s {p99s} {ratios}"
+        )
+
+def serve_metrics(port, host=''):
+    """Serves `/metrics` from this process on a background HTTP server and returns the server."""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?', 1)[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = registry.render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', CONTENT_TYPE)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            logger.debug("Metrics request: " + format, *args)
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name='kpi-metrics-server', daemon=True).start()
+    return server
+
+def _format_seconds(value):
+    if value is None:
+        return '-'
+    if value == float('inf'):
+        return '>2.5s'
+    return f"{value * 1e6:.0f}us" if value < 0.001 else f"{value * 1e3:.1f}ms"
@@ -0,0 +1,201 @@
+# kpi_app/parallel.py
+
+"""
+Multi-process ingest for the message pipeline.
+
+Two strategies are offered:
+
+* Sharded: the parent reads the source and routes every message to the worker
+  owning `shard_for(asset_id)`, so messages of one asset are always processed
+  by the same worker in file order.
+* Split file: each worker reads its own line-aligned byte range of one file in
+  parallel. Reading is no longer a bottleneck, but per-asset ordering only
+  holds within a range.
+
+Every worker builds its own routing index and buffered sink and reports its
+counts back to the parent, which merges them. A worker that dies without
+reporting, e.g. killed by the OOM killer, fails the run with `WorkerFailed`
+instead of leaving the parent waiting for it.
+"""
+
+import multiprocessing
+import queue
+import zlib
+from collections import Counter
+
+from .data_sources import FileDataSource, split_byte_ranges
+
+# Messages are shipped to workers in chunks to amortize inter-process overhead
+DEFAULT_CHUNK_SIZE = 256
+
+# Seconds between liveness checks while waiting on a worker
+POLL_INTERVAL = 1.0
+
+class WorkerFailed(RuntimeError):
+    """A worker process exited without reporting its results."""
+
+def shard_for(asset_id, workers):
+    """Returns the worker index for an asset; stable across processes and runs."""
+    return zlib.crc32(str(asset_id).encode('utf-8')) % workers
+
+def run_sharded(messages, workers, sink_options, chunk_size=DEFAULT_CHUNK_SIZE, before_dispatch=None):
+    """
+    Processes `messages` on `workers` processes sharded by asset_id and returns
+    the merged report. `before_dispatch(message)` is called in the parent for
+    every message, e.g. to apply rate limiting.
+    """
+    context = multiprocessing.get_context()
+    results = context.Queue()
+    queues = [context.Queue(maxsize=8) for _ in range(workers)]
+    processes = [
+        context.Process(target=_sharded_worker, args=(queue, results, sink_options), daemon=True)
+        for queue in queues
+    ]
+    for process in processes:
+        process.start()
+
+    chunks = [[] for _ in range(workers)]
+    try:
+        try:
+            for message in messages:
+                if before_dispatch is not None:
+                    before_dispatch(message)
+                # Malformed messages have no asset; any worker can reject them
+                asset_id = message.get('asset_id') if isinstance(message, dict) else None
+                shard = shard_for(asset_id, workers)
+                chunks[shard].append(message)
+                if len(chunks[shard]) >= chunk_size:
+                    _put(queues[shard], chunks[shard], processes[shard])
+                    chunks[shard] = []
+        finally:
+            for chunk_queue, chunk, process in zip(queues, chunks, processes):
+                if chunk:
+                    _put(chunk_queue, chunk, process)
+                _put(chunk_queue, None, process)
+    except WorkerFailed:
+        _terminate(processes)
+        raise
+
+    return _collect(results, processes)
+
+def run_split_file(file_path, workers, sink_options, source_class=FileDataSource):
+    """Processes one file on `workers` processes, each reading its own byte range with `source_class`."""
+    context = multiprocessing.get_context()
+    results = context.Queue()
+    processes = [
+        context.Process(target=_range_worker, args=(file_path, start, end, results, sink_options, source_class),
+                        daemon=True)
+        for start, end in split_byte_ranges(file_path, workers)
+    ]
+    for process in processes:
+        process.start()
+    return _collect(results, processes)
+
+def merge_reports(reports):
+    """Merges worker reports into one report with summed counts and failures."""
+    counts = Counter()
+    failures = Counter()
+    for report in reports:
+        counts.update(report['counts'])
+        failures.update(report['failures'])
+    return {
+        'counts': dict(counts),
+        'failures': dict(failures),
+        'malformed': sum(report.get('malformed', 0) for report in reports),
+        'workers': reports,
+    }
+
+def _put(chunk_queue, chunk, process):
+    """Sends a chunk to a worker, waiting while its queue is full as long as the worker is alive."""
+    while True:
+        try:
+            chunk_queue.put(chunk, timeout=POLL_INTERVAL)
+            return
+        except queue.Full:
+            if not process.is_alive():
+                raise WorkerFailed(f"Worker {process.pid} exited with code {process.exitcode} "
+                                   f"before reading all of its messages")
+
+def _collect(results, processes):
+    reports = []
+    while len(reports) < len(processes):
+        # A worker puts its report before it exits, so check for exits first and then drain the queue
+        exited = [process for process in processes if process.exitcode is not None]
+        try:
+            reports.append(results.get(timeout=POLL_INTERVAL))
+            continue
+        except queue.Empty:
+            pass
+        if len(exited) > len(reports):
+            _terminate(processes)
+            codes = ", ".join(str(process.exitcode) for process in exited)
+            raise WorkerFailed(f"{len(exited) - len(reports)} worker(s) exited without reporting "
+                               f"(exit codes: {codes})")
+    for process in processes:
+        process.join()
+    errors = [report['error'] for report in reports if report.get('error')]
+    merged = merge_reports(reports)
+    merged['errors'] = errors
+    return merged
+
+def _terminate(processes):
+    for process in processes:
+        if process.is_alive():
+            process.terminate()
+        process.join()
+
+def _worker_processor(sink_options):
+    """Prepares Django in a worker process and builds its own routing index, sink and processor."""
+    import django
+    from django.apps import apps
+    if not apps.ready:
+        django.setup()
+    from django.db import connections
+    # Never share database connections inherited from the parent across a fork
+    connections.close_all()
+
+    from .data_sinks import build_sink
+    from .dead_letters import open_dead_letter_store
+    from .pipeline import MessageProcessor
+    from .routing import RoutingIndex
+
+    # The dead-letter spec travels with the sink options but builds a store of its own
+    sink_options = dict(sink_options)
+    dead_letters = open_dead_letter_store(sink_options.pop('dead_letters', 'none'))
+    routing = RoutingIndex(refresh_interval=sink_options.pop('routing_refresh', None)).load()
+    return MessageProcessor(routing, build_sink(**sink_options), dead_letters)
+
+def _run_worker(results, sink_options, chunks, source=None):
+    processor = None
+    try:
+        processor = _worker_processor(sink_options)
+        if source is not None:
+            source.dead_letters = processor.dead_letters
+        try:
+            for chunk in chunks:
+                for message in chunk:
+                    processor.process(message)
+                processor.routing.refresh_if_due()
+        finally:
+            processor.close()
+        report = processor.report()
+    except Exception as e:
+        report = processor.report() if processor is not None else {'counts': {}, 'failures': {}}
+        report['error'] = f"{type(e).__name__}: {e}"
+    report['malformed'] = getattr(source, 'malformed', 0)
+    results.put(report)
+
+def _sharded_worker(queue, results, sink_options):
+    chunks = iter(queue.get, None)
+    _run_worker(results, sink_options, chunks)
+    # After a failure keep consuming so the parent never blocks on a full queue
+    for _ in chunks:
+        pass
+
+def _range_worker(file_path, start, end, results, sink_options, source_class):
+    source = source_class(file_path, start_offset=start, end_offset=end)
+    if hasattr(source, 'read_batches'):
+        chunks = source.read_batches()
+    else:
+        chunks = ([message] for message in source.read_data())
+    _run_worker(results, sink_options, chunks, source)
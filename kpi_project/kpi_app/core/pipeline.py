@@ -0,0 +1,193 @@
+# kpi_app/pipeline.py
+
+import json
+import logging
+from collections import Counter
+from time import perf_counter
+
+from kpi_app.models.dead_letter import DeadLetter
+
+from .dead_letters import INVALID_MESSAGE, INVALID_VALUE, MISSING_FIELDS, NO_ROUTE
+from .metrics import EVALUATE, FAILURES, MESSAGES, ROUTE, SINK_WRITE, STAGE_SECONDS
+
+logger = logging.getLogger(__name__)
+
+PROCESSED = 'processed'
+SKIPPED = 'skipped'
+FAILED = 'failed'
+
+class MessageProcessor:
+    """
+    Evaluates messages against the routing index and writes results to a sink.
+
+    Keeps per-status counts and failure counts by error class so that several
+    processors (e.g. one per worker process) can be merged into one report.
+    With a `dead_letters` store, every message that is skipped or fails is
+    recorded there so it can be replayed later.
+    """
+
+    def __init__(self, routing, data_sink, dead_letters=None):
+        self.routing = routing
+        self.data_sink = data_sink
+        self.dead_letters = dead_letters
+        self.counts = {PROCESSED: 0, SKIPPED: 0, FAILED: 0}
+        self.failures = Counter()
+
+    def process(self, message):
+        """Processes one message, writes its results and records its status."""
+        status, rows = self.evaluate(message)
+        if rows:
+            # Write all results of the message to the data sink in one call
+            started = perf_counter()
+            try:
+                failures = self.data_sink.write_many(rows, [message] * len(rows))
+            except Exception as e:
+                failures = [(row, e) for row in rows]
+            STAGE_SECONDS.observe(perf_counter() - started, SINK_WRITE)
+            for row, error in failures:
+                self.fail(error, row[0], message.get('attribute_id'), message, DeadLetter.WRITE, row[1])
+            rejected = self.record_rejected()
+            if len(failures) + sum(1 for _, _, source in rejected if source is message) == len(rows):
+                status = FAILED
+            elif logger.isEnabledFor(logging.DEBUG):
+                for asset_id, attribute_id, _, result in rows:
+                    logger.debug("Processed message for Asset ID: %s, Attribute: %s, Result: %s",
+                                 asset_id, attribute_id, result)
+        self.record(status)
+        if self.dead_letters is not None:
+            self.dead_letters.flush_if_due()
+        return status
+
+    def record(self, status):
+        """Counts one finished message."""
+        self.counts[status] += 1
+        MESSAGES.inc(1, status)
+
+    def evaluate(self, message):
+        """
+        Evaluates one message without writing it.
+
+        Returns the processing status and the (asset_id, attribute_id, timestamp,
+        result) rows to write, one per linked KPI; failures are already recorded
+        in `failures`. A message is PROCESSED when at least one KPI produced a row.
+        """
+        asset_id = None
+        attribute_id = None
+
+        try:
+            # Ensure that message is a dictionary with necessary fields
+            if not isinstance(message, dict):
+                logger.debug("Skipping invalid message format. Expected JSON object.")
+                self.dead_letter(message, INVALID_MESSAGE, "Expected a JSON object.", DeadLetter.VALIDATE)
+                return SKIPPED, ()
+
+            # Extract fields with error handling for missing keys
+            asset_id = message.get('asset_id')
+            attribute_id = message.get('attribute_id')
+            timestamp = message.get('timestamp')
+            value = message.get('value')
+
+            # Check for null or missing values
+            if not asset_id or not attribute_id or not timestamp or value is None:
+                logger.debug("Skipping message with missing fields: %s", message)
+                present = {'asset_id': asset_id, 'attribute_id': attribute_id, 'timestamp': timestamp,
+                           'value': value is not None}
+                missing = [field for field, given in present.items() if not given]
+                self.dead_letter(message, MISSING_FIELDS, f"Missing or empty: {', '.join(missing)}.",
+                                 DeadLetter.VALIDATE)
+                return SKIPPED, ()
+
+            # Find every compiled KPI expression linked to this asset attribute
+            started = perf_counter()
+            fanout = self.routing.fanout(asset_id, attribute_id)
+            routed = perf_counter()
+            STAGE_SECONDS.observe(routed - started, ROUTE)
+            if fanout is None:
+                logger.debug("No AssetKPI found for asset_id: %s and attribute_id: %s", asset_id, attribute_id)
+                self.dead_letter(message, NO_ROUTE,
+                                 f"No AssetKPI found for asset_id: {asset_id} and attribute_id: {attribute_id}.",
+                                 DeadLetter.ROUTE)
+                return SKIPPED, ()
+
+            # Evaluate all linked KPIs at once, sharing the parsed value and common subexpressions
+            outcomes = fanout.evaluate(value)
+            STAGE_SECONDS.observe(perf_counter() - routed, EVALUATE)
+            if not outcomes:
+                logger.debug("Invalid numeric value for KPI calculation: %s", value)
+                self.dead_letter(message, INVALID_VALUE, f"Invalid numeric value for KPI calculation: {value!r}.",
+                                 DeadLetter.EVALUATE)
+                return SKIPPED, ()
+            rows = []
+            for route, result, error in outcomes:
+                if error is not None:
+                    self.fail(error, asset_id, attribute_id, message, DeadLetter.EVALUATE, route.output_attribute_id)
+                else:
+                    rows.append((asset_id, route.output_attribute_id, timestamp, result))
+            return (PROCESSED if rows else FAILED), rows
+
+        except json.JSONDecodeError:
+            logger.debug("Skipping invalid JSON format line.")
+            return SKIPPED, ()
+        except Exception as e:
+            return self.fail(e, asset_id, attribute_id, message), ()
+
+    def fail(self, error, asset_id, attribute_id, message=None, stage=DeadLetter.EVALUATE, output_attribute_id=''):
+        """Records a failed message and returns the FAILED status."""
+        self.failures[type(error).__name__] += 1
+        FAILURES.inc(1, type(error).__name__)
+        if self.dead_letters is not None and message is not None:
+            # The dead letter keeps the details; no need to log every failure
+            self.dead_letters.add(message, type(error).__name__, error, stage, output_attribute_id)
+            logger.debug("Dead-lettered message for asset_id: %s, attribute_id: %s: %s",
+                         asset_id, attribute_id, error)
+        else:
+            logger.warning("Unexpected error processing message for asset_id: %s, attribute_id: %s: %s",
+                           asset_id, attribute_id, error)
+        return FAILED
+
+    def dead_letter(self, message, error_class, reason, stage):
+        """Records a skipped message in the dead-letter store, if there is one."""
+        if self.dead_letters is not None:
+            self.dead_letters.add(message, error_class, reason, stage)
+
+    def record_rejected(self):
+        """
+        Records the rows that the sink's flushes rejected as failures of the
+        messages they came from, and returns them as (row, error, message).
+        """
+        rejected = self.data_sink.take_rejected()
+        for row, error, message in rejected:
+            attribute_id = message.get('attribute_id') if isinstance(message, dict) else None
+            self.fail(error, row[0], attribute_id, message, DeadLetter.WRITE, row[1])
+        return rejected
+
+    def flush_if_due(self):
+        """Writes buffered results and dead letters that have waited too long."""
+        try:
+            self.data_sink.flush_if_due()
+        finally:
+            self.record_rejected()
+        if self.dead_letters is not None:
+            self.dead_letters.flush_if_due()
+
+    def flush(self):
+        """Writes all buffered results and dead letters."""
+        try:
+            self.data_sink.flush()
+        finally:
+            self.record_rejected()
+        if self.dead_letters is not None:
+            self.dead_letters.flush()
+
+    def close(self):
+        """Closes the sink, then the dead-letter store."""
+        try:
+            self.data_sink.close()
+        finally:
+            self.record_rejected()
+            if self.dead_letters is not None:
+                self.dead_letters.close()
+
+    def report(self):
+        """Returns the counts as a plain dict that can cross process boundaries."""
+        return {'counts': dict(self.counts), 'failures': dict(self.failures)}
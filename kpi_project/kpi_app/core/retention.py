@@ -0,0 +1,144 @@
+# kpi_app/retention.py
+
+"""
+Expiry of evaluation results according to RetentionPolicy rows.
+
+Where rollups are in use, raw rows are folded into them before they are
+deleted, so a series keeps its minute/hour/day history after its raw rows
+expire, until the rollups expire in turn.
+
+Deletion runs series by series in batches of `batch_size` rows. Each batch
+selects its ids through the (asset_id, attribute_id, timestamp) index and
+deletes them by primary key in one short transaction; EvaluationLog and
+EvaluationRollup have no relations or delete signals, so Django issues a
+single DELETE without loading the rows. Writers only ever wait for one batch.
+
+The archive is already partitioned by day, so archived rows expire by
+removing whole segment files.
+
+Dead letters are not tied to a series; they expire after the
+DEAD_LETTER_RETENTION_DAYS setting, whether or not policies exist.
+"""
+
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from kpi_app.models.dead_letter import DeadLetter
+from kpi_app.models.evaluation_log import EvaluationLog
+from kpi_app.models.evaluation_rollup import EvaluationRollup, RollupWatermark
+from kpi_app.models.retention_policy import RetentionPolicy
+from .archive import ONE_DAY, ArchiveReader
+from .rollups import RollupBuilder
+
+RAW = 'raw'
+
+# Buckets are only dropped once they end before the cutoff
+BUCKET_SPANS = {
+    EvaluationRollup.MINUTE: timedelta(minutes=1),
+    EvaluationRollup.HOUR: timedelta(hours=1),
+    EvaluationRollup.DAY: timedelta(days=1),
+}
+
+class PolicySet:
+    """Resolves the policy that applies to an asset attribute, most specific first."""
+
+    def __init__(self, policies):
+        self._policies = {(policy.asset_id, policy.attribute_id): policy for policy in policies}
+
+    def __bool__(self):
+        return bool(self._policies)
+
+    def resolve(self, asset_id, attribute_id):
+        for key in ((asset_id, attribute_id), (asset_id, ''), ('', attribute_id), ('', '')):
+            policy = self._policies.get(key)
+            if policy is not None:
+                return policy
+        return None
+
+class Purger:
+    """
+    Deletes evaluation results older than their retention period. With
+    `dry_run`, counts what would be deleted instead.
+    """
+
+    def __init__(self, batch_size=1000, pause=0.0, rollups=True, dry_run=False, archive_root=None, now=None):
+        if batch_size <= 0:
+            raise ValueError("batch_size must be a positive integer")
+        self.batch_size = batch_size
+        self.pause = pause
+        self.rollups = rollups
+        self.dry_run = dry_run
+        self.archive = ArchiveReader(archive_root)
+        self.now = now or timezone.now()
+
+    def cutoff(self, policy, kind):
+        """Returns the datetime before which data of this kind expires, or None to keep it."""
+        if policy is None or policy.days(kind) is None:
+            return None
+        return self.now - timedelta(days=policy.days(kind))
+
+    def purge(self):
+        """Applies every policy; returns the number of rows (or segment files, or dead letters) deleted per kind."""
+        deleted = {RAW: 0, **{resolution: 0 for resolution in BUCKET_SPANS}, 'segments': 0, 'dead_letters': 0}
+        dead_letter_days = getattr(settings, 'DEAD_LETTER_RETENTION_DAYS', None)
+        if dead_letter_days is not None:
+            deleted['dead_letters'] = self.delete_in_batches(
+                DeadLetter.objects.filter(created_at__lt=self.now - timedelta(days=dead_letter_days)), 'created_at')
+
+        policies = PolicySet(RetentionPolicy.objects.all())
+        if not policies:
+            return deleted
+
+        if self.rollups and not self.dry_run and RollupWatermark.objects.exists():
+            # Only fold expiring rows in where rollups are in use; a first build would scan the whole table
+            RollupBuilder().build()
+
+        series = EvaluationLog.objects.values_list('asset_id', 'attribute_id').distinct().order_by()
+        for asset_id, attribute_id in list(series):
+            cutoff = self.cutoff(policies.resolve(asset_id, attribute_id), RAW)
+            if cutoff is not None:
+                deleted[RAW] += self.delete_in_batches(
+                    EvaluationLog.objects.filter(asset_id=asset_id, attribute_id=attribute_id, timestamp__lt=cutoff),
+                    'timestamp',
+                )
+
+        series = EvaluationRollup.objects.values_list('asset_id', 'attribute_id', 'resolution').distinct().order_by()
+        for asset_id, attribute_id, resolution in list(series):
+            cutoff = self.cutoff(policies.resolve(asset_id, attribute_id), resolution)
+            if cutoff is not None:
+                deleted[resolution] += self.delete_in_batches(
+                    EvaluationRollup.objects.filter(
+                        asset_id=asset_id, attribute_id=attribute_id, resolution=resolution,
+                        bucket_start__lte=cutoff - BUCKET_SPANS[resolution],
+                    ),
+                    'bucket_start',
+                )
+
+        for day, asset_id, attribute_id, path in list(self.archive.segment_paths()):
+            cutoff = self.cutoff(policies.resolve(asset_id, attribute_id), RAW)
+            if cutoff is not None and day + ONE_DAY <= cutoff:
+                if not self.dry_run:
+                    # Out of the index first: a crash leaves an unlisted file rather than a listed missing one
+                    self.archive.index.remove(path)
+                    path.unlink()
+                deleted['segments'] += 1
+        return deleted
+
+    def delete_in_batches(self, queryset, field):
+        """Deletes the queryset's rows oldest first, `batch_size` rows per transaction."""
+        if self.dry_run:
+            return queryset.count()
+        deleted = 0
+        while True:
+            with transaction.atomic():
+                ids = list(queryset.order_by(field, 'id').values_list('id', flat=True)[:self.batch_size])
+                if ids:
+                    deleted += queryset.model.objects.filter(id__in=ids).delete()[0]
+            if len(ids) < self.batch_size:
+                return deleted
+            if self.pause:
+                time.sleep(self.pause)
@@ -0,0 +1,107 @@
+# kpi_app/rollups.py
+
+from django.db import transaction
+from django.db.models import Count, Max, Min, Q, Sum
+from django.db.models.functions import Trunc
+
+from kpi_app.models.evaluation_log import EvaluationLog
+from kpi_app.models.evaluation_rollup import EvaluationRollup, RollupWatermark
+
+WATERMARK_NAME = 'evaluation_rollups'
+
+class RollupBuilder:
+    """
+    Folds new EvaluationLog rows into minute/hour/day EvaluationRollup buckets.
+
+    Progress is tracked with a watermark on EvaluationLog.id, so each run only
+    aggregates rows inserted since the previous one, and running it from the
+    sink after every flush and from `build_rollups` never counts a row twice.
+    Rows whose ids commit out of order (concurrent writers on databases with
+    sequence-allocated ids) can be missed and need a rebuild with `reset()`.
+    """
+
+    resolutions = [EvaluationRollup.MINUTE, EvaluationRollup.HOUR, EvaluationRollup.DAY]
+    lookup_batch_size = 200
+
+    def __init__(self, chunk_size=50000):
+        self.chunk_size = chunk_size
+
+    def build(self):
+        """Processes all pending rows in chunks; returns the number of rows folded in."""
+        total = 0
+        while True:
+            processed = self.build_chunk()
+            total += processed
+            if processed < self.chunk_size:
+                return total
+
+    def build_chunk(self):
+        """Folds up to `chunk_size` pending rows into the rollups in one transaction."""
+        with transaction.atomic():
+            watermark, _ = RollupWatermark.objects.select_for_update().get_or_create(name=WATERMARK_NAME)
+            upper_ids = list(
+                EvaluationLog.objects.filter(id__gt=watermark.last_log_id)
+                .order_by('id').values_list('id', flat=True)[self.chunk_size - 1:self.chunk_size]
+            )
+            pending = EvaluationLog.objects.filter(id__gt=watermark.last_log_id)
+            if upper_ids:
+                pending = pending.filter(id__lte=upper_ids[0])
+            last_id = pending.aggregate(last=Max('id'), rows=Count('id'))
+            if not last_id['rows']:
+                return 0
+
+            for resolution in self.resolutions:
+                self.merge(resolution, self.aggregate(pending, resolution))
+
+            watermark.last_log_id = last_id['last']
+            watermark.save(update_fields=['last_log_id'])
+            return last_id['rows']
+
+    def aggregate(self, queryset, resolution):
+        """Aggregates rows per asset, attribute and bucket in the database."""
+        return (
+            queryset.annotate(bucket=Trunc('timestamp', resolution))
+            .values('asset_id', 'attribute_id', 'bucket')
+            .annotate(count=Count('id'), sum=Sum('result'), min=Min('result'), max=Max('result'))
+            .order_by()
+        )
+
+    def merge(self, resolution, deltas):
+        """Adds aggregated deltas to existing buckets and creates the missing ones."""
+        deltas = {(row['asset_id'], row['attribute_id'], row['bucket']): row for row in deltas}
+        if not deltas:
+            return
+
+        existing = {}
+        keys = list(deltas)
+        # Look buckets up in slices to stay within the database's expression limits
+        for i in range(0, len(keys), self.lookup_batch_size):
+            match = Q()
+            for asset_id, attribute_id, bucket in keys[i:i + self.lookup_batch_size]:
+                match |= Q(asset_id=asset_id, attribute_id=attribute_id, bucket_start=bucket)
+            for rollup in EvaluationRollup.objects.filter(match, resolution=resolution):
+                existing[(rollup.asset_id, rollup.attribute_id, rollup.bucket_start)] = rollup
+
+        updated = []
+        created = []
+        for key, delta in deltas.items():
+            rollup = existing.get(key)
+            if rollup is None:
+                created.append(EvaluationRollup(
+                    asset_id=key[0], attribute_id=key[1], resolution=resolution, bucket_start=key[2],
+                    count=delta['count'], sum=delta['sum'], min=delta['min'], max=delta['max'],
+                ))
+            else:
+                rollup.count += delta['count']
+                rollup.sum += delta['sum']
+                rollup.min = min(rollup.min, delta['min'])
+                rollup.max = max(rollup.max, delta['max'])
+                updated.append(rollup)
+        EvaluationRollup.objects.bulk_create(created, batch_size=self.lookup_batch_size)
+        EvaluationRollup.objects.bulk_update(updated, ['count', 'sum', 'min', 'max'], batch_size=self.lookup_batch_size)
+
+    def reset(self):
+        """Drops every rollup and rewinds the watermark so the next build starts over."""
+        with transaction.atomic():
+            EvaluationRollup.objects.all().delete()
+            RollupWatermark.objects.filter(name=WATERMARK_NAME).update(last_log_id=0)
@@ -0,0 +1,184 @@
+# kpi_app/routing.py
+
+import threading
+import time
+from .fanout import FanOut
+from .interpreter import CustomInterpreter
+
+class Route:
+    """A compiled KPI expression linked to one asset attribute through an AssetKPI."""
+
+    def __init__(self, asset_kpi_id, asset_pk, asset_id, attribute_id, kpi_id, expression, interpreter,
+                 output_attribute_id=None):
+        self.asset_kpi_id = asset_kpi_id
+        self.asset_pk = asset_pk
+        self.asset_id = asset_id
+        self.attribute_id = attribute_id
+        self.kpi_id = kpi_id
+        self.output_attribute_id = output_attribute_id or f"output_{attribute_id}"
+        self.set_expression(expression, interpreter)
+
+    @property
+    def key(self):
+        return (self.asset_id, self.attribute_id)
+
+    def set_expression(self, expression, interpreter):
+        """Compiles the expression, keeping the error so it surfaces per message like before."""
+        self.expression = expression
+        try:
+            self.compiled = interpreter.get_compiled(expression)
+            self.error = None
+        except ValueError as e:
+            self.compiled = None
+            self.error = e
+
+    def evaluate(self, attr_value):
+        if self.error is not None:
+            raise self.error
+        return self.compiled.evaluate(attr_value)
+
+class RoutingIndex:
+    """
+    In-memory map from (asset_id, attribute_id) to the routes that evaluate it.
+
+    The index is loaded with a single query and then kept in sync incrementally
+    by the model signals in `kpi_app.signals` once the changes commit, so the
+    message pipeline can route messages without touching the database. Changes
+    made in other processes, or through `bulk_create`/`update()` (which do not
+    send signals), are picked up by the next `load()`; with `refresh_interval`
+    set, `refresh_if_due()` reloads the index once it is that many seconds old.
+
+    Each route writes to the output attribute stored on its AssetKPI, so the
+    series a KPI writes to does not change when other links are added or removed.
+    """
+
+    def __init__(self, interpreter=None, refresh_interval=None):
+        self.interpreter = interpreter or CustomInterpreter()
+        self.refresh_interval = refresh_interval
+        self.loaded_at = None
+        self.is_loaded = False
+        self._routes = {}
+        self._by_link = {}
+        self._fanouts = {}
+        self._lock = threading.RLock()
+
+    def load(self):
+        """(Re)builds the whole index with one select_related query."""
+        from kpi_app.models.asset_kpi import AssetKPI
+
+        links = AssetKPI.objects.select_related('asset', 'kpi').only(
+            'id', 'attribute_id', 'output_attribute_id', 'asset__id', 'asset__asset_id', 'kpi__id', 'kpi__expression'
+        )
+        with self._lock:
+            # Build the new maps aside and swap them in, so lookups never see a half-loaded index
+            by_link = {}
+            routes = {}
+            for link in links.iterator():
+                route = self._route_for(link)
+                by_link[route.asset_kpi_id] = route
+                routes.setdefault(route.key, []).append(route)
+            self._by_link = by_link
+            self._routes = {key: tuple(sorted(group, key=lambda r: r.asset_kpi_id)) for key, group in routes.items()}
+            self._fanouts = {}
+            self.loaded_at = time.monotonic()
+            self.is_loaded = True
+        return self
+
+    def refresh_if_due(self):
+        """Reloads the index if it is older than `refresh_interval`; returns whether it did."""
+        if not self.refresh_interval or self.loaded_at is None:
+            return False
+        if time.monotonic() - self.loaded_at < self.refresh_interval:
+            return False
+        self.load()
+        return True
+
+    def lookup(self, asset_id, attribute_id):
+        """Returns the routes for an asset attribute, or an empty tuple."""
+        return self._routes.get((asset_id, attribute_id), ())
+
+    def fanout(self, asset_id, attribute_id):
+        """
+        Returns the FanOut evaluating every route of an asset attribute, or None.
+
+        FanOuts are built on first use and rebuilt whenever the routes change.
+        """
+        routes = self._routes.get((asset_id, attribute_id))
+        if not routes:
+            return None
+        fanout = self._fanouts.get((asset_id, attribute_id))
+        if fanout is None or fanout.routes is not routes:
+            fanout = self._fanouts[(asset_id, attribute_id)] = FanOut(routes)
+        return fanout
+
+    def __len__(self):
+        return len(self._by_link)
+
+    def asset_kpi_saved(self, asset_kpi):
+        with self._lock:
+            self._remove(asset_kpi.pk)
+            self._add(self._route_for(asset_kpi))
+
+    def asset_kpi_deleted(self, asset_kpi):
+        with self._lock:
+            self._remove(asset_kpi.pk)
+
+    def kpi_saved(self, kpi):
+        with self._lock:
+            for route in self._by_link.values():
+                if route.kpi_id == kpi.pk and route.expression != kpi.expression:
+                    route.set_expression(kpi.expression, self.interpreter)
+                    self._fanouts.pop(route.key, None)
+
+    def kpi_deleted(self, kpi):
+        with self._lock:
+            for link_id in [r.asset_kpi_id for r in self._by_link.values() if r.kpi_id == kpi.pk]:
+                self._remove(link_id)
+
+    def asset_saved(self, asset):
+        with self._lock:
+            for route in [r for r in self._by_link.values() if r.asset_pk == asset.pk]:
+                if route.asset_id != asset.asset_id:
+                    self._remove(route.asset_kpi_id)
+                    route.asset_id = asset.asset_id
+                    self._add(route)
+
+    def asset_deleted(self, asset):
+        with self._lock:
+            for link_id in [r.asset_kpi_id for r in self._by_link.values() if r.asset_pk == asset.pk]:
+                self._remove(link_id)
+
+    def _route_for(self, asset_kpi):
+        return Route(
+            asset_kpi_id=asset_kpi.pk,
+            asset_pk=asset_kpi.asset.pk,
+            asset_id=asset_kpi.asset.asset_id,
+            attribute_id=asset_kpi.attribute_id,
+            kpi_id=asset_kpi.kpi.pk,
+            expression=asset_kpi.kpi.expression,
+            interpreter=self.interpreter,
+            output_attribute_id=asset_kpi.output_attribute_id,
+        )
+
+    def _add(self, route):
+        # Route tuples are replaced, never mutated, so lookups need no lock
+        self._by_link[route.asset_kpi_id] = route
+        self._set_routes(route.key, self._routes.get(route.key, ()) + (route,))
+
+    def _remove(self, asset_kpi_id):
+        route = self._by_link.pop(asset_kpi_id, None)
+        if route is None:
+            return
+        remaining = tuple(r for r in self._routes.get(route.key, ()) if r.asset_kpi_id != asset_kpi_id)
+        self._set_routes(route.key, remaining)
+
+    def _set_routes(self, key, routes):
+        """Stores the routes of one attribute, ordered by link id."""
+        self._fanouts.pop(key, None)
+        if not routes:
+            self._routes.pop(key, None)
+            return
+        self._routes[key] = tuple(sorted(routes, key=lambda r: r.asset_kpi_id))
+
+# Process-wide index, loaded on demand by the message pipeline
+routing_index = RoutingIndex()
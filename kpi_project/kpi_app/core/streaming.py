@@ -0,0 +1,318 @@
+# kpi_app/streaming.py
+
+"""
+Streaming data sources for running the evaluator as a long-lived service.
+
+Each source reads newline-delimited JSON on a background thread into a
+bounded queue. When the queue is full the reader blocks, which pushes back on
+the producer (a full pipe, TCP flow control, or simply not reading the file
+further). `read_batches()` yields lists of decoded messages as soon as they
+are available and an empty list after `idle_timeout` seconds without input,
+so callers can flush buffered sinks while the stream is quiet.
+"""
+
+import asyncio
+import glob
+import logging
+import os
+import queue
+import socketserver
+import sys
+import threading
+from abc import abstractmethod
+from time import perf_counter
+from urllib.parse import urlparse
+
+from .data_sources import JSON_ERRORS, FileDataSource, MappedFileDataSource, decode_json
+from .interfaces import DataSource
+from .metrics import MALFORMED_LINES, PARSE, QUEUE_DEPTH, STAGE_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Marks the end of a finite stream in the queue
+_END = object()
+
+class StreamingDataSource(DataSource):
+    """Base class for sources fed by a background reader thread."""
+
+    def __init__(self, batch_size=256, max_buffer=10000, idle_timeout=1.0):
+        self.batch_size = batch_size
+        self.idle_timeout = idle_timeout
+        self.malformed = 0
+        self._lines = queue.Queue(maxsize=max_buffer)
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def read_data(self):
+        """
+        Generator function to yield messages until the stream ends or `stop()` is called.
+
+        Yields:
+            dict: Message data as dictionary.
+        """
+        for batch in self.read_batches():
+            yield from batch
+
+    def read_batches(self):
+        """
+        Generator function to yield lists of decoded messages; empty lists mark idle periods.
+
+        Yields:
+            list: Decoded messages in arrival order.
+        """
+        self.start()
+        try:
+            while not self._stopped.is_set():
+                try:
+                    line = self._lines.get(timeout=self.idle_timeout)
+                except queue.Empty:
+                    yield []
+                    continue
+                lines = [line]
+                while len(lines) < self.batch_size:
+                    try:
+                        lines.append(self._lines.get_nowait())
+                    except queue.Empty:
+                        break
+                ended = _END in lines
+                if ended:
+                    lines = lines[:lines.index(_END)]
+                batch = self.decode(lines)
+                if batch:
+                    yield batch
+                if ended:
+                    return
+        finally:
+            self.stop()
+
+    async def aread_data(self, batch_size=None):
+        """
+        Async variant of read_data that hands on every batch as soon as it
+        arrives. Idle periods yield nothing; the async pipeline's writer
+        flushes buffered sinks on its own idle timeout meanwhile.
+        """
+        batches = self.read_batches()
+        try:
+            while True:
+                batch = await asyncio.to_thread(next, batches, None)
+                if batch is None:
+                    return
+                for message in batch:
+                    yield message
+        finally:
+            self.stop()
+
+    def decode(self, lines):
+        messages = []
+        started = perf_counter()
+        for line in lines:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                messages.append(decode_json(line))
+            except JSON_ERRORS as e:
+                self.malformed += 1
+                MALFORMED_LINES.inc()
+                logger.debug("Malformed JSON line from %s: %r", self, line[:200])
+                if self.dead_letters is not None:
+                    self.dead_letters.add_malformed(line, e)
+        STAGE_SECONDS.observe_many(perf_counter() - started, len(lines), PARSE)
+        return messages
+
+    def start(self):
+        """Starts the background reader if it is not running yet."""
+        if self._thread is None:
+            QUEUE_DEPTH.track(self._lines.qsize, 'source')
+            self._thread = threading.Thread(target=self._run, name=f"{type(self).__name__}-reader", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Asks the reader to stop; `read_data()` returns after the current batch."""
+        self._stopped.set()
+        QUEUE_DEPTH.untrack('source')
+
+    def put_line(self, line):
+        """Queues one raw line, waiting while the buffer is full. Returns False once stopped."""
+        while not self._stopped.is_set():
+            try:
+                self._lines.put(line, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _run(self):
+        try:
+            self.produce()
+        except Exception:
+            logger.exception("Reader of %s failed", self)
+        finally:
+            self.put_line(_END)
+
+    @abstractmethod
+    def produce(self):
+        """Reads raw lines and passes them to `put_line` until the stream ends."""
+        pass
+
+class StdinDataSource(StreamingDataSource):
+    """Reads messages piped to standard input until end of file."""
+
+    def __init__(self, stream=None, **kwargs):
+        super().__init__(**kwargs)
+        self.stream = stream
+
+    def produce(self):
+        stream = self.stream if self.stream is not None else sys.stdin.buffer
+        for line in stream:
+            if not self.put_line(line):
+                return
+
+    def __str__(self):
+        return "stdin"
+
+class TCPDataSource(StreamingDataSource):
+    """
+    Listens on a TCP port and reads newline-delimited JSON from every client
+    connection. Runs until `stop()` is called.
+    """
+
+    def __init__(self, host='0.0.0.0', port=9000, **kwargs):
+        super().__init__(**kwargs)
+        self.host = host
+        self.port = port
+        self.server = None
+        self.ready = threading.Event()
+
+    def produce(self):
+        source = self
+
+        class LineHandler(socketserver.StreamRequestHandler):
+            def handle(self):
+                for line in self.rfile:
+                    if not source.put_line(line):
+                        return
+
+        class Server(socketserver.ThreadingTCPServer):
+            allow_reuse_address = True
+            daemon_threads = True
+
+        with Server((self.host, self.port), LineHandler) as server:
+            self.server = server
+            self.port = server.server_address[1]
+            self.ready.set()
+            server.serve_forever(poll_interval=0.5)
+
+    def stop(self):
+        super().stop()
+        if self.server is not None:
+            threading.Thread(target=self.server.shutdown, daemon=True).start()
+
+    def __str__(self):
+        return f"tcp://{self.host}:{self.port}"
+
+class TailDataSource(StreamingDataSource):
+    """
+    Follows appended lines of a file, or of every file matching `pattern` in a
+    directory, like `tail -F`: files that are truncated or replaced (rotated)
+    are reopened from the start, and new files in a directory are picked up.
+    Existing content is skipped unless `from_start` is set.
+    """
+
+    def __init__(self, path, pattern='*', from_start=False, poll_interval=0.5, **kwargs):
+        super().__init__(**kwargs)
+        self.path = path
+        self.pattern = pattern
+        self.from_start = from_start
+        self.poll_interval = poll_interval
+        self._files = {}
+
+    def produce(self):
+        first_scan = True
+        while not self._stopped.is_set():
+            for path in self.paths():
+                self.follow(path, skip_existing=first_scan and not self.from_start)
+            first_scan = False
+            read_any = False
+            for path in list(self._files):
+                read_any |= self.read_appended(path)
+            if not read_any:
+                self._stopped.wait(self.poll_interval)
+        for tailed in self._files.values():
+            tailed['file'].close()
+
+    def paths(self):
+        if os.path.isdir(self.path):
+            return sorted(p for p in glob.glob(os.path.join(self.path, self.pattern)) if os.path.isfile(p))
+        return [self.path] if os.path.isfile(self.path) else []
+
+    def follow(self, path, skip_existing=False):
+        """Opens `path` if it is new, or reopens it if it has been rotated."""
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return
+        tailed = self._files.get(path)
+        if tailed is not None:
+            rotated = stat.st_ino != tailed['inode']
+            truncated = stat.st_size < tailed['file'].tell()
+            if not (rotated or truncated):
+                return
+            if rotated:
+                # Drain what the writer appended to the old file before the rotation
+                self.read_appended(path)
+            tailed['file'].close()
+            skip_existing = False
+        handle = open(path, 'rb')
+        if skip_existing:
+            handle.seek(0, os.SEEK_END)
+        self._files[path] = {'file': handle, 'inode': os.fstat(handle.fileno()).st_ino, 'partial': b''}
+
+    def read_appended(self, path):
+        """Queues the complete lines appended to `path` since the last read."""
+        tailed = self._files[path]
+        data = tailed['file'].read()
+        if not data:
+            return False
+        data = tailed['partial'] + data
+        lines = data.split(b'\n')
+        # Keep an incomplete last line until the writer finishes it
+        tailed['partial'] = lines.pop()
+        for line in lines:
+            if not self.put_line(line):
+                break
+        return True
+
+    def __str__(self):
+        return f"tail://{self.path}"
+
+def open_source(uri, mmap=False, **offsets):
+    """
+    Builds a data source from a URI:
+
+    - `-` or `stdin:`: standard input
+    - `tcp://host:port`: newline-delimited JSON over TCP
+    - `tail:///path`: follow a file or directory (`?pattern=*.jsonl&from_start=1`)
+    - `file:///path` or a plain path: read a file once
+    """
+    if uri in ('-', 'stdin:', 'stdin://'):
+        return StdinDataSource()
+    parsed = urlparse(uri)
+    if parsed.scheme == 'tcp':
+        if not parsed.port:
+            raise ValueError(f"TCP source needs a port: {uri}")
+        return TCPDataSource(parsed.hostname or '0.0.0.0', parsed.port)
+    if parsed.scheme == 'tail':
+        params = dict(pair.split('=', 1) for pair in parsed.query.split('&') if '=' in pair)
+        return TailDataSource(
+            parsed.netloc + parsed.path,
+            pattern=params.get('pattern', '*'),
+            from_start=params.get('from_start', '0') in ('1', 'true', 'yes'),
+        )
+    if parsed.scheme == 'file':
+        uri = parsed.netloc + parsed.path
+    elif parsed.scheme and len(parsed.scheme) > 1:
+        # One-letter schemes are Windows drive letters, not URIs
+        raise ValueError(f"Unsupported source URI: {uri}")
+    source_class = MappedFileDataSource if mmap else FileDataSource
+    return source_class(uri, **offsets)
@@ -0,0 +1,77 @@
+# kpi_app/throttling.py
+
+import time
+from datetime import datetime, timezone
+
+class TokenBucket:
+    """
+    Token-bucket rate limiter. `acquire()` blocks until a token is available,
+    allowing short bursts of up to `burst` messages above the steady `rate`.
+    """
+
+    def __init__(self, rate, burst=None, clock=time.monotonic, sleep=time.sleep):
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        self.rate = rate
+        self.capacity = burst if burst is not None else max(1.0, rate)
+        self.tokens = self.capacity
+        self._clock = clock
+        self._sleep = sleep
+        self._last = clock()
+
+    def acquire(self):
+        """Takes one token, sleeping until one has been refilled if necessary."""
+        now = self._clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self._last) * self.rate)
+        self._last = now
+        if self.tokens < 1:
+            wait = (1 - self.tokens) / self.rate
+            self._sleep(wait)
+            self._last = self._clock()
+            self.tokens = 0
+        else:
+            self.tokens -= 1
+
+class TimestampPacer:
+    """
+    Paces replay of recorded messages by the deltas between their own
+    timestamps, so a recorded stream is replayed at its original speed
+    (or `speed` times faster).
+    """
+
+    def __init__(self, speed=1.0, clock=time.monotonic, sleep=time.sleep):
+        if speed <= 0:
+            raise ValueError("speed must be positive")
+        self.speed = speed
+        self._clock = clock
+        self._sleep = sleep
+        self._first_timestamp = None
+        self._started_at = None
+
+    def wait_for(self, timestamp):
+        """Sleeps until the message with `timestamp` is due. Unparseable or out-of-order timestamps are not delayed."""
+        moment = parse_timestamp(timestamp)
+        if moment is None:
+            return
+        if self._first_timestamp is None:
+            self._first_timestamp = moment
+            self._started_at = self._clock()
+            return
+        offset = (moment - self._first_timestamp).total_seconds() / self.speed
+        delay = self._started_at + offset - self._clock()
+        if delay > 0:
+            self._sleep(delay)
+
+def parse_timestamp(value):
+    """Parses an ISO 8601 message timestamp, returning None when it is not valid."""
+    if isinstance(value, datetime):
+        moment = value
+    else:
+        try:
+            moment = datetime.fromisoformat(str(value))
+        except ValueError:
+            return None
+    # Treat naive timestamps as UTC so they can be compared with aware ones
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return moment
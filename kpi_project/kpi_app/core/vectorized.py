@@ -0,0 +1,169 @@
+# kpi_app/vectorized.py
+
+"""
+Vectorized evaluation of KPI expressions over arrays of values.
+
+Arithmetic ASTs are compiled into NumPy array operations, so one KPI can be
+evaluated over millions of readings without a Python-level loop per value.
+NumPy is an optional dependency; it is only imported when this module is used.
+"""
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - exercised only without numpy installed
+    np = None
+
+from .interpreter import Attr, BinOp, Num, RegexOp, UnaryOp, compile_pattern
+
+class BatchResult:
+    """
+    Results of evaluating one expression over many values.
+
+    `values[i]` is the result for input `i` and is only meaningful where
+    `errors[i]` is False. Rows that failed (non-numeric input, division by
+    zero) are flagged in `errors` instead of raising.
+    """
+
+    def __init__(self, values, errors):
+        self.values = values
+        self.errors = errors
+
+    def __len__(self):
+        return len(self.values)
+
+    def tolist(self):
+        """Returns the results as Python objects, with None for failed rows."""
+        return [None if error else value for value, error in zip(self.values.tolist(), self.errors.tolist())]
+
+def require_numpy():
+    if np is None:
+        raise ImportError("Vectorized evaluation requires numpy; install it with `pip install numpy`.")
+
+def evaluate_many(compiled, values):
+    """Evaluates a CompiledExpression for every element of `values`."""
+    require_numpy()
+    function = getattr(compiled, '_vectorized', None)
+    if function is None:
+        function = compile_ast(compiled.ast)
+        compiled._vectorized = function
+
+    if compiled.is_regex:
+        return function(values)
+    numbers, errors = to_float_array(values)
+    with np.errstate(over='ignore', invalid='ignore'):
+        result, result_errors = function(numbers)
+    result = np.broadcast_to(np.asarray(result, dtype=float), numbers.shape)
+    # NaN and infinite inputs, and results that overflowed, are errors as in the scalar path
+    non_finite = ~np.isfinite(numbers) | ~np.isfinite(result)
+    return BatchResult(result, errors | result_errors | non_finite)
+
+# Inputs NumPy may convert in one call. Anything else, notably booleans (which
+# NumPy would turn into 0/1 but to_number rejects), is converted value by value,
+# so whether a row fails never depends on the other rows in its batch.
+FAST_TYPES = frozenset((int, float, str))
+FAST_KINDS = 'iufU'
+
+def to_float_array(values):
+    """Converts input values to a float array, flagging entries that are not numbers."""
+    if isinstance(values, np.ndarray):
+        fast = values.dtype.kind in FAST_KINDS
+    else:
+        if not isinstance(values, (list, tuple)):
+            values = list(values)
+        fast = set(map(type, values)) <= FAST_TYPES
+    if fast:
+        try:
+            numbers = np.asarray(values, dtype=float)
+            if numbers.ndim != 1:
+                raise ValueError("values must be one-dimensional")
+            return numbers, np.zeros(numbers.shape, dtype=bool)
+        except (TypeError, ValueError, OverflowError):
+            pass
+
+    values = list(values)
+    numbers = np.empty(len(values), dtype=float)
+    errors = np.zeros(len(values), dtype=bool)
+    for i, value in enumerate(values):
+        try:
+            if isinstance(value, (bool, np.bool_)):
+                raise ValueError
+            numbers[i] = float(value)
+        except (TypeError, ValueError, OverflowError):
+            numbers[i] = np.nan
+            errors[i] = True
+    return numbers, errors
+
+def compile_ast(node):
+    """
+    Compiles an AST into a function of the ATTR array.
+
+    Arithmetic functions return `(values, errors)`; regex functions return a
+    BatchResult directly since they operate on strings.
+    """
+    if isinstance(node, RegexOp):
+        return compile_regex(node.pattern)
+    return compile_arithmetic(node)
+
+def compile_arithmetic(node):
+    if isinstance(node, Num):
+        value = node.value
+        return lambda x: (value, False)
+    elif isinstance(node, Attr):
+        return lambda x: (x, False)
+    elif isinstance(node, UnaryOp):
+        operand = compile_arithmetic(node.expr)
+        if node.op == '-':
+            def negate(x):
+                value, errors = operand(x)
+                return np.negative(value), errors
+            return negate
+        return operand
+    elif isinstance(node, BinOp):
+        left = compile_arithmetic(node.left)
+        right = compile_arithmetic(node.right)
+        if node.op == '/':
+            def divide(x):
+                left_val, left_errors = left(x)
+                right_val, right_errors = right(x)
+                zero = np.equal(right_val, 0)
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    value = np.true_divide(left_val, right_val)
+                value = np.where(zero, np.nan, value)
+                return value, left_errors | right_errors | zero
+            return divide
+        if node.op == '//':
+            def floor_divide(x):
+                left_val, left_errors = left(x)
+                right_val, right_errors = right(x)
+                zero = np.equal(right_val, 0)
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    value = np.floor_divide(left_val, right_val)
+                value = np.where(zero, np.nan, value)
+                return value, left_errors | right_errors | zero
+            return floor_divide
+        # float_power also takes constant integer operands such as `2 ** -1`; overflowing
+        # powers and negative bases with fractional exponents come out as inf/NaN,
+        # which evaluate_many flags as errors like the scalar path does
+        ufunc = {'+': np.add, '-': np.subtract, '*': np.multiply, '**': np.float_power}.get(node.op)
+        if ufunc is None:
+            raise ValueError(f"Unknown operator: {node.op}")
+        def binary(x):
+            left_val, left_errors = left(x)
+            right_val, right_errors = right(x)
+            return ufunc(left_val, right_val), left_errors | right_errors
+        return binary
+    raise ValueError(f"Unknown AST node: {type(node)}")
+
+def compile_regex(pattern):
+    regex = compile_pattern(pattern)
+
+    def match(values):
+        # Match each distinct value once and scatter the outcome back to every row
+        strings = np.asarray([str(value) for value in values], dtype=object)
+        if not len(strings):
+            return BatchResult(np.empty(0, dtype='<U5'), np.zeros(0, dtype=bool))
+        unique, inverse = np.unique(strings.astype(str), return_inverse=True)
+        matched = np.fromiter((regex.fullmatch(s) is not None for s in unique), dtype=bool, count=len(unique))
+        result = np.where(matched[inverse], "True", "False")
+        return BatchResult(result, np.zeros(len(strings), dtype=bool))
+    return match
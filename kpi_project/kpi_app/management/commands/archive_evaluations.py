@@ -0,0 +1,50 @@
+# kpi_app/management/commands/archive_evaluations.py
+
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from kpi_app.core.archive import CODECS, ArchiveReader, Archiver
+
+class Command(BaseCommand):
+    help = ("Move EvaluationLog rows of closed days into the columnar archive, one segment per asset, "
+            "attribute and day.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--before', type=str,
+                            help="Archive the days before the one containing this ISO 8601 datetime "
+                                 "(default: today minus --keep-days)")
+        parser.add_argument('--keep-days', type=int, default=7,
+                            help="Number of recent days left in the database when --before is not given")
+        parser.add_argument('--codec', choices=list(CODECS), default='none',
+                            help="Compression codec for new segments; 'none' segments are read via mmap")
+        parser.add_argument('--root', type=str,
+                            help="Archive directory (default: the EVALUATION_ARCHIVE_DIR setting)")
+        parser.add_argument('--reindex', action='store_true',
+                            help="Only rebuild the archive index from the segment files, e.g. after copying "
+                                 "segments in by hand")
+
+    def handle(self, *args, **options):
+        if options['reindex']:
+            reader = ArchiveReader(options['root'])
+            try:
+                count = reader.index.rebuild()
+            except ImportError as e:
+                raise CommandError(str(e))
+            self.stdout.write(f"Indexed {count} segments under {reader.root}.")
+            return
+        if options['before']:
+            before = parse_datetime(options['before'])
+            if before is None:
+                raise CommandError("--before must be an ISO 8601 datetime.")
+        else:
+            if options['keep_days'] < 0:
+                raise CommandError("--keep-days must not be negative.")
+            before = timezone.now() - timedelta(days=options['keep_days'])
+        try:
+            archiver = Archiver(root=options['root'], codec=options['codec'])
+            rows, segments = archiver.archive(before)
+        except ImportError as e:
+            raise CommandError(str(e))
+        self.stdout.write(f"Archived {rows} evaluation rows into {segments} segments under {archiver.reader.root}.")
@@ -0,0 +1,63 @@
+# kpi_app/management/commands/benchmark_interpreter.py
+
+import re
+import timeit
+from django.core.management.base import BaseCommand, CommandError
+from kpi_app.core.cache import LRUCache
+from kpi_app.core.interpreter import CustomInterpreter
+
+DEFAULT_EXPRESSIONS = ["ATTR + 50", "ATTR * 2 - 1", "(ATTR - 32) * 5 / 9", "Regex(ATTR, '[A-Z]{2}\\d+')"]
+
+def legacy_evaluate(expression, attr_value):
+    """
+    The evaluation path the compiled engine replaced: substitute ATTR into the
+    text, check it looks numeric, then eval() it. Kept here only as the baseline
+    for this benchmark; expressions other than the built-in ones are refused,
+    so nothing passed on the command line ever reaches eval().
+    """
+    if expression not in DEFAULT_EXPRESSIONS:
+        raise ValueError(f"The eval baseline only runs the built-in expressions, not {expression!r}")
+    if "Regex(" in expression:
+        pattern = re.match(r"Regex\(ATTR, '(.+?)'\)", expression).group(1)
+        return "True" if re.fullmatch(pattern, str(attr_value)) else "False"
+    expression = expression.replace("ATTR", str(attr_value))
+    if re.match(r"^[\d+\-*/().\s]+$", expression):
+        return eval(expression)
+    raise ValueError(f"Unsupported expression: {expression}")
+
+class Command(BaseCommand):
+    help = "Measure the per-evaluation cost of KPI expressions: compiled engine vs the former eval path."
+
+    def add_arguments(self, parser):
+        parser.add_argument('expressions', nargs='*', default=DEFAULT_EXPRESSIONS,
+                            help="Expressions to benchmark (defaults to a small arithmetic/regex mix); the eval "
+                                 "baseline is only measured for the built-in ones")
+        parser.add_argument('--number', type=int, default=20000, help="Evaluations per measurement")
+        parser.add_argument('--repeat', type=int, default=5, help="Measurements per case; the best is reported")
+
+    def handle(self, *args, **options):
+        interpreter = CustomInterpreter(cache=LRUCache())
+        value = 42.0
+        number = options['number']
+        repeat = options['repeat']
+
+        self.stdout.write(f"{'expression':<32} {'eval path':>12} {'compiled':>12} {'cached call':>12} {'speedup':>8}")
+        for expression in options['expressions']:
+            regex_value = "AB123"
+            argument = regex_value if "Regex(" in expression else value
+            try:
+                compiled = interpreter.get_compiled(expression)
+            except ValueError as e:
+                raise CommandError(str(e))
+
+            def best(statement):
+                return min(timeit.repeat(statement, number=number, repeat=repeat)) / number * 1e9
+
+            direct = best(lambda: compiled.evaluate(argument))
+            cached = best(lambda: interpreter.evaluate_expression(expression, argument))
+            if expression in DEFAULT_EXPRESSIONS:
+                legacy = best(lambda: legacy_evaluate(expression, argument))
+                baseline, speedup = f"{legacy:>9.0f} ns", f"{legacy / direct:>7.1f}x"
+            else:
+                baseline, speedup = f"{'n/a':>12}", f"{'n/a':>8}"
+            self.stdout.write(f"{expression:<32} {baseline} {direct:>9.0f} ns {cached:>9.0f} ns {speedup}")
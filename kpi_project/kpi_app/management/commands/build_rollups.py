@@ -0,0 +1,20 @@
+# kpi_app/management/commands/build_rollups.py
+
+from django.core.management.base import BaseCommand
+from kpi_app.core.rollups import RollupBuilder
+
+class Command(BaseCommand):
+    help = "Fold EvaluationLog rows added since the last run into the minute/hour/day rollups."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=50000,
+                            help="Number of EvaluationLog rows aggregated per transaction")
+        parser.add_argument('--reset', action='store_true',
+                            help="Drop all rollups and rebuild them from the full EvaluationLog table")
+
+    def handle(self, *args, **options):
+        builder = RollupBuilder(chunk_size=options['chunk_size'])
+        if options['reset']:
+            builder.reset()
+        rows = builder.build()
+        self.stdout.write(f"Folded {rows} evaluation rows into rollups.")
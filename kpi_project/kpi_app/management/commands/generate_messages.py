@@ -0,0 +1,26 @@
+# kpi_app/management/commands/generate_messages.py
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from kpi_app.core.benchmark import add_workload_arguments, workload_from_options
+
+class Command(BaseCommand):
+    help = "Write a synthetic JSONL message stream in the process_messages format."
+
+    def add_arguments(self, parser):
+        parser.add_argument('output', type=str, help="Path of the JSONL file to write")
+        add_workload_arguments(parser)
+        parser.add_argument('--fixtures', action='store_true',
+                            help="Also create the KPIs, assets and AssetKPI links the messages refer to")
+
+    def handle(self, *args, **options):
+        try:
+            workload = workload_from_options(options)
+        except ValueError as e:
+            raise CommandError(str(e))
+        size = workload.write(options['output'])
+        self.stdout.write(f"Wrote {workload.messages} messages ({size} bytes) to {options['output']}.")
+        if options['fixtures']:
+            with transaction.atomic():
+                workload.create_fixtures()
+            self.stdout.write(f"Created {workload.assets} assets and their AssetKPI links.")
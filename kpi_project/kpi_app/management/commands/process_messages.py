@@ -1,75 +1,281 @@
 # kpi_app/management/commands/process_messages.py
 
-import json
+import asyncio
 import time
-from django.core.management.base import BaseCommand
-from kpi_app.models.asset_kpi import AssetKPI
-from kpi_app.core.data_sources import FileDataSource
-from kpi_app.core.data_sinks import DatabaseDataSink
-from kpi_app.core.interpreter import CustomInterpreter
+from django.core.management.base import BaseCommand, CommandError
+from kpi_app.core.async_pipeline import AsyncPipeline
+from kpi_app.core.data_sources import FileDataSource, MappedFileDataSource, load_checkpoint, save_checkpoint
+from kpi_app.core.data_sinks import build_sink, parse_sink_specs
+from kpi_app.core.dead_letters import FileDeadLetterStore, open_dead_letter_store
+from kpi_app.core.metrics import QUEUE_DEPTH, SummaryLogger, serve_metrics
+from kpi_app.core.parallel import WorkerFailed, merge_reports, run_sharded, run_split_file
+from kpi_app.core.pipeline import FAILED, PROCESSED, SKIPPED, MessageProcessor
+from kpi_app.core.routing import routing_index
+from kpi_app.core.streaming import open_source
+from kpi_app.core.throttling import TokenBucket, TimestampPacer
 
 class Command(BaseCommand):
-    help = "Process messages from a text file and evaluate KPIs, with 5-second intervals between each message."
+    help = (
+        "Process messages from a text file, or from a streaming --source, and evaluate KPIs. Messages are "
+        "processed as fast as possible unless --rate or --replay-timestamps is given."
+    )
 
     def add_arguments(self, parser):
-        parser.add_argument('file_path', type=str, help="Path to the messages text file")
+        parser.add_argument('file_path', type=str, nargs='?', help="Path to the messages text file")
+        parser.add_argument('--source', type=str, default=None,
+                            help="Source URI instead of a file path: '-' (stdin), tcp://host:port, "
+                                 "tail:///path/to/file-or-directory, or file:///path")
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help="Number of evaluation results written per bulk insert")
+        parser.add_argument('--flush-interval', type=float, default=1.0,
+                            help="Maximum seconds a result may wait in the buffer before being written")
+        pacing = parser.add_mutually_exclusive_group()
+        pacing.add_argument('--rate', type=float, default=None,
+                            help="Limit processing to this many messages per second")
+        pacing.add_argument('--replay-timestamps', action='store_true',
+                            help="Pace messages by the deltas between their own timestamps")
+        parser.add_argument('--replay-speed', type=float, default=1.0,
+                            help="Speed-up factor applied with --replay-timestamps")
+        parser.add_argument('--workers', type=int, default=1,
+                            help="Number of worker processes; messages are sharded by asset_id")
+        parser.add_argument('--split-file', action='store_true',
+                            help="With --workers, let each worker read its own byte range of the file "
+                                 "(faster reading, per-asset ordering only within a range)")
+        parser.add_argument('--mmap', action='store_true',
+                            help="Read the file through a memory-mapped, batched JSONL reader")
+        parser.add_argument('--start-offset', type=int, default=0,
+                            help="Byte offset to start reading at (rounded up to the next line)")
+        parser.add_argument('--end-offset', type=int, default=None,
+                            help="Byte offset to stop reading at; lines starting before it are read")
+        parser.add_argument('--checkpoint', type=str, default=None,
+                            help="With --mmap, file used to save and resume the read offset")
+        parser.add_argument('--rollups', action='store_true',
+                            help="Update the minute/hour/day rollups after every batch is written")
+        parser.add_argument('--sink', dest='sinks', action='append', default=None,
+                            help="Where results are written: db (default), ndjson:PATH, csv:PATH or "
+                                 "segments:DIR. Repeat to write to several sinks; the first is written "
+                                 "synchronously and the others each from their own thread")
+        parser.add_argument('--segment-max-bytes', type=int, default=64 << 20,
+                            help="Size at which a segments: sink starts a new segment file")
+        parser.add_argument('--fsync-interval', type=float, default=1.0,
+                            help="Seconds between fsyncs of the open segment of a segments: sink")
+        parser.add_argument('--dead-letters', type=str, default='none',
+                            help="Where messages that cannot be processed are recorded for replay: db, "
+                                 "file:PATH or none (default)")
+        parser.add_argument('--async', dest='use_async', action='store_true',
+                            help="Run reading, evaluation and writing as concurrent asyncio stages")
+        parser.add_argument('--evaluators', type=int, default=4,
+                            help="With --async, number of concurrent evaluator tasks")
+        parser.add_argument('--queue-size', type=int, default=1000,
+                            help="With --async, capacity of the queues between stages")
+        parser.add_argument('--log-interval', type=float, default=10.0,
+                            help="Seconds between metrics summary log lines; 0 disables them")
+        parser.add_argument('--routing-refresh', type=float, default=60.0,
+                            help="Seconds after which the KPI routing is reloaded from the database, to pick up "
+                                 "changes made by other processes; 0 disables it")
+        parser.add_argument('--metrics-port', type=int, default=None,
+                            help="Serve Prometheus metrics of this process on http://0.0.0.0:PORT/metrics")
 
     def handle(self, *args, **options):
         # Initialize components
-        file_path = options['file_path']
-        data_source = FileDataSource(file_path)
-        data_sink = DatabaseDataSink()
-        interpreter = CustomInterpreter()
+        if bool(options['file_path']) == bool(options['source']):
+            raise CommandError("Provide either a file path or --source")
+        workers = options['workers']
+        if workers < 1:
+            raise CommandError("--workers must be at least 1")
+        if options['split_file'] and (options['rate'] is not None or options['replay_timestamps']):
+            raise CommandError("--split-file cannot be combined with --rate or --replay-timestamps")
+        if options['split_file'] and (options['start_offset'] or options['end_offset'] is not None):
+            raise CommandError("--split-file cannot be combined with --start-offset or --end-offset")
+        checkpoint = options['checkpoint']
+        if checkpoint and (not options['mmap'] or workers > 1):
+            raise CommandError("--checkpoint requires --mmap and a single worker")
+        if options['use_async'] and (workers > 1 or checkpoint):
+            raise CommandError("--async cannot be combined with --workers or --checkpoint")
+        if options['routing_refresh'] < 0:
+            raise CommandError("--routing-refresh cannot be negative")
+        routing_index.refresh_interval = options['routing_refresh']
+        sinks = options['sinks'] or ['db']
+        try:
+            schemes = [scheme for scheme, _ in parse_sink_specs(sinks)]
+        except ValueError as e:
+            raise CommandError(str(e))
+        if workers > 1 and set(schemes) - {'db'}:
+            raise CommandError("File sinks cannot be shared between --workers processes")
+        try:
+            dead_letters = open_dead_letter_store(options['dead_letters'], options['batch_size'],
+                                                  options['flush_interval'])
+        except ValueError as e:
+            raise CommandError(str(e))
+        if workers > 1 and isinstance(dead_letters, FileDeadLetterStore):
+            raise CommandError("A dead-letter file cannot be shared between --workers processes")
+        sink_options = {
+            'sinks': sinks,
+            'batch_size': options['batch_size'],
+            'max_latency': options['flush_interval'],
+            'rollups': options['rollups'],
+            'segment_max_bytes': options['segment_max_bytes'],
+            'fsync_interval': options['fsync_interval'],
+        }
 
-        # Process each message from the data source with a 5-second delay
-        for message in data_source.read_data():
-            asset_id = None
-            attribute_id = None
+        try:
+            data_source = open_source(
+                options['source'] or options['file_path'],
+                mmap=options['mmap'],
+                start_offset=options['start_offset'],
+                end_offset=options['end_offset'],
+            )
+        except ValueError as e:
+            raise CommandError(str(e))
+        data_source.dead_letters = dead_letters
+        is_file = isinstance(data_source, FileDataSource)
+        if not is_file and (options['split_file'] or checkpoint):
+            raise CommandError("--split-file and --checkpoint need a file source")
+        if not is_file and workers > 1:
+            # Workers only receive full chunks, so a slow stream would leave results waiting indefinitely
+            raise CommandError("--workers needs a file source; streaming sources run in a single process")
+        if checkpoint:
+            data_source.start_offset = max(data_source.start_offset,
+                                           load_checkpoint(checkpoint, data_source.file_path))
+        try:
+            rate_limiter = TokenBucket(options['rate']) if options['rate'] is not None else None
+            pacer = TimestampPacer(options['replay_speed']) if options['replay_timestamps'] else None
+        except ValueError as e:
+            raise CommandError(str(e))
 
+        def pace(message):
+            if rate_limiter is not None:
+                rate_limiter.acquire()
+            elif pacer is not None and isinstance(message, dict):
+                pacer.wait_for(message.get('timestamp'))
+
+        metrics_server = None
+        if options['metrics_port'] is not None:
             try:
-                # Ensure that message is a dictionary with necessary fields
-                if not isinstance(message, dict):
-                    print("Skipping invalid message format. Expected JSON object.")
-                    continue
-
-                # Extract fields with error handling for missing keys
-                asset_id = message.get('asset_id')
-                attribute_id = message.get('attribute_id')
-                timestamp = message.get('timestamp')
-                value = message.get('value')
-
-                # Check for null or missing values
-                if not asset_id or not attribute_id or not timestamp or value is None:
-                    print(f"Skipping message with missing fields: {message}")
-                    continue
-
-                # Retrieve the corresponding AssetKPI and KPI
-                try:
-                    asset_kpi = AssetKPI.objects.get(asset__asset_id=asset_id, attribute_id=attribute_id)
-                except AssetKPI.DoesNotExist:
-                    print(f"No AssetKPI found for asset_id: {asset_id} and attribute_id: {attribute_id}")
-                    continue
-
-                kpi = asset_kpi.kpi
-
-                # Validate and process numeric value for arithmetic expressions
-                if isinstance(value, str) and value.replace('.', '', 1).isdigit():
-                    value = float(value)  # Convert numeric string to float
-                elif not isinstance(value, (int, float)) and not kpi.expression.startswith("Regex("):
-                    print(f"Invalid numeric value for KPI calculation: {value}")
-                    continue
-
-                # Evaluate the KPI expression using the custom interpreter
-                result = interpreter.evaluate_expression(kpi.expression, value)
-
-                # Write the result to the data sink (database)
-                data_sink.write_data(asset_id, f"output_{attribute_id}", timestamp, result)
-                print(f"Processed message for Asset ID: {asset_id}, Attribute: {attribute_id}, Result: {result}")
-
-            except json.JSONDecodeError:
-                print("Skipping invalid JSON format line.")
-            except Exception as e:
-                print(f"Unexpected error processing message for asset_id: {asset_id}, attribute_id: {attribute_id}: {e}")
-            
-            # Wait for 5 seconds before processing the next row
-            time.sleep(5)
+                metrics_server = serve_metrics(options['metrics_port'])
+            except OSError as e:
+                raise CommandError(f"Cannot serve metrics on port {options['metrics_port']}: {e}")
+        summary = SummaryLogger(options['log_interval']).start() if options['log_interval'] > 0 else None
+
+        started_at = time.monotonic()
+        try:
+            report = self.run(data_source, workers, sink_options, pace, rate_limiter, pacer, checkpoint, options)
+        except WorkerFailed as e:
+            raise CommandError(str(e))
+        finally:
+            if dead_letters is not None:
+                # Already closed by the processor unless the run failed early or used workers
+                dead_letters.close()
+            if summary is not None:
+                summary.stop()
+            if metrics_server is not None:
+                metrics_server.shutdown()
+        self.write_summary(report, time.monotonic() - started_at)
+
+    def run(self, data_source, workers, sink_options, pace, rate_limiter, pacer, checkpoint, options):
+        """Dispatches to the processing mode selected by the options and returns the report."""
+        if workers > 1 and options['split_file']:
+            source_class = MappedFileDataSource if options['mmap'] else FileDataSource
+            return run_split_file(data_source.file_path, workers, self.worker_options(sink_options, options),
+                                  source_class)
+        if workers > 1:
+            def before_dispatch(message):
+                pace(message)
+                # Malformed lines are recorded by the parent's own store
+                if data_source.dead_letters is not None:
+                    data_source.dead_letters.flush_if_due()
+
+            report = run_sharded(data_source.read_data(), workers, self.worker_options(sink_options, options),
+                                 before_dispatch=before_dispatch)
+            report['malformed'] = getattr(data_source, 'malformed', 0)
+            return report
+        if options['use_async']:
+            paced = rate_limiter is not None or pacer is not None
+            return self.run_async(data_source, sink_options, pace if paced else None, options)
+        return self.run_in_process(data_source, sink_options, pace, checkpoint)
+
+    def worker_options(self, sink_options, options):
+        """Sink options for worker processes, which also build their own dead-letter store."""
+        return dict(sink_options, dead_letters=options['dead_letters'], routing_refresh=options['routing_refresh'])
+
+    def run_in_process(self, data_source, sink_options, pace, checkpoint=None):
+        """Processes every message in this process and returns the report."""
+        # Load every AssetKPI link up front; signals keep the index fresh afterwards
+        processor = MessageProcessor(routing_index.load(), build_sink(**sink_options), data_source.dead_letters)
+        QUEUE_DEPTH.track(processor.data_sink.pending, 'sink_buffer')
+        if hasattr(data_source, 'read_batches'):
+            batches = data_source.read_batches()
+        else:
+            batches = ([message] for message in data_source.read_data())
+        try:
+            for batch in batches:
+                for message in batch:
+                    pace(message)
+                    processor.process(message)
+                # Pick up KPI and link changes made by other processes
+                processor.routing.refresh_if_due()
+                if checkpoint:
+                    # Only advance the checkpoint past rows that are safely written
+                    processor.flush()
+                    save_checkpoint(checkpoint, data_source.file_path, data_source.offset)
+                else:
+                    # Streaming sources yield empty batches while idle; don't let results sit in the buffer
+                    processor.flush_if_due()
+        except KeyboardInterrupt:
+            self.stderr.write("Interrupted, flushing buffered results.")
+        finally:
+            # Write out whatever is still buffered
+            processor.close()
+            QUEUE_DEPTH.untrack('sink_buffer')
+        report = merge_reports([processor.report()])
+        report['malformed'] = getattr(data_source, 'malformed', 0)
+        return report
+
+    def run_async(self, data_source, sink_options, pace, options):
+        """Processes every message through the asyncio pipeline and returns the report."""
+        processor = MessageProcessor(routing_index.load(), build_sink(**sink_options), data_source.dead_letters)
+        QUEUE_DEPTH.track(processor.data_sink.pending, 'sink_buffer')
+
+        async def async_pace(message):
+            # Pacing sleeps, so keep it off the event loop
+            await asyncio.to_thread(pace, message)
+
+        try:
+            pipeline = AsyncPipeline(
+                processor,
+                evaluators=options['evaluators'],
+                queue_size=options['queue_size'],
+                write_batch_size=options['batch_size'],
+                pace=async_pace if pace is not None else None,
+            )
+        except ValueError as e:
+            raise CommandError(str(e))
+        try:
+            report = merge_reports([asyncio.run(pipeline.run(data_source))])
+        finally:
+            QUEUE_DEPTH.untrack('sink_buffer')
+        report['malformed'] = getattr(data_source, 'malformed', 0)
+        return report
+
+    def write_summary(self, report, elapsed):
+        counts = report['counts']
+        total = sum(counts.values())
+        rate = total / elapsed if elapsed > 0 else 0.0
+        self.stdout.write(
+            f"Processed: {counts.get(PROCESSED, 0)}, skipped: {counts.get(SKIPPED, 0)}, "
+            f"failed: {counts.get(FAILED, 0)} in {elapsed:.2f}s ({rate:.1f} messages/sec)"
+        )
+        if report.get('malformed'):
+            self.stdout.write(f"Malformed lines: {report['malformed']}")
+        if report['failures']:
+            details = ", ".join(f"{name}: {count}" for name, count in sorted(report['failures'].items()))
+            self.stdout.write(f"Failures by error class: {details}")
+        if len(report['workers']) > 1:
+            for number, worker in enumerate(report['workers'], start=1):
+                worker_counts = worker['counts']
+                self.stdout.write(
+                    f"  worker {number}: processed {worker_counts.get(PROCESSED, 0)}, "
+                    f"skipped {worker_counts.get(SKIPPED, 0)}, failed {worker_counts.get(FAILED, 0)}"
+                )
+        for error in report.get('errors', []):
+            self.stderr.write(f"Worker error: {error}")
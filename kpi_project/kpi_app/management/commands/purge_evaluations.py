@@ -0,0 +1,32 @@
+# kpi_app/management/commands/purge_evaluations.py
+
+from django.core.management.base import BaseCommand, CommandError
+from kpi_app.core.retention import Purger
+
+class Command(BaseCommand):
+    help = ("Delete evaluation results, rollups and archived segments older than their retention policy, "
+            "and expired dead letters, in bounded batches.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help="Number of rows deleted per transaction")
+        parser.add_argument('--pause', type=float, default=0.0,
+                            help="Seconds to sleep between batches, leaving the database to other writers")
+        parser.add_argument('--no-rollups', action='store_true',
+                            help="Do not fold pending rows into the rollups before deleting raw rows")
+        parser.add_argument('--dry-run', action='store_true',
+                            help="Only count what would be deleted")
+
+    def handle(self, *args, **options):
+        try:
+            purger = Purger(batch_size=options['batch_size'], pause=options['pause'],
+                            rollups=not options['no_rollups'], dry_run=options['dry_run'])
+        except ValueError as e:
+            raise CommandError(str(e))
+        deleted = purger.purge()
+        verb = "Would delete" if options['dry_run'] else "Deleted"
+        self.stdout.write(
+            f"{verb} {deleted['raw']} evaluation rows, {deleted['minute']} minute, {deleted['hour']} hour and "
+            f"{deleted['day']} day rollups, {deleted['segments']} archived segments and "
+            f"{deleted['dead_letters']} dead letters."
+        )
@@ -0,0 +1,151 @@
+# kpi_app/management/commands/replay_dead_letters.py
+
+import math
+import sys
+from collections import Counter
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Count, Q
+from django.utils import timezone
+from kpi_app.core.data_sinks import build_sink
+from kpi_app.core.dead_letters import Replayer, read_dead_letter_file, write_dead_letter_file
+from kpi_app.core.pipeline import MessageProcessor
+from kpi_app.core.routing import routing_index
+from kpi_app.models.dead_letter import DeadLetter
+
+class Command(BaseCommand):
+    help = (
+        "Replay messages from the dead-letter store, e.g. once the missing AssetKPI links or a broken KPI have "
+        "been fixed. Replayed messages are removed; those that fail again are kept with their new error."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--error-class', dest='error_classes', action='append', default=None,
+                            help="Only replay dead letters of this error class, e.g. NoRoute; may be repeated")
+        parser.add_argument('--list', action='store_true',
+                            help="Only show how many dead letters there are per error class")
+        parser.add_argument('--file', type=str, default=None,
+                            help="Replay a dead-letter file written with --dead-letters file:PATH instead of "
+                                 "the DeadLetter table")
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help="Number of dead letters replayed and written per batch")
+        parser.add_argument('--sink', dest='sinks', action='append', default=None,
+                            help="Where replayed results are written, as for process_messages")
+        parser.add_argument('--rollups', action='store_true',
+                            help="Update the minute/hour/day rollups after every batch is written")
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError("--batch-size must be at least 1")
+        classes = options['error_classes']
+        if options['list']:
+            counts = self.count_file(options['file']) if options['file'] else self.count_table()
+            for error_class, count in sorted(counts.items()):
+                if not classes or error_class in classes:
+                    self.stdout.write(f"{error_class}: {count}")
+            if not counts:
+                self.stdout.write("No dead letters.")
+            return
+
+        try:
+            # Never flush inside write_many: each chunk of dead letters is written by one flush
+            sink = build_sink(options['sinks'] or ['db'], batch_size=sys.maxsize, max_latency=math.inf,
+                              rollups=options['rollups'])
+        except ValueError as e:
+            raise CommandError(str(e))
+        replayer = Replayer(MessageProcessor(routing_index.load(), sink))
+        try:
+            if options['file']:
+                results = self.replay_file(replayer, options['file'], classes, options['batch_size'])
+            else:
+                results = self.replay_table(replayer, classes, options['batch_size'])
+        finally:
+            sink.close()
+
+        for error_class, (replayed, failed) in sorted(results.items()):
+            self.stdout.write(f"{error_class}: {replayed} replayed, {failed} still failing")
+        if not results:
+            self.stdout.write("No dead letters to replay.")
+
+    def count_table(self):
+        rows = DeadLetter.objects.values('error_class').annotate(count=Count('id')).order_by()
+        return {row['error_class']: row['count'] for row in rows}
+
+    def count_file(self, path):
+        return Counter(entry['error_class'] for entry in self.read_file(path))
+
+    def read_file(self, path):
+        try:
+            return read_dead_letter_file(path)
+        except (OSError, ValueError) as e:
+            raise CommandError(f"Cannot read dead-letter file {path}: {e}")
+
+    def replay_table(self, replayer, classes, batch_size):
+        """Replays the DeadLetter table class by class; returns {error_class: (replayed, still failing)}."""
+        started = timezone.now()
+        # Letters that fail again get a new error class; never replay them twice in one run
+        letters = DeadLetter.objects.filter(Q(last_replayed_at__isnull=True) | Q(last_replayed_at__lt=started))
+        if classes:
+            letters = letters.filter(error_class__in=classes)
+        names = list(letters.order_by('error_class').values_list('error_class', flat=True).distinct())
+
+        results = {}
+        for error_class in names:
+            replayed = failed = 0
+            last_id = 0
+            while True:
+                chunk = list(letters.filter(error_class=error_class, id__gt=last_id).order_by('id')[:batch_size])
+                if not chunk:
+                    break
+                last_id = chunk[-1].id
+                done, failures = replayer.replay(
+                    [(letter.id, letter.message, letter.output_attribute_id) for letter in chunk])
+                retried = []
+                for letter in chunk:
+                    if letter.id in failures:
+                        letter.error_class, letter.reason, letter.stage = failures[letter.id]
+                        letter.attempts += 1
+                        letter.last_replayed_at = timezone.now()
+                        retried.append(letter)
+                with transaction.atomic():
+                    DeadLetter.objects.filter(id__in=done).delete()
+                    DeadLetter.objects.bulk_update(
+                        retried, ['error_class', 'reason', 'stage', 'attempts', 'last_replayed_at'])
+                replayed += len(done)
+                failed += len(failures)
+            results[error_class] = (replayed, failed)
+        return results
+
+    def replay_file(self, replayer, path, classes, batch_size):
+        """Replays a dead-letter file and rewrites it with the entries that still fail."""
+        entries = self.read_file(path)
+        selected = {}
+        for index, entry in enumerate(entries):
+            if not classes or entry['error_class'] in classes:
+                selected.setdefault(entry['error_class'], []).append(index)
+
+        results = {}
+        replayed_indexes = set()
+        for error_class, indexes in sorted(selected.items()):
+            replayed = failed = 0
+            for start in range(0, len(indexes), batch_size):
+                chunk = indexes[start:start + batch_size]
+                done, failures = replayer.replay(
+                    [(index, entries[index]['message'], entries[index].get('output_attribute_id', ''))
+                     for index in chunk])
+                replayed_indexes.update(done)
+                for index, (new_class, reason, stage) in failures.items():
+                    entries[index].update(
+                        error_class=new_class, reason=reason, stage=stage,
+                        attempts=entries[index].get('attempts', 0) + 1,
+                        last_replayed_at=timezone.now().isoformat(),
+                    )
+                replayed += len(done)
+                failed += len(failures)
+            results[error_class] = (replayed, failed)
+
+        if replayed_indexes or results:
+            write_dead_letter_file(
+                path, [entry for index, entry in enumerate(entries) if index not in replayed_indexes])
+        return results
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-17 17:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('kpi_app', '0003_alter_evaluationlog_result'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='evaluationlog',
+            index=models.Index(fields=['asset_id', 'attribute_id', 'timestamp', 'id'], name='evallog_asset_attr_ts_idx'),
+        ),
+    ]
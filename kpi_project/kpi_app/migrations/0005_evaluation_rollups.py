@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-17 17:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('kpi_app', '0004_evaluationlog_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RollupWatermark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+                ('last_log_id', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='EvaluationRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('asset_id', models.CharField(max_length=100)),
+                ('attribute_id', models.CharField(max_length=100)),
+                ('resolution', models.CharField(choices=[('minute', 'Minute'), ('hour', 'Hour'), ('day', 'Day')], max_length=10)),
+                ('bucket_start', models.DateTimeField()),
+                ('count', models.PositiveBigIntegerField(default=0)),
+                ('sum', models.FloatField(default=0)),
+                ('min', models.FloatField()),
+                ('max', models.FloatField()),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('asset_id', 'attribute_id', 'resolution', 'bucket_start'), name='evalrollup_unique_bucket')],
+            },
+        ),
+    ]
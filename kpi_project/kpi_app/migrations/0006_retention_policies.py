@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-17 18:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('kpi_app', '0005_evaluation_rollups'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RetentionPolicy',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('asset_id', models.CharField(blank=True, default='', max_length=100)),
+                ('attribute_id', models.CharField(blank=True, default='', max_length=100)),
+                ('raw_days', models.PositiveIntegerField(blank=True, null=True)),
+                ('minute_days', models.PositiveIntegerField(blank=True, null=True)),
+                ('hour_days', models.PositiveIntegerField(blank=True, null=True)),
+                ('day_days', models.PositiveIntegerField(blank=True, null=True)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('asset_id', 'attribute_id'), name='retention_unique_scope')],
+            },
+        ),
+    ]
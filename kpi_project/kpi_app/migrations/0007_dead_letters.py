@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-17 18:24
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('kpi_app', '0006_retention_policies'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DeadLetter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('message', models.TextField()),
+                ('error_class', models.CharField(max_length=100)),
+                ('reason', models.TextField(blank=True, default='')),
+                ('stage', models.CharField(choices=[('decode', 'Decode'), ('validate', 'Validate'), ('route', 'Route'), ('evaluate', 'Evaluate'), ('write', 'Write')], max_length=10)),
+                ('output_attribute_id', models.CharField(blank=True, default='', max_length=100)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('last_replayed_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['error_class', 'id'], name='deadletter_class_idx')],
+            },
+        ),
+    ]
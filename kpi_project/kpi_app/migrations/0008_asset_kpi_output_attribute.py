@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-17 18:36
+
+from django.db import migrations, models
+
+
+def name_existing_outputs(apps, schema_editor):
+    """Keeps the names existing links already write to: the oldest link per attribute gets the bare name."""
+    AssetKPI = apps.get_model('kpi_app', 'AssetKPI')
+    seen = set()
+    links = []
+    for link in AssetKPI.objects.order_by('id').iterator():
+        key = (link.asset_id, link.attribute_id)
+        suffix = f"_{link.kpi_id}" if key in seen else ""
+        link.output_attribute_id = f"output_{link.attribute_id}{suffix}"
+        seen.add(key)
+        links.append(link)
+    AssetKPI.objects.bulk_update(links, ['output_attribute_id'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('kpi_app', '0007_dead_letters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='assetkpi',
+            name='output_attribute_id',
+            field=models.CharField(blank=True, default='', editable=False, max_length=150),
+        ),
+        migrations.RunPython(name_existing_outputs, migrations.RunPython.noop),
+    ]
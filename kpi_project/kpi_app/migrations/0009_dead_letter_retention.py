@@ -0,0 +1,22 @@
+# Generated by Django 5.2.18 on 2026-10-17 18:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('kpi_app', '0008_asset_kpi_output_attribute'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='deadletter',
+            name='output_attribute_id',
+            field=models.CharField(blank=True, default='', max_length=150),
+        ),
+        migrations.AddIndex(
+            model_name='deadletter',
+            index=models.Index(fields=['created_at'], name='deadletter_created_idx'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-17 18:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('kpi_app', '0009_dead_letter_retention'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='evaluationlog',
+            name='attribute_id',
+            field=models.CharField(max_length=150),
+        ),
+        migrations.AlterField(
+            model_name='evaluationrollup',
+            name='attribute_id',
+            field=models.CharField(max_length=150),
+        ),
+        migrations.AlterField(
+            model_name='retentionpolicy',
+            name='attribute_id',
+            field=models.CharField(blank=True, default='', max_length=150),
+        ),
+    ]
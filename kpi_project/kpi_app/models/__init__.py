@@ -2,3 +2,6 @@ from .kpi import KPI
 from .asset import Asset
 from .asset_kpi import AssetKPI
 from .evaluation_log import EvaluationLog
+from .evaluation_rollup import EvaluationRollup, RollupWatermark
+from .retention_policy import RetentionPolicy
+from .dead_letter import DeadLetter
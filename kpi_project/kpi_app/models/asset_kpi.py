@@ -1,3 +1,5 @@
+from itertools import chain, count
+
 from django.db import models
 from .asset import Asset
 from .kpi import KPI
@@ -5,10 +7,55 @@ from .kpi import KPI
 class AssetKPI(models.Model):
     """
     Represents the relationship between an Asset and a KPI, with an attribute ID.
+
+    `output_attribute_id` names the series the KPI's results are written to.
+    It is assigned once, when the link is created, and never changes when
+    other links come and go: the first KPI linked to an asset attribute
+    writes to `output_<attribute_id>`, KPIs linked while others exist write
+    to `output_<attribute_id>_<kpi_id>`.
     """
     asset = models.ForeignKey(Asset, on_delete=models.CASCADE)
     kpi = models.ForeignKey(KPI, on_delete=models.CASCADE)
     attribute_id = models.CharField(max_length=100)
+    output_attribute_id = models.CharField(max_length=150, blank=True, default='', editable=False)
 
     def __str__(self):
         return f"{self.asset.name} - {self.kpi.name} (Attribute: {self.attribute_id})"
+
+    def save(self, *args, **kwargs):
+        if self.pk is not None and self.output_attribute_id:
+            # Re-pointing a link at another asset, attribute or KPI starts a new series
+            stored = AssetKPI.objects.filter(pk=self.pk).values_list('asset_id', 'attribute_id', 'kpi_id').first()
+            if stored is not None and stored != (self.asset_id, self.attribute_id, self.kpi_id):
+                self.output_attribute_id = ''
+        AssetKPI.assign_output_attribute_ids([self])
+        super().save(*args, **kwargs)
+
+    @classmethod
+    def assign_output_attribute_ids(cls, links):
+        """Names the outputs of links that have none yet; `bulk_create` callers must call this first."""
+        pending = [link for link in links if not link.output_attribute_id]
+        if not pending:
+            return
+        own = {link.pk for link in pending if link.pk is not None}
+        assets = sorted({link.asset_id for link in pending})
+        linked = set()
+        taken = set()
+        # Chunked to stay under the database's limit on query parameters
+        for start in range(0, len(assets), 500):
+            for pk, asset_pk, attribute_id, output_attribute_id in cls.objects.filter(
+                    asset_id__in=assets[start:start + 500]).values_list(
+                    'pk', 'asset_id', 'attribute_id', 'output_attribute_id'):
+                if pk not in own:
+                    linked.add((asset_pk, attribute_id))
+                    taken.add((asset_pk, output_attribute_id))
+
+        for link in pending:
+            base = f"output_{link.attribute_id}"
+            # Later KPIs are told apart by their id, and by a counter for repeated links to one KPI
+            candidates = (f"{base}_{link.kpi_id}" if n == 1 else f"{base}_{link.kpi_id}_{n}" for n in count(1))
+            if (link.asset_id, link.attribute_id) not in linked:
+                candidates = chain([base], candidates)
+            link.output_attribute_id = next(name for name in candidates if (link.asset_id, name) not in taken)
+            linked.add((link.asset_id, link.attribute_id))
+            taken.add((link.asset_id, link.output_attribute_id))
@@ -0,0 +1,35 @@
+from django.db import models
+from django.utils import timezone
+
+class DeadLetter(models.Model):
+    """
+    A message the pipeline could not turn into evaluation results, kept with
+    the reason so it can be replayed once the cause is fixed.
+    """
+    DECODE = 'decode'
+    VALIDATE = 'validate'
+    ROUTE = 'route'
+    EVALUATE = 'evaluate'
+    WRITE = 'write'
+    STAGES = [(DECODE, 'Decode'), (VALIDATE, 'Validate'), (ROUTE, 'Route'), (EVALUATE, 'Evaluate'), (WRITE, 'Write')]
+
+    message = models.TextField()
+    error_class = models.CharField(max_length=100)
+    reason = models.TextField(blank=True, default='')
+    stage = models.CharField(max_length=10, choices=STAGES)
+    # Output attribute of the one KPI that failed, when the others linked to the attribute succeeded
+    output_attribute_id = models.CharField(max_length=150, blank=True, default='')
+    created_at = models.DateTimeField(default=timezone.now)
+    attempts = models.PositiveIntegerField(default=0)
+    last_replayed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # Serves replaying one error class at a time in id order
+            models.Index(fields=['error_class', 'id'], name='deadletter_class_idx'),
+            # Serves the purge of expired dead letters
+            models.Index(fields=['created_at'], name='deadletter_created_idx'),
+        ]
+
+    def __str__(self):
+        return f"DeadLetter(error_class={self.error_class}, stage={self.stage}, reason={self.reason[:50]})"
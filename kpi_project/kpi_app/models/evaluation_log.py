@@ -5,9 +5,15 @@ class EvaluationLog(models.Model):
     Logs the evaluation of KPIs for assets over time.
     """
     asset_id = models.CharField(max_length=100)
-    attribute_id = models.CharField(max_length=100)
+    attribute_id = models.CharField(max_length=150)
     timestamp = models.DateTimeField()
     result = models.FloatField()
 
+    class Meta:
+        indexes = [
+            # Serves "asset/attribute in a time window" queries and their (timestamp, id) keyset pagination
+            models.Index(fields=['asset_id', 'attribute_id', 'timestamp', 'id'], name='evallog_asset_attr_ts_idx'),
+        ]
+
     def __str__(self):
         return f"EvaluationLog(asset_id={self.asset_id}, attribute_id={self.attribute_id}, result={self.result})"
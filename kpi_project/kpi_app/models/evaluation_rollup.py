@@ -0,0 +1,45 @@
+from django.db import models
+
+class EvaluationRollup(models.Model):
+    """
+    Pre-aggregated EvaluationLog results for one asset attribute over one time bucket.
+    """
+    MINUTE = 'minute'
+    HOUR = 'hour'
+    DAY = 'day'
+    RESOLUTIONS = [(MINUTE, 'Minute'), (HOUR, 'Hour'), (DAY, 'Day')]
+
+    asset_id = models.CharField(max_length=100)
+    attribute_id = models.CharField(max_length=150)
+    resolution = models.CharField(max_length=10, choices=RESOLUTIONS)
+    bucket_start = models.DateTimeField()
+    count = models.PositiveBigIntegerField(default=0)
+    sum = models.FloatField(default=0)
+    min = models.FloatField()
+    max = models.FloatField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['asset_id', 'attribute_id', 'resolution', 'bucket_start'],
+                name='evalrollup_unique_bucket',
+            ),
+        ]
+
+    @property
+    def avg(self):
+        return self.sum / self.count if self.count else None
+
+    def __str__(self):
+        return (f"EvaluationRollup(asset_id={self.asset_id}, attribute_id={self.attribute_id}, "
+                f"{self.resolution}={self.bucket_start.isoformat()}, count={self.count})")
+
+class RollupWatermark(models.Model):
+    """
+    Records the highest EvaluationLog id already folded into the rollups.
+    """
+    name = models.CharField(max_length=50, unique=True)
+    last_log_id = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f"RollupWatermark(name={self.name}, last_log_id={self.last_log_id})"
@@ -0,0 +1,28 @@
+from django.db import models
+
+class RetentionPolicy(models.Model):
+    """
+    How many days the evaluation results of matching asset attributes are kept,
+    as raw EvaluationLog rows and per rollup resolution. A blank asset_id or
+    attribute_id matches any value and the most specific policy wins; a null
+    period keeps that data forever.
+    """
+    asset_id = models.CharField(max_length=100, blank=True, default='')
+    attribute_id = models.CharField(max_length=150, blank=True, default='')
+    raw_days = models.PositiveIntegerField(null=True, blank=True)
+    minute_days = models.PositiveIntegerField(null=True, blank=True)
+    hour_days = models.PositiveIntegerField(null=True, blank=True)
+    day_days = models.PositiveIntegerField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['asset_id', 'attribute_id'], name='retention_unique_scope'),
+        ]
+
+    def days(self, kind):
+        """Returns the retention period for 'raw' or a rollup resolution."""
+        return getattr(self, f'{kind}_days')
+
+    def __str__(self):
+        return (f"RetentionPolicy(asset_id={self.asset_id or '*'}, attribute_id={self.attribute_id or '*'}, "
+                f"raw_days={self.raw_days})")
@@ -0,0 +1,54 @@
+# kpi_app/signals.py
+
+import copy
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .api import caching
+from .core.routing import routing_index
+from .models import KPI, Asset, AssetKPI
+
+# The routing index is only maintained once something has loaded it, so API
+# processes that never route messages pay nothing for these handlers. Changes
+# reach the index when their transaction commits, so a rolled-back save never
+# routes messages; the instance is copied because a deleted one loses its pk.
+
+def update_routing_index(method, instance):
+    if routing_index.is_loaded:
+        instance = copy.copy(instance)
+        transaction.on_commit(lambda: method(instance))
+
+@receiver(post_save, sender=AssetKPI)
+def asset_kpi_saved(sender, instance, **kwargs):
+    update_routing_index(routing_index.asset_kpi_saved, instance)
+
+@receiver(post_delete, sender=AssetKPI)
+def asset_kpi_deleted(sender, instance, **kwargs):
+    update_routing_index(routing_index.asset_kpi_deleted, instance)
+
+@receiver(post_save, sender=KPI)
+def kpi_saved(sender, instance, **kwargs):
+    update_routing_index(routing_index.kpi_saved, instance)
+
+@receiver(post_delete, sender=KPI)
+def kpi_deleted(sender, instance, **kwargs):
+    update_routing_index(routing_index.kpi_deleted, instance)
+
+@receiver(post_save, sender=Asset)
+def asset_saved(sender, instance, **kwargs):
+    update_routing_index(routing_index.asset_saved, instance)
+
+@receiver(post_delete, sender=Asset)
+def asset_deleted(sender, instance, **kwargs):
+    update_routing_index(routing_index.asset_deleted, instance)
+
+# Cached API responses are invalidated on every change, whether or not the
+# routing index is loaded.
+
+@receiver([post_save, post_delete], sender=KPI)
+@receiver([post_save, post_delete], sender=Asset)
+@receiver([post_save, post_delete], sender=AssetKPI)
+def invalidate_cached_responses(sender, **kwargs):
+    caching.invalidate(sender)
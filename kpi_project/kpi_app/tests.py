@@ -2,11 +2,51 @@
 Unit tests for KPI application.
 """
 
-from django.test import TestCase
+import asyncio
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from unittest import mock, skipUnless
+
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import DataError, OperationalError, connection, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
 from django.urls import reverse
 from rest_framework import status
 from rest_framework.test import APITestCase
-from .models.models import KPI, Asset, AssetKPI
+from .models import KPI, Asset, AssetKPI, DeadLetter, EvaluationLog, EvaluationRollup, RetentionPolicy, RollupWatermark
+from .core import vectorized
+from .core.archive import INDEX_NAME, ArchiveReader, Archiver, Segment, write_segment
+from .core.async_pipeline import AsyncPipeline
+from .core.benchmark import Workload
+from .core.cache import LRUCache
+from .core.data_sinks import BufferedDatabaseDataSink, BufferedSink, CopyDataSink, TeeSink, build_sink
+from .core.dead_letters import DatabaseDeadLetterStore, FileDeadLetterStore, Replayer, read_dead_letter_file
+from .core.data_sources import FileDataSource, MappedFileDataSource, load_checkpoint, save_checkpoint
+from .core.fanout import SharedPlan
+from .core.file_sinks import CSVFileSink, NDJSONFileSink, SegmentFileSink
+from .core.interfaces import DataSink, DataSource
+from .core.interpreter import CustomInterpreter, cache_info, regex_cache
+from .core.metrics import Counter as MetricCounter, Histogram, MESSAGES, STAGE_SECONDS, SummaryLogger, registry
+from .core.parallel import WorkerFailed, _collect, merge_reports, shard_for, split_byte_ranges
+from .core.pipeline import MessageProcessor
+from .core.retention import PolicySet, Purger
+from .core.rollups import RollupBuilder
+from .core.routing import RoutingIndex
+from .core.streaming import StdinDataSource, TailDataSource, TCPDataSource, open_source
+from .core.throttling import TokenBucket, TimestampPacer
+from .management.commands.benchmark_interpreter import legacy_evaluate
+
 
 class KPIModelTests(TestCase):
     """
@@ -24,6 +64,13 @@ class KPIModelTests(TestCase):
         """Test the evaluation of a KPI expression."""
         self.assertEqual(self.kpi.expression, "ATTR+50")
 
+    def test_every_output_attribute_id_fits_where_results_are_stored(self):
+        """Test that the columns holding result series are as wide as the generated series names."""
+        width = AssetKPI._meta.get_field('output_attribute_id').max_length
+        for model in (EvaluationLog, EvaluationRollup, RetentionPolicy, DeadLetter):
+            field = 'output_attribute_id' if model is DeadLetter else 'attribute_id'
+            self.assertGreaterEqual(model._meta.get_field(field).max_length, width, model.__name__)
+
 
 class KPIAPITests(APITestCase):
     """
@@ -46,7 +93,15 @@ class KPIAPITests(APITestCase):
         url = reverse('kpi-list')
         response = self.client.get(url, format='json')
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertGreaterEqual(len(response.data), 1)
+        self.assertGreaterEqual(len(response.data["results"]), 1)
+
+    def test_create_kpi_rejects_invalid_expression(self):
+        """Test that bad regex patterns and syntax errors fail at creation."""
+        url = reverse('kpi-list')
+        for expression in ("Regex(ATTR, '[unclosed')", "ATTR +"):
+            response = self.client.post(url, {"name": "Bad KPI", "expression": expression}, format='json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertIn("expression", response.data)
 
     def test_retrieve_kpi(self):
         """Test retrieving a specific KPI by ID."""
@@ -77,7 +132,7 @@ class AssetAPITests(APITestCase):
         url = reverse('asset-list')
         response = self.client.get(url, format='json')
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertGreaterEqual(len(response.data), 1)
+        self.assertGreaterEqual(len(response.data["results"]), 1)
 
     def test_retrieve_asset(self):
         """Test retrieving a specific Asset by ID."""
@@ -113,7 +168,7 @@ class AssetKPIAPITests(APITestCase):
         url = reverse('assetkpi-list')
         response = self.client.get(url, format='json')
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertGreaterEqual(len(response.data), 1)
+        self.assertGreaterEqual(len(response.data["results"]), 1)
 
     def test_retrieve_asset_kpi(self):
         """Test retrieving a specific AssetKPI by ID."""
@@ -134,6 +189,152 @@ class AssetKPIAPITests(APITestCase):
 
 
 
+class ResponseCacheTests(APITestCase):
+    """
+    Tests for the cached, conditional KPI/Asset/AssetKPI responses.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.kpi = KPI.objects.create(name="Sample KPI", expression="ATTR+50")
+        self.asset = Asset.objects.create(asset_id="A001", name="Test Asset")
+        AssetKPI.objects.create(asset=self.asset, kpi=self.kpi, attribute_id="Temp")
+
+    def test_repeated_get_is_served_from_cache(self):
+        """Test that a cached list is returned without querying the database."""
+        url = reverse('kpi-list')
+        first = self.client.get(url)
+        with self.assertNumQueries(0):
+            second = self.client.get(url)
+        self.assertEqual(second.json(), first.json())
+        self.assertEqual(second['ETag'], first['ETag'])
+
+    def test_conditional_get_returns_not_modified(self):
+        """Test that If-None-Match returns 304 and If-Modified-Since, only accurate to the second, does not."""
+        url = reverse('assetkpi-list')
+        response = self.client.get(url)
+        with self.assertNumQueries(0):
+            not_modified = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(not_modified.status_code, status.HTTP_304_NOT_MODIFIED)
+        since = self.client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(since.status_code, status.HTTP_200_OK)
+        self.assertEqual(since['ETag'], response['ETag'])
+
+    def test_changes_invalidate_dependent_responses(self):
+        """Test that saving a model changes the ETag of responses depending on it."""
+        kpi_url = reverse('kpi-detail', args=[self.kpi.id])
+        link_url = reverse('assetkpi-list')
+        kpi_etag = self.client.get(kpi_url)['ETag']
+        link_etag = self.client.get(link_url)['ETag']
+        asset_etag = self.client.get(reverse('asset-list'))['ETag']
+
+        self.client.patch(kpi_url, {"name": "Renamed"}, format='json')
+        response = self.client.get(kpi_url, HTTP_IF_NONE_MATCH=kpi_etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["name"], "Renamed")
+        self.assertNotEqual(self.client.get(link_url)['ETag'], link_etag)
+        self.assertEqual(self.client.get(reverse('asset-list'))['ETag'], asset_etag)
+
+
+class ConfigurationListTests(APITestCase):
+    """
+    Tests for pagination, sparse fieldsets and expansion on the configuration endpoints.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.kpi = KPI.objects.create(name="Sample KPI", expression="ATTR+50")
+        self.assets = [Asset.objects.create(asset_id=f"A{i:03d}", name=f"Asset {i}") for i in range(5)]
+        for asset in self.assets:
+            AssetKPI.objects.create(asset=asset, kpi=self.kpi, attribute_id="Temp")
+
+    def test_pages_follow_cursor(self):
+        """Test that following `next` links returns every asset exactly once."""
+        url = reverse('asset-list') + '?page_size=2'
+        seen = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            seen.extend(item["asset_id"] for item in response.data["results"])
+            url = response.data["next"]
+        self.assertEqual(seen, [asset.asset_id for asset in self.assets])
+
+    def test_sparse_fields(self):
+        """Test that `fields` trims the response and rejects unknown names."""
+        response = self.client.get(reverse('kpi-list'), {'fields': 'id,name'})
+        self.assertEqual(response.data["results"], [{"id": self.kpi.id, "name": "Sample KPI"}])
+        response = self.client.get(reverse('kpi-detail', args=[self.kpi.id]), {'fields': 'expression'})
+        self.assertEqual(response.data, {"expression": "ATTR+50"})
+        response = self.client.get(reverse('kpi-list'), {'fields': 'id,secret'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_expand_uses_one_query(self):
+        """Test that expanded relations are loaded with select_related."""
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('assetkpi-list'), {'expand': 'asset,kpi'})
+        first = response.data["results"][0]
+        self.assertEqual(first["asset"]["asset_id"], "A000")
+        self.assertEqual(first["kpi"]["expression"], "ATTR+50")
+        response = self.client.get(reverse('assetkpi-list'), {'expand': 'owner'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class BulkProvisioningTests(APITestCase):
+    """
+    Tests for the bulk asset and Asset-KPI endpoints.
+    """
+
+    def setUp(self):
+        self.kpi = KPI.objects.create(name="Temp KPI", expression="ATTR*2")
+        self.existing = Asset.objects.create(asset_id="A000", name="Old name")
+
+    def test_bulk_upsert_assets(self):
+        """Test that assets are created or updated by asset_id with per-row status."""
+        rows = [
+            {"asset_id": "A000", "name": "New name"},
+            {"asset_id": "A001", "name": "Pump"},
+            {"asset_id": "A001", "name": "Pump again"},
+            {"name": "No id"},
+        ]
+        response = self.client.post(reverse('asset-bulk'), rows, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        results = response.data["results"]
+        self.assertEqual([r["status"] for r in results], ["updated", "created", "error", "error"])
+        self.assertEqual(results[0]["id"], self.existing.id)
+        self.assertIn("asset_id", results[3]["errors"])
+        self.assertEqual(response.data["counts"], {"updated": 1, "created": 1, "error": 2})
+        self.existing.refresh_from_db()
+        self.assertEqual(self.existing.name, "New name")
+        self.assertEqual(Asset.objects.count(), 2)
+
+    def test_bulk_create_asset_kpis_updates_routing(self):
+        """Test that links are created once, resolved in bulk and routed without a reload."""
+        Asset.objects.create(asset_id="A001", name="Pump")
+        index = RoutingIndex().load()
+        rows = [
+            {"asset_id": "A001", "kpi": self.kpi.id, "attribute_id": "Temp"},
+            {"asset": self.existing.id, "kpi": self.kpi.id, "attribute_id": "Temp"},
+            {"asset_id": "A001", "kpi": self.kpi.id, "attribute_id": "Temp"},
+            {"asset_id": "missing", "kpi": self.kpi.id, "attribute_id": "Temp"},
+            {"asset": self.existing.id, "asset_id": "A000", "kpi": self.kpi.id, "attribute_id": "Temp"},
+        ]
+        with mock.patch('kpi_app.api.bulk.routing_index', index), self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('assetkpi-bulk'), rows, format='json')
+        results = response.data["results"]
+        self.assertEqual([r["status"] for r in results], ["created", "created", "exists", "error", "error"])
+        self.assertEqual(results[2]["id"], results[0]["id"])
+        self.assertEqual(AssetKPI.objects.count(), 2)
+        self.assertEqual(index.lookup("A001", "Temp")[0].evaluate(4), 8)
+
+        response = self.client.post(reverse('assetkpi-bulk'), rows[:1], format='json')
+        self.assertEqual(response.data["results"][0]["status"], "exists")
+
+    def test_bulk_rejects_non_list_body(self):
+        """Test that the body must be a list of objects."""
+        response = self.client.post(reverse('asset-bulk'), {"asset_id": "A002"}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
 class EvaluateExpressionTests(APITestCase):
     """
     Tests for custom evaluations with edge cases.
@@ -157,3 +358,1555 @@ class EvaluateExpressionTests(APITestCase):
         data = {"value": None}
         response = self.client.post(url, data, format='json')
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_non_finite_values_and_results(self):
+        """Test that NaN, infinities and overflowing results are rejected, not returned."""
+        url = reverse('assetkpi-evaluate', args=[self.asset_kpi.id])
+        for value in ("nan", "inf", "-Infinity", "1e400"):
+            response = self.client.post(url, {"value": value}, format='json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, value)
+        self.kpi.expression = "ATTR*ATTR"
+        self.kpi.save()
+        response = self.client.post(url, {"value": "1e200"}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class CustomInterpreterTests(TestCase):
+    """
+    Tests for the compiled expression cache of the interpreter.
+    """
+
+    def setUp(self):
+        self.cache = LRUCache(maxsize=2)
+        self.interpreter = CustomInterpreter(cache=self.cache)
+
+    def test_arithmetic_without_spaces(self):
+        """Test that ATTR is bound as a variable rather than substituted as text."""
+        self.assertEqual(self.interpreter.evaluate_expression("ATTR*2+1", "20"), 41)
+        self.assertEqual(self.interpreter.evaluate_expression("-(ATTR - 4) / 2", 10), -3.0)
+
+    def test_regex_expression(self):
+        """Test regex expressions return the string booleans the pipeline expects."""
+        self.assertEqual(self.interpreter.evaluate_expression("Regex(ATTR, '^ab.*')", "abc"), "True")
+        self.assertEqual(self.interpreter.evaluate_expression("Regex(ATTR, '^ab.*')", "xyz"), "False")
+
+    def test_compiled_expression_is_reused(self):
+        """Test that repeated evaluations of one expression hit the cache."""
+        for value in range(5):
+            self.interpreter.evaluate_expression("ATTR+50", value)
+        self.assertEqual(self.cache.info(), {'hits': 4, 'misses': 1, 'size': 1, 'maxsize': 2})
+
+    def test_cache_is_bounded(self):
+        """Test that the least recently used expression is evicted."""
+        for expression in ("ATTR+1", "ATTR+2", "ATTR+3"):
+            self.interpreter.evaluate_expression(expression, 1)
+        self.assertEqual(len(self.cache), 2)
+        self.assertNotIn("ATTR+1", self.cache)
+
+    def test_invalid_value(self):
+        """Test that non-numeric values are rejected for arithmetic expressions."""
+        with self.assertRaises(ValueError):
+            self.interpreter.evaluate_expression("ATTR+50", "INVALID")
+
+    def test_division_by_zero(self):
+        """Test that division by zero raises a ValueError."""
+        with self.assertRaises(ValueError):
+            self.interpreter.evaluate_expression("ATTR/0", 1)
+
+    def test_regex_patterns_are_compiled_once(self):
+        """Test that expressions sharing a pattern reuse one compiled regex."""
+        regex_cache.clear()
+        self.interpreter.evaluate_expression("Regex(ATTR, 'K\\d+')", "K1")
+        self.interpreter.evaluate_expression("Regex( ATTR , 'K\\d+' )", "K2")
+        info = cache_info()['regex']
+        self.assertEqual((info['misses'], info['size']), (1, 1))
+        self.assertGreaterEqual(info['hits'], 1)
+
+    def test_syntax_errors_report_position(self):
+        """Test that lexer and parser errors point at the offending input."""
+        cases = {
+            "ATTR + $": "position 7",
+            "(ATTR + 1": "Mismatched parentheses",
+            "ATTR 2": "position 5",
+            "Regex(ATTR, 'a') + 1": "position 17",
+            "ATTR + Regex(ATTR, 'a')": "whole expression",
+            "__import__('os')": "position 0",
+        }
+        for expression, message in cases.items():
+            with self.assertRaisesRegex(ValueError, message):
+                self.interpreter.compile(expression)
+
+    def test_regex_pattern_may_contain_escaped_quote(self):
+        """Test that a quote inside a pattern can be escaped."""
+        self.assertEqual(self.interpreter.evaluate_expression(r"Regex(ATTR, 'it\'s')", "it's"), "True")
+
+    def test_power_and_floor_division(self):
+        """Test that ** and // work with Python's precedence and that huge powers are refused."""
+        cases = {"ATTR ** 2": 9, "-ATTR ** 2": -9, "2 ** ATTR ** 2": 512, "ATTR ** -1": 1 / 3,
+                 "ATTR // 2 * 2": 2, "7 // ATTR": 2}
+        for expression, expected in cases.items():
+            self.assertEqual(self.interpreter.evaluate_expression(expression, 3), expected)
+        for expression, value in (("ATTR ** 1000000", 10), ("ATTR ** 0.5", -4), ("ATTR ** 2000", 1.5),
+                                  ("ATTR // 0", 3)):
+            with self.assertRaises(ValueError):
+                self.interpreter.evaluate_expression(expression, value)
+        self.assertEqual(self.interpreter.evaluate_expression("ATTR ** 1000000", 1), 1)
+
+    def test_legacy_regex_with_unescaped_quote(self):
+        """Test that a pattern stored before quotes needed escaping still compiles."""
+        self.assertEqual(self.interpreter.evaluate_expression("Regex(ATTR, 'it's')", "it's"), "True")
+        self.assertEqual(self.interpreter.evaluate_expression("Regex(ATTR, 'it's')", "its"), "False")
+
+    def test_incompatible_stored_kpis_are_reported_by_the_system_check(self):
+        """Test that `check --database` lists KPIs whose expression does not compile."""
+        KPI.objects.create(name="Fine", expression="ATTR ** 2 // 3")
+        broken = KPI.objects.create(name="Broken", expression="ATTR % 2")
+        with self.assertRaises(CommandError) as raised:
+            call_command('check', databases=['default'], fail_level='WARNING')
+        output = str(raised.exception)
+        self.assertIn(f"KPI {broken.id} (Broken)", output)
+        self.assertNotIn("Fine", output)
+
+    def test_constant_subexpressions_are_folded(self):
+        """Test that constant parts are computed at compile time."""
+        compiled = self.interpreter.compile("ATTR * (60 / 2) - -1")
+        self.assertEqual(compiled.evaluate(2), 61.0)
+        self.assertEqual(self.interpreter.compile("(1 + 2) * 3").evaluate(0), 9)
+
+
+class BufferedDatabaseDataSinkTests(TestCase):
+    """
+    Tests for the batched EvaluationLog sink.
+    """
+
+    def test_flushes_when_batch_is_full(self):
+        """Test that rows are only inserted once the batch size is reached."""
+        sink = BufferedDatabaseDataSink(batch_size=3, max_latency=60)
+        for minute in range(2):
+            sink.write_data("A001", "output_Temp", f"2024-10-31T10:0{minute}:00Z", minute)
+        self.assertEqual(EvaluationLog.objects.count(), 0)
+        sink.write_data("A001", "output_Temp", "2024-10-31T10:02:00Z", 2)
+        self.assertEqual(EvaluationLog.objects.count(), 3)
+
+    def test_close_flushes_remaining_rows(self):
+        """Test that closing the sink writes the partially filled batch."""
+        sink = BufferedDatabaseDataSink(batch_size=100, max_latency=60)
+        sink.write_data("A001", "output_Temp", "2024-10-31T10:00:00Z", 1.5)
+        sink.close()
+        self.assertEqual(EvaluationLog.objects.get().result, 1.5)
+        self.assertEqual(sink.rows_written, 1)
+
+    def test_invalid_row_is_rejected_on_write(self):
+        """Test that a bad row fails on its own and does not poison the batch."""
+        sink = BufferedDatabaseDataSink(batch_size=100, max_latency=60)
+        with self.assertRaises(Exception):
+            sink.write_data("A001", "output_Temp", "not a timestamp", 1)
+        sink.write_data("A001", "output_Temp", "2024-10-31T10:00:00Z", 1)
+        sink.flush()
+        self.assertEqual(EvaluationLog.objects.count(), 1)
+
+    def test_failed_flush_keeps_earlier_rows_for_the_next_flush(self):
+        """Test that a failing INSERT loses no rows: earlier ones are retried, the caller's are reported."""
+        sink = BufferedDatabaseDataSink(batch_size=3, max_latency=60)
+        sink.write_many([("A001", "output_Temp", "2024-10-31T10:00:00Z", 1),
+                         ("A001", "output_Temp", "2024-10-31T10:01:00Z", 2)])
+        with mock.patch.object(EvaluationLog.objects, 'bulk_create', side_effect=OperationalError("disk I/O error")):
+            failures = sink.write_many([("A001", "output_Temp", "2024-10-31T10:02:00Z", 3)])
+        self.assertEqual([row[3] for row, _ in failures], [3])
+        self.assertEqual(sink.pending(), 2)
+        sink.close()
+        self.assertEqual(sorted(EvaluationLog.objects.values_list('result', flat=True)), [1.0, 2.0])
+
+    def test_rejected_row_is_isolated_and_the_rest_written(self):
+        """Test that a row the backend refuses is split out of its batch instead of wedging the buffer."""
+        bulk_create = EvaluationLog.objects.bulk_create
+
+        def refuse_bad_rows(rows, **kwargs):
+            if any(row.attribute_id == "bad" for row in rows):
+                raise DataError("value too long for type character varying(100)")
+            return bulk_create(rows, **kwargs)
+
+        sink = BufferedDatabaseDataSink(batch_size=4, max_latency=60)
+        rows = [("A001", "bad" if minute == 2 else "output_Temp", f"2024-10-31T10:0{minute}:00Z", minute)
+                for minute in range(9)]
+        with mock.patch.object(EvaluationLog.objects, 'bulk_create', side_effect=refuse_bad_rows):
+            failures = sink.write_many(rows[:5], sources=[f"message {minute}" for minute in range(5)])
+            self.assertEqual(failures, [])
+            self.assertEqual([(row[3], source) for row, _, source in sink.take_rejected()], [(2, "message 2")])
+            self.assertEqual(sink.write_many(rows[5:]), [])
+            sink.close()
+        self.assertEqual(sink.take_rejected(), [])
+        self.assertEqual(sorted(EvaluationLog.objects.values_list('result', flat=True)),
+                         [0.0, 1.0, 3.0, 4.0, 5.0, 6.0, 7.0, 8.0])
+
+
+class CopyDataSinkTests(TestCase):
+    """
+    Tests for the COPY-based sink and its bulk INSERT fallback.
+    """
+
+    def write(self, sink):
+        sink.write_data("A,001", 'output_"Temp"', "2024-10-31T10:00:00Z", 1.5)
+        sink.write_data("A002", "output_Temp", "2024-10-31T13:00:00+02:00", "2")
+        sink.close()
+
+    def test_copy_payload_is_quoted_csv(self):
+        """Test that ids with commas and quotes are escaped for COPY's CSV format."""
+        sink = CopyDataSink()
+        batch = [sink.build_row("A,001", 'output_"Temp"', "2024-10-31T10:00:00Z", 1.5)]
+        self.assertEqual(sink.copy_payload(batch).getvalue(),
+                         '"A,001","output_""Temp""",2024-10-31T10:00:00+00:00,1.5\n')
+        self.assertIn('FROM STDIN WITH (FORMAT csv)', sink.copy_statement())
+
+    def test_copies_through_the_cursor_on_postgresql(self):
+        """Test that flushes go through cursor.copy on PostgreSQL instead of bulk_create."""
+        copy = mock.MagicMock()
+        raw_cursor = mock.Mock(spec=['copy'])
+        raw_cursor.copy = mock.MagicMock()
+        raw_cursor.copy.return_value.__enter__.return_value = copy
+        wrapper = mock.MagicMock()
+        wrapper.__enter__.return_value.cursor = raw_cursor
+        with mock.patch('kpi_app.core.data_sinks.connection') as fake_connection, \
+                mock.patch.object(EvaluationLog.objects, 'bulk_create') as bulk_create:
+            fake_connection.vendor = 'postgresql'
+            fake_connection.ops.quote_name = lambda name: f'"{name}"'
+            fake_connection.cursor.return_value = wrapper
+            self.write(CopyDataSink(batch_size=10))
+        bulk_create.assert_not_called()
+        statement = raw_cursor.copy.call_args[0][0]
+        self.assertTrue(statement.startswith('COPY "kpi_app_evaluationlog" ("asset_id", "attribute_id"'))
+        self.assertEqual(copy.write.call_args[0][0].count('\n'), 2)
+
+    def test_writes_rows_on_the_current_backend(self):
+        """Test the sink end to end: COPY on PostgreSQL, bulk INSERT elsewhere."""
+        self.write(CopyDataSink(batch_size=10))
+        self.assertEqual(
+            sorted(EvaluationLog.objects.values_list('asset_id', 'attribute_id', 'result')),
+            [("A,001", 'output_"Temp"', 1.5), ("A002", "output_Temp", 2.0)],
+        )
+        self.assertEqual(EvaluationLog.objects.get(asset_id="A002").timestamp.isoformat(),
+                         "2024-10-31T11:00:00+00:00")
+
+    @skipUnless(connection.vendor == 'postgresql', "requires the PostgreSQL backend (set POSTGRES_DB)")
+    def test_copy_assigns_ids_for_rollups(self):
+        """Test that copied rows get sequence ids the rollup watermark can follow."""
+        sink = CopyDataSink(batch_size=10, rollups=True)
+        self.write(sink)
+        self.assertEqual(EvaluationRollup.objects.filter(resolution='day').count(), 2)
+
+
+class FileSinkTests(TestCase):
+    """
+    Tests for the NDJSON, CSV and segment file sinks and the tee sink.
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def test_ndjson_and_csv_sinks(self):
+        """Test that rows are normalized, buffered until flushed, and the CSV header written once."""
+        ndjson = NDJSONFileSink(self.path("out.ndjson"), batch_size=10)
+        ndjson.write_data("A001", "output_Temp", "2024-10-31T10:00:00Z", 1.5)
+        ndjson.write_data("A001", "output_Match", "2024-10-31T10:00:00Z", "True")
+        self.assertEqual(ndjson.pending(), 2)
+        self.assertEqual(ndjson.write_many([("A001", "output_Temp", "not a time", 1)])[0][0][2], "not a time")
+        ndjson.close()
+        with open(self.path("out.ndjson")) as f:
+            rows = [json.loads(line) for line in f]
+        self.assertEqual(rows[0], {"asset_id": "A001", "attribute_id": "output_Temp",
+                                   "timestamp": "2024-10-31T10:00:00+00:00", "result": 1.5})
+        self.assertEqual(rows[1]["result"], "True")
+
+        for _ in range(2):
+            sink = CSVFileSink(self.path("out.csv"))
+            sink.write_data("A,001", "output_Temp", "2024-10-31T10:00:00Z", 2)
+            sink.close()
+        with open(self.path("out.csv")) as f:
+            self.assertEqual(f.read().splitlines(), [
+                "asset_id,attribute_id,timestamp,result",
+                '"A,001",output_Temp,2024-10-31T10:00:00+00:00,2',
+                '"A,001",output_Temp,2024-10-31T10:00:00+00:00,2',
+            ])
+
+    def test_segment_sink_rotates_and_publishes(self):
+        """Test size-capped rotation, .part naming of the open segment and numbering across runs."""
+        segments = self.path("segments")
+        sink = SegmentFileSink(segments, batch_size=1, max_bytes=200, fsync_interval=0)
+        for minute in range(5):
+            sink.write_data("A001", "output_Temp", f"2024-10-31T10:{minute:02d}:00Z", minute)
+        self.assertTrue(any(name.endswith(".part") for name in os.listdir(segments)))
+        sink.close()
+        names = sorted(os.listdir(segments))
+        self.assertEqual(names, [f"evaluations-{i:06d}.ndjson" for i in range(1, len(names) + 1)])
+        self.assertGreater(len(names), 1)
+        lines = []
+        for name in names:
+            with open(os.path.join(segments, name)) as f:
+                lines.extend(f.read().splitlines())
+        self.assertEqual([json.loads(line)["result"] for line in lines], [0, 1, 2, 3, 4])
+
+        sink = SegmentFileSink(segments)
+        sink.write_data("A001", "output_Temp", "2024-10-31T11:00:00Z", 5)
+        sink.close()
+        self.assertIn(f"evaluations-{len(names) + 1:06d}.ndjson", os.listdir(segments))
+
+    def test_segment_sink_publishes_full_and_leftover_segments(self):
+        """Test that a full segment is published by the write that fills it and a crashed run's .part on start-up."""
+        segments = self.path("segments")
+        sink = SegmentFileSink(segments, batch_size=1, max_bytes=1)
+        sink.write_data("A001", "output_Temp", "2024-10-31T10:00:00Z", 1)
+        self.assertEqual(os.listdir(segments), ["evaluations-000001.ndjson"])
+
+        with open(os.path.join(segments, "evaluations-000002.ndjson.part"), "w") as f:
+            f.write('{"result": 2}\n{"resu')
+        sink = SegmentFileSink(segments)
+        self.assertEqual(sorted(os.listdir(segments)), ["evaluations-000001.ndjson", "evaluations-000002.ndjson"])
+        with open(os.path.join(segments, "evaluations-000002.ndjson")) as f:
+            self.assertEqual(f.read(), '{"result": 2}\n')
+        sink.write_data("A001", "output_Temp", "2024-10-31T11:00:00Z", 3)
+        sink.close()
+        self.assertIn("evaluations-000003.ndjson", os.listdir(segments))
+
+    def test_tee_sink_isolates_slow_secondaries(self):
+        """Test that the primary is written synchronously while a slow secondary drains on its own."""
+        class SlowSink(ListDataSink):
+            def write_many(self, rows):
+                release.wait(5)
+                return super().write_many(rows)
+
+        release = threading.Event()
+        primary, slow = ListDataSink(), SlowSink()
+        tee = TeeSink([primary, slow, NDJSONFileSink(self.path("tee.ndjson"), batch_size=100)])
+        failures = tee.write_many([("A001", "output_Temp", "2024-10-31T10:00:00Z", 1),
+                                   ("A001", "output_Temp", "2024-10-31T10:01:00Z", -1)])
+        self.assertEqual(len(failures), 1)
+        self.assertEqual(len(primary.rows), 1)
+        self.assertEqual(slow.rows, [])
+
+        with self.assertLogs('kpi_app.core.data_sinks', 'WARNING'):
+            release.set()
+            tee.close()
+        self.assertEqual(len(slow.rows), 1)
+        self.assertTrue(primary.closed and slow.closed)
+        with open(self.path("tee.ndjson")) as f:
+            self.assertEqual(len(f.read().splitlines()), 2)
+        self.assertIsInstance(build_sink(['db', f'csv:{self.path("b.csv")}']), TeeSink)
+        with self.assertRaises(ValueError):
+            build_sink(['csv'])
+
+
+class FakeClock:
+    """Deterministic clock whose sleep advances time instead of blocking."""
+
+    def __init__(self):
+        self.now = 0.0
+        self.slept = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+class ThrottlingTests(TestCase):
+    """
+    Tests for the rate limiter and timestamp pacer used by process_messages.
+    """
+
+    def test_token_bucket_limits_rate(self):
+        """Test that the bucket allows a burst and then spaces messages by 1/rate."""
+        clock = FakeClock()
+        bucket = TokenBucket(rate=2, burst=2, clock=clock, sleep=clock.sleep)
+        for _ in range(4):
+            bucket.acquire()
+        self.assertEqual(clock.slept, [0.5, 0.5])
+
+    def test_pacer_follows_message_timestamps(self):
+        """Test that replay waits for the delta between message timestamps."""
+        clock = FakeClock()
+        pacer = TimestampPacer(speed=2, clock=clock, sleep=clock.sleep)
+        pacer.wait_for("2024-10-31T10:00:00Z")
+        pacer.wait_for("2024-10-31T10:00:10Z")
+        pacer.wait_for("2024-10-31T10:00:05Z")  # out of order, not delayed
+        self.assertEqual(clock.slept, [5.0])
+
+
+class ProcessMessagesCommandTests(TestCase):
+    """
+    End-to-end tests for the process_messages management command.
+    """
+
+    def setUp(self):
+        kpi = KPI.objects.create(name="Temp KPI", expression="ATTR*2")
+        asset = Asset.objects.create(asset_id="Asset123", name="Sensor")
+        AssetKPI.objects.create(asset=asset, kpi=kpi, attribute_id="Temp")
+
+    def write_messages(self, lines):
+        handle = tempfile.NamedTemporaryFile('w', suffix='.txt', delete=False, encoding='utf-8')
+        with handle:
+            handle.write("\n".join(lines) + "\n")
+        self.addCleanup(os.remove, handle.name)
+        return handle.name
+
+    def run_command(self, *args):
+        out = io.StringIO()
+        call_command('process_messages', *args, stdout=out)
+        return out.getvalue()
+
+    def test_processes_without_delay_and_reports_summary(self):
+        """Test that messages are evaluated, written and summarized."""
+        path = self.write_messages([
+            '{"asset_id": "Asset123", "attribute_id": "Temp", "timestamp": "2024-10-31T10:00:00Z", "value": "20"}',
+            '{"asset_id": "Asset123", "attribute_id": "Temp", "timestamp": "2024-10-31T10:05:00Z", "value": "30"}',
+            '{"asset_id": "Unknown", "attribute_id": "Temp", "timestamp": "2024-10-31T10:05:00Z", "value": "30"}',
+            '{"asset_id": "Asset123", "attribute_id": "Temp"}',
+        ])
+        output = self.run_command(path)
+        self.assertIn("Processed: 2, skipped: 2, failed: 0", output)
+        self.assertEqual(
+            sorted(EvaluationLog.objects.values_list('result', flat=True)), [40.0, 60.0]
+        )
+
+    def test_streaming_source_cannot_use_workers(self):
+        """Test that --workers is refused for sources that never end, whose chunks would wait indefinitely."""
+        with self.assertRaises(CommandError):
+            call_command('process_messages', '--source', 'tcp://127.0.0.1:1', '--workers', '2', stdout=io.StringIO())
+
+    def test_writes_to_several_sinks(self):
+        """Test that --sink options tee results to the database and a file."""
+        path = self.write_messages([
+            '{"asset_id": "Asset123", "attribute_id": "Temp", "timestamp": "2024-10-31T10:00:00Z", "value": "20"}',
+        ])
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        output_path = os.path.join(directory, "results.ndjson")
+        output = self.run_command(path, '--sink', 'db', '--sink', f'ndjson:{output_path}')
+        self.assertIn("Processed: 1, skipped: 0, failed: 0", output)
+        self.assertEqual(EvaluationLog.objects.get().result, 40.0)
+        with open(output_path) as f:
+            self.assertEqual(json.loads(f.read())["result"], 40.0)
+        with self.assertRaises(CommandError):
+            self.run_command(path, '--sink', 'parquet:out')
+
+
+class MetricsTests(TestCase):
+    """
+    Tests for the pipeline metrics and the /metrics endpoint.
+    """
+
+    def test_histogram_and_counter_rendering(self):
+        """Test the Prometheus text format of labelled counters and histograms."""
+        counter = MetricCounter('test_total', "Test counter.", ['status'])
+        counter.inc(2, 'ok')
+        histogram = Histogram('test_seconds', "Test histogram.", ['stage'], buckets=(0.1, 1.0))
+        histogram.observe(0.05, 'parse')
+        histogram.observe_many(1.0, 2, 'parse')
+        samples = [(name, labels, value) for name, _, labels, value in counter.samples() + histogram.samples()]
+        self.assertEqual(samples, [
+            ('test_total', ('ok',), 2),
+            ('test_seconds_bucket', ('parse', '0.1'), 1),
+            ('test_seconds_bucket', ('parse', '1.0'), 3),
+            ('test_seconds_bucket', ('parse', '+Inf'), 3),
+            ('test_seconds_count', ('parse',), 3),
+            ('test_seconds_sum', ('parse',), 1.05),
+        ])
+        self.assertEqual(histogram.quantile(0.5, 'parse'), 1.0)
+
+    def test_pipeline_metrics_and_web_endpoint(self):
+        """Test that processing a message shows up in the registry and summary line, but not in the web /metrics."""
+        kpi = KPI.objects.create(name="Temp KPI", expression="ATTR*2")
+        asset = Asset.objects.create(asset_id="Asset123", name="Sensor")
+        AssetKPI.objects.create(asset=asset, kpi=kpi, attribute_id="Temp")
+        processed = MESSAGES.value('processed')
+        evaluations = STAGE_SECONDS.snapshot('evaluate')[0]
+        processor = MessageProcessor(RoutingIndex().load(), ListDataSink())
+        processor.process({"asset_id": "Asset123", "attribute_id": "Temp", "timestamp": "2024-10-31T10:00:00Z",
+                           "value": 3})
+        self.assertEqual(MESSAGES.value('processed'), processed + 1)
+        self.assertEqual(STAGE_SECONDS.snapshot('evaluate')[0], evaluations + 1)
+
+        body = registry.render()
+        for stage in ('route', 'evaluate', 'sink_write'):
+            self.assertIn(f'kpi_stage_seconds_count{{stage="{stage}"}}', body)
+
+        # The web process only exports what its own requests update
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        body = response.content.decode()
+        self.assertIn('kpi_cache_hit_ratio{cache="expressions"}', body)
+        self.assertNotIn('kpi_stage_seconds', body)
+        self.assertNotIn('kpi_messages_total', body)
+
+        summary_logger = SummaryLogger()
+        summary_logger._last = (0.0, 0)
+        summary = summary_logger.summary()
+        self.assertIn(f"processed={MESSAGES.value('processed')}", summary)
+        self.assertIn("expressions_cache_hit_ratio=", summary)
+
+
+class RoutingIndexTests(TestCase):
+    """
+    Tests for the in-memory AssetKPI routing index and its signal handlers.
+    """
+
+    def setUp(self):
+        self.kpi = KPI.objects.create(name="Temp KPI", expression="ATTR*2")
+        self.asset = Asset.objects.create(asset_id="Asset123", name="Sensor")
+        self.link = AssetKPI.objects.create(asset=self.asset, kpi=self.kpi, attribute_id="Temp")
+        self.index = RoutingIndex()
+        # Point the signal handlers at this test's index
+        patcher = mock.patch('kpi_app.signals.routing_index', self.index)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_load_uses_one_query(self):
+        """Test that the index is built with a single select_related query."""
+        with self.assertNumQueries(1):
+            self.index.load()
+        with self.assertNumQueries(0):
+            (route,) = self.index.lookup("Asset123", "Temp")
+            self.assertEqual(route.evaluate(21), 42)
+
+    def test_signals_keep_index_fresh(self):
+        """Test that model changes are reflected without reloading once they commit."""
+        self.index.load()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.kpi.expression = "ATTR+1"
+            self.kpi.save()
+            # Not committed yet
+            self.assertEqual(self.index.lookup("Asset123", "Temp")[0].evaluate(5), 10)
+        self.assertEqual(self.index.lookup("Asset123", "Temp")[0].evaluate(5), 6)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.asset.asset_id = "Asset456"
+            self.asset.save()
+        self.assertEqual(self.index.lookup("Asset123", "Temp"), ())
+        self.assertEqual(len(self.index.lookup("Asset456", "Temp")), 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.link.delete()
+        self.assertEqual(self.index.lookup("Asset456", "Temp"), ())
+        self.assertEqual(len(self.index), 0)
+
+    def test_rolled_back_changes_never_reach_the_index(self):
+        """Test that a change whose transaction rolls back leaves the index as it was."""
+        self.index.load()
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            with contextlib.suppress(RuntimeError), transaction.atomic():
+                self.link.delete()
+                raise RuntimeError("roll back")
+        self.assertEqual(callbacks, [])
+        self.assertEqual(len(self.index.lookup("Asset123", "Temp")), 1)
+
+    def test_refresh_picks_up_changes_made_without_signals(self):
+        """Test that refresh_if_due reloads an index older than refresh_interval."""
+        self.index.refresh_interval = 60
+        self.index.load()
+        KPI.objects.filter(pk=self.kpi.pk).update(expression="ATTR+1")
+        self.assertFalse(self.index.refresh_if_due())
+        self.assertEqual(self.index.lookup("Asset123", "Temp")[0].evaluate(5), 10)
+        self.index.loaded_at -= 60
+        self.assertTrue(self.index.refresh_if_due())
+        self.assertEqual(self.index.lookup("Asset123", "Temp")[0].evaluate(5), 6)
+
+
+class FanOutTests(TestCase):
+    """
+    Tests for evaluating every KPI linked to one asset attribute.
+    """
+
+    def setUp(self):
+        self.asset = Asset.objects.create(asset_id="Asset123", name="Sensor")
+        self.kpis = [
+            KPI.objects.create(name="Celsius", expression="(ATTR - 32) * 5 / 9"),
+            KPI.objects.create(name="Kelvin", expression="(ATTR - 32) * 5 / 9 + 273.15"),
+            KPI.objects.create(name="Ratio", expression="100 / (ATTR - 32)"),
+        ]
+        for kpi in self.kpis:
+            AssetKPI.objects.create(asset=self.asset, kpi=kpi, attribute_id="Temp")
+        self.routing = RoutingIndex().load()
+
+    def test_common_subexpressions_are_planned_once(self):
+        """Test that shared subtrees become a single step of the plan."""
+        interpreter = CustomInterpreter()
+        asts = [interpreter.get_compiled(kpi.expression).ast for kpi in self.kpis]
+        plan = SharedPlan(asts)
+        # ATTR - 32, * 5, / 9, + 273.15 and 100 / (...)
+        self.assertEqual(len(plan.steps), 5)
+        celsius, kelvin, ratio = plan.evaluate(212)
+        self.assertEqual(celsius, 100)
+        self.assertAlmostEqual(kelvin, 373.15)
+        self.assertAlmostEqual(ratio, 100 / 180)
+
+    def test_message_writes_one_row_per_kpi(self):
+        """Test that a message fans out to every linked KPI in one sink call."""
+        sink = ListDataSink()
+        sink.write_many = mock.Mock(wraps=sink.write_many)
+        processor = MessageProcessor(self.routing, sink)
+        message = {"asset_id": "Asset123", "attribute_id": "Temp", "timestamp": "2024-10-31T10:00:00Z", "value": "212"}
+        self.assertEqual(processor.process(message), 'processed')
+        sink.write_many.assert_called_once()
+        outputs = {row[1]: row[3] for row in sink.rows}
+        self.assertEqual(set(outputs), {
+            "output_Temp", f"output_Temp_{self.kpis[1].pk}", f"output_Temp_{self.kpis[2].pk}",
+        })
+        self.assertEqual(outputs["output_Temp"], 100)
+
+    def test_output_names_survive_deleting_the_oldest_link(self):
+        """Test that removing the first link does not rename the other KPIs' series."""
+        links = list(AssetKPI.objects.order_by('id'))
+        names = [link.output_attribute_id for link in links]
+        self.assertEqual(names, ["output_Temp", f"output_Temp_{self.kpis[1].pk}", f"output_Temp_{self.kpis[2].pk}"])
+        self.routing.asset_kpi_deleted(links[0])
+        self.assertEqual([route.output_attribute_id for route in self.routing.lookup("Asset123", "Temp")],
+                         names[1:])
+        links[0].delete()
+
+        again = AssetKPI.objects.create(asset=self.asset, kpi=self.kpis[2], attribute_id="Temp")
+        self.assertEqual(again.output_attribute_id, f"output_Temp_{self.kpis[2].pk}_2")
+        routing = RoutingIndex().load()
+        self.assertEqual([route.output_attribute_id for route in routing.lookup("Asset123", "Temp")],
+                         names[1:] + [again.output_attribute_id])
+
+    def test_failing_kpi_does_not_block_the_others(self):
+        """Test that a division by zero only drops the KPI that divides."""
+        processor = MessageProcessor(self.routing, ListDataSink())
+        message = {"asset_id": "Asset123", "attribute_id": "Temp", "timestamp": "2024-10-31T10:00:00Z", "value": 32}
+        with self.assertLogs('kpi_app.core.pipeline', level='WARNING') as logs:
+            status, rows = processor.evaluate(message)
+        self.assertIn("Division by zero", logs.output[0])
+        self.assertEqual(status, 'processed')
+        self.assertEqual([row[3] for row in rows], [0, 273.15])
+        self.assertEqual(processor.failures, {'ValueError': 1})
+
+
+@skipUnless(vectorized.np is not None, "numpy is not installed")
+class VectorizedEvaluationTests(TestCase):
+    """
+    Tests for evaluating one expression over many values with NumPy.
+    """
+
+    def setUp(self):
+        self.interpreter = CustomInterpreter(cache=LRUCache())
+
+    def test_arithmetic_matches_scalar_evaluation(self):
+        """Test that vectorized results agree with the scalar interpreter."""
+        values = [0, 1.5, "20", -3]
+        batch = self.interpreter.evaluate_many("-(ATTR - 4) * 2 + 1", values)
+        expected = [self.interpreter.evaluate_expression("-(ATTR - 4) * 2 + 1", v) for v in values]
+        self.assertEqual(batch.tolist(), expected)
+
+    def test_division_by_zero_is_masked(self):
+        """Test that per-row division by zero is flagged instead of raising."""
+        batch = self.interpreter.evaluate_many("10 / ATTR", [2, 0, "oops", 5])
+        self.assertEqual(batch.errors.tolist(), [False, True, True, False])
+        self.assertEqual(batch.tolist(), [5.0, None, None, 2.0])
+
+    def test_power_and_floor_division_match_scalar_evaluation(self):
+        """Test that ** and // agree with the scalar interpreter, failed rows included."""
+        values = [3, -4, 7.5, 1e200, 0]
+        for expression in ("ATTR ** 2 * 2 ** -1", "ATTR ** 0.5", "100 // ATTR"):
+            expected = []
+            for value in values:
+                try:
+                    expected.append(self.interpreter.evaluate_expression(expression, value))
+                except ValueError:
+                    expected.append(None)
+            self.assertEqual(self.interpreter.evaluate_many(expression, values).tolist(), expected)
+
+    def test_booleans_fail_whatever_else_is_in_the_batch(self):
+        """Test that a boolean is rejected as in the scalar path, even in an all-numeric batch."""
+        for values in ([True, 2], [True, False], [True, "2"], vectorized.np.array([True, False])):
+            batch = self.interpreter.evaluate_many("ATTR + 1", values)
+            self.assertTrue(batch.errors[0], values)
+            with self.assertRaises(ValueError):
+                self.interpreter.evaluate_expression("ATTR + 1", values[0])
+        self.assertEqual(self.interpreter.evaluate_many("ATTR + 1", [True, 2]).tolist(), [None, 3.0])
+
+    def test_regex_over_values(self):
+        """Test that regex KPIs are matched for every value."""
+        batch = self.interpreter.evaluate_many("Regex(ATTR, 'ab.*')", ["abc", "x", "abc", 12])
+        self.assertEqual(batch.tolist(), ["True", "False", "True", "False"])
+
+
+class EvaluateBatchTests(APITestCase):
+    """
+    Tests for the batch evaluation endpoints.
+    """
+
+    def setUp(self):
+        self.asset = Asset.objects.create(asset_id="A001", name="Test Asset")
+        self.double = AssetKPI.objects.create(
+            asset=self.asset, kpi=KPI.objects.create(name="Double", expression="ATTR*2"), attribute_id="Temp")
+        self.regex = AssetKPI.objects.create(
+            asset=self.asset, kpi=KPI.objects.create(name="Code", expression="Regex(ATTR, 'E\\d+')"),
+            attribute_id="Code")
+
+    def test_evaluate_batch_for_one_asset_kpi(self):
+        """Test evaluating many values against one Asset-KPI, with per-item errors."""
+        url = reverse('assetkpi-evaluate-batch', args=[self.double.id])
+        response = self.client.post(url, {"values": [1, "2.5", "bad"]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["results"], [2, 5.0, None])
+        self.assertEqual(response.data["errors"][:2], [None, None])
+        self.assertIsNotNone(response.data["errors"][2])
+
+    def test_evaluate_batch_flags_non_finite_values(self):
+        """Test that non-finite inputs and results are per-item errors in both batch endpoints."""
+        url = reverse('assetkpi-evaluate-batch', args=[self.double.id])
+        response = self.client.post(url, {"values": ["inf", "1", "nan", "1e308"]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["results"], [None, 2, None, None])
+        self.assertEqual([error is None for error in response.data["errors"]], [False, True, False, False])
+
+        url = reverse('assetkpi-bulk-evaluate')
+        response = self.client.post(url, {"asset_kpi": [self.double.id] * 2, "value": ["inf", "1"]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["results"], [None, 2])
+
+    def test_evaluate_batch_requires_list(self):
+        """Test that a missing values list is rejected."""
+        url = reverse('assetkpi-evaluate-batch', args=[self.double.id])
+        response = self.client.post(url, {"values": "1"}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_bulk_evaluate_row_and_columnar_forms(self):
+        """Test evaluating across Asset-KPIs in both accepted body layouts."""
+        url = reverse('assetkpi-bulk-evaluate')
+        rows = {"items": [
+            {"asset_kpi": self.double.id, "value": 3},
+            {"asset_kpi": self.regex.id, "value": "E42"},
+            {"asset_kpi": 999999, "value": 1},
+        ]}
+        columns = {"asset_kpi": [self.double.id, self.regex.id, 999999], "value": [3, "E42", 1]}
+        for body in (rows, columns):
+            with self.assertNumQueries(1):
+                response = self.client.post(url, body, format='json')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(response.data["results"], [6, "True", None])
+            self.assertEqual(response.data["errors"][2], "AssetKPI 999999 not found.")
+
+
+class ParallelIngestTests(TestCase):
+    """
+    Tests for sharding and byte-range splitting used by process_messages --workers.
+    """
+
+    def test_shard_is_stable_per_asset(self):
+        """Test that one asset always maps to the same worker."""
+        shards = {shard_for("Asset123", 4) for _ in range(10)}
+        self.assertEqual(len(shards), 1)
+        self.assertTrue(0 <= shards.pop() < 4)
+
+    def test_byte_ranges_cover_every_line_once(self):
+        """Test that readers over split ranges see each message exactly once."""
+        handle = tempfile.NamedTemporaryFile('w', suffix='.txt', delete=False, encoding='utf-8')
+        with handle:
+            for i in range(100):
+                handle.write(f'{{"asset_id": "A{i}", "padding": "{"x" * (i % 7)}"}}\n')
+        self.addCleanup(os.remove, handle.name)
+
+        seen = []
+        for start, end in split_byte_ranges(handle.name, 7):
+            seen.extend(m["asset_id"] for m in FileDataSource(handle.name, start, end).read_data())
+        self.assertEqual(seen, [f"A{i}" for i in range(100)])
+
+    def test_merge_reports(self):
+        """Test that worker reports are summed into one report."""
+        merged = merge_reports([
+            {'counts': {'processed': 2, 'skipped': 1}, 'failures': {'ValueError': 1}},
+            {'counts': {'processed': 3, 'failed': 1}, 'failures': {'ValueError': 1}},
+        ])
+        self.assertEqual(merged['counts'], {'processed': 5, 'skipped': 1, 'failed': 1})
+        self.assertEqual(merged['failures'], {'ValueError': 2})
+
+    def test_worker_that_dies_without_reporting_fails_the_run(self):
+        """Test that the parent stops waiting for a worker that exited without a report."""
+        context = multiprocessing.get_context()
+        process = context.Process(target=os._exit, args=(3,), daemon=True)
+        process.start()
+        with mock.patch('kpi_app.core.parallel.POLL_INTERVAL', 0.05):
+            with self.assertRaisesRegex(WorkerFailed, "exit codes: 3"):
+                _collect(context.Queue(), [process])
+
+
+class ParallelRunTests(TransactionTestCase):
+    """
+    Runs process_messages with real worker processes, which need committed data.
+    """
+
+    def test_sharded_and_split_file_runs(self):
+        """Test that --workers 2 evaluates every message once, with and without --split-file."""
+        kpi = KPI.objects.create(name="Temp KPI", expression="ATTR*2")
+        for number in range(4):
+            asset = Asset.objects.create(asset_id=f"Asset{number}", name="Sensor")
+            AssetKPI.objects.create(asset=asset, kpi=kpi, attribute_id="Temp")
+        handle = tempfile.NamedTemporaryFile('w', suffix='.txt', delete=False, encoding='utf-8')
+        with handle:
+            for minute in range(20):
+                handle.write(json.dumps({"asset_id": f"Asset{minute % 4}", "attribute_id": "Temp",
+                                         "timestamp": f"2024-10-31T10:{minute:02d}:00Z", "value": minute}) + "\n")
+        self.addCleanup(os.remove, handle.name)
+
+        for extra in ([], ['--split-file']):
+            EvaluationLog.objects.all().delete()
+            out = io.StringIO()
+            call_command('process_messages', handle.name, '--workers', '2', *extra, stdout=out)
+            self.assertIn("Processed: 20, skipped: 0, failed: 0", out.getvalue())
+            self.assertIn("worker 2:", out.getvalue())
+            self.assertEqual(sorted(EvaluationLog.objects.values_list('result', flat=True)),
+                             [minute * 2.0 for minute in range(20)])
+
+
+class MappedFileDataSourceTests(TestCase):
+    """
+    Tests for the memory-mapped batched JSONL reader.
+    """
+
+    def setUp(self):
+        handle = tempfile.NamedTemporaryFile('wb', suffix='.txt', delete=False)
+        with handle:
+            for i in range(10):
+                handle.write(f'{{"asset_id": "A{i}"}}\n'.encode('utf-8'))
+                if i == 4:
+                    self.malformed_offset = handle.tell()
+                    handle.write(b'not json\n\n')
+        self.path = handle.name
+        self.addCleanup(os.remove, self.path)
+
+    def test_reads_batches_and_counts_malformed_lines(self):
+        """Test batching and that malformed lines are counted by offset, not printed."""
+        source = MappedFileDataSource(self.path, batch_size=4, window_size=16)
+        with contextlib.redirect_stdout(io.StringIO()) as out:
+            batches = list(source.read_batches())
+        self.assertEqual([len(batch) for batch in batches], [4, 4, 2])
+        self.assertEqual([m["asset_id"] for batch in batches for m in batch], [f"A{i}" for i in range(10)])
+        self.assertEqual((source.malformed, source.malformed_offsets), (1, [self.malformed_offset]))
+        self.assertEqual(out.getvalue(), "")
+        self.assertEqual(source.offset, os.path.getsize(self.path))
+
+    def test_byte_range_matches_line_reader(self):
+        """Test that offsets select the same lines as the line-by-line reader."""
+        for start, end in ((0, 30), (5, 90), (31, None)):
+            mapped_source = MappedFileDataSource(self.path, start, end)
+            mapped = list(mapped_source.read_data())
+            line_source = FileDataSource(self.path, start, end)
+            with mock.patch('kpi_app.core.data_sources.logger'):
+                lines = list(line_source.read_data())
+            self.assertEqual(mapped, lines)
+            self.assertEqual(mapped_source.malformed, line_source.malformed)
+        self.assertEqual(line_source.malformed, 1)
+
+    def test_resume_from_checkpoint(self):
+        """Test that a saved offset resumes after the last yielded batch."""
+        checkpoint = self.path + ".checkpoint"
+        self.addCleanup(os.remove, checkpoint)
+        source = MappedFileDataSource(self.path, batch_size=3)
+        first = next(source.read_batches())
+        save_checkpoint(checkpoint, self.path, source.offset)
+
+        resumed = MappedFileDataSource(self.path, start_offset=load_checkpoint(checkpoint, self.path))
+        remaining = list(resumed.read_data())
+        self.assertEqual([m["asset_id"] for m in first + remaining], [f"A{i}" for i in range(10)])
+
+
+class EvaluationLogAPITests(APITestCase):
+    """
+    API tests for reading evaluation results with keyset pagination.
+    """
+
+    def setUp(self):
+        rows = [
+            EvaluationLog(asset_id="A001", attribute_id="output_Temp",
+                          timestamp=f"2024-10-31T10:{minute:02d}:00Z", result=minute)
+            for minute in range(5)
+        ]
+        # Two rows sharing a timestamp exercise the id tie-breaker
+        rows.append(EvaluationLog(asset_id="A001", attribute_id="output_Temp",
+                                  timestamp="2024-10-31T10:02:00Z", result=99))
+        rows.append(EvaluationLog(asset_id="A002", attribute_id="output_Temp",
+                                  timestamp="2024-10-31T10:02:00Z", result=-1))
+        EvaluationLog.objects.bulk_create(rows)
+
+    def test_filters_and_pages_through_window(self):
+        """Test filtering by asset and time window and following next links."""
+        url = reverse('evaluationlog-list')
+        response = self.client.get(url, {
+            "asset_id": "A001", "from": "2024-10-31T10:01:00Z", "to": "2024-10-31T10:04:00Z", "page_size": 2,
+        })
+        results = []
+        while True:
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            results.extend(row["result"] for row in response.data["results"])
+            if not response.data["next"]:
+                break
+            response = self.client.get(response.data["next"])
+        self.assertEqual(results, [1.0, 2.0, 99.0, 3.0])
+
+    def test_rejects_invalid_parameters(self):
+        """Test that malformed time windows and cursors return 400."""
+        url = reverse('evaluationlog-list')
+        self.assertEqual(self.client.get(url, {"from": "yesterday"}).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.get(url, {"cursor": "garbage"}).status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class EvaluationArchiveTests(APITestCase):
+    """
+    Tests for the columnar EvaluationLog archive and its merge into the API.
+    """
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root, ignore_errors=True)
+        settings_override = override_settings(EVALUATION_ARCHIVE_DIR=self.root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def create_logs(self, day, count, asset_id="A001"):
+        EvaluationLog.objects.bulk_create([
+            EvaluationLog(asset_id=asset_id, attribute_id="output_Temp",
+                          timestamp=f"2024-10-{day}T10:{minute:02d}:00Z", result=minute)
+            for minute in range(count)
+        ])
+
+    def test_segment_roundtrip_with_codecs(self):
+        """Test that segments restore ids, timestamps and results in order with every codec."""
+        for codec in ('none', 'zlib', 'lzma'):
+            path = os.path.join(self.root, f"{codec}.seg")
+            write_segment(path, "A001", "output_Temp", [3, 1, 2], [2_000_000, 1_000_000, 1_000_000],
+                          [3.5, 1.5, 2.5], codec=codec)
+            with Segment(path) as segment:
+                ids, timestamps, results = segment.read(start=1_000_000, end=2_000_000)
+                self.assertEqual(segment.header['codec'], codec)
+                self.assertEqual((segment.header['min'], segment.header['max'], segment.header['sum']),
+                                 (1.5, 3.5, 7.5))
+            self.assertEqual(ids.tolist(), [1, 2])
+            self.assertEqual(timestamps.tolist(), [1_000_000, 1_000_000])
+            self.assertEqual(results.tolist(), [1.5, 2.5])
+
+    def test_archive_command_moves_closed_days(self):
+        """Test that closed days leave the table and range/aggregate queries read them back."""
+        self.create_logs(30, 3)
+        self.create_logs(31, 2)
+        self.create_logs(30, 2, asset_id="A002")
+        out = io.StringIO()
+        call_command('archive_evaluations', '--before', '2024-10-31T12:00:00Z', '--codec', 'zlib', stdout=out)
+        self.assertIn("Archived 5 evaluation rows into 2 segments", out.getvalue())
+        self.assertEqual(EvaluationLog.objects.count(), 2)
+
+        reader = ArchiveReader()
+        block = reader.read("A001", "output_Temp", start=datetime_utc("2024-10-30T10:01:00"))
+        self.assertEqual(block.results.tolist(), [1.0, 2.0])
+        self.assertEqual(reader.aggregate("A001")["count"], 3)
+        self.assertEqual(reader.aggregate(end=datetime_utc("2024-10-30T10:01:00")),
+                         {"count": 2, "sum": 0.0, "min": 0.0, "max": 0.0, "avg": 0.0})
+
+        # Late rows for an archived day are merged into its segment on the next run
+        self.create_logs(30, 1)
+        Archiver(codec='none').archive(datetime_utc("2024-10-31T00:00:00"))
+        self.assertEqual(reader.aggregate("A001")["count"], 4)
+
+    def test_api_merges_archived_and_live_rows(self):
+        """Test that listing and retrieving return archived rows alongside live ones."""
+        self.create_logs(30, 3)
+        self.create_logs(31, 2)
+        archived_id = EvaluationLog.objects.order_by('id').first().id
+        Archiver().archive(datetime_utc("2024-10-31T00:00:00"))
+
+        url = reverse('evaluationlog-list')
+        response = self.client.get(url, {"asset_id": "A001", "page_size": 2})
+        timestamps = []
+        while True:
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            timestamps.extend(row["timestamp"] for row in response.data["results"])
+            if not response.data["next"]:
+                break
+            response = self.client.get(response.data["next"])
+        self.assertEqual(timestamps, [
+            "2024-10-30T10:00:00Z", "2024-10-30T10:01:00Z", "2024-10-30T10:02:00Z",
+            "2024-10-31T10:00:00Z", "2024-10-31T10:01:00Z",
+        ])
+
+        response = self.client.get(reverse('evaluationlog-detail', args=[archived_id]))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["timestamp"], "2024-10-30T10:00:00Z")
+
+    def test_index_limits_the_segments_opened(self):
+        """Test that lookups by id only open the segment whose id range holds the id, without walking the tree."""
+        for day in (28, 29, 30):
+            self.create_logs(day, 2)
+        last_id = EvaluationLog.objects.order_by('id').last().id
+        Archiver().archive(datetime_utc("2024-10-31T00:00:00"))
+
+        reader = ArchiveReader()
+        with mock.patch('kpi_app.core.archive.Segment', wraps=Segment) as opened, \
+                mock.patch('kpi_app.core.archive.Path.iterdir') as iterdir:
+            self.assertEqual(reader.find(last_id).result, 1.0)
+            self.assertIsNone(reader.find(last_id + 1))
+            self.assertEqual(len(reader.read("A001", limit=1)), 1)
+        self.assertEqual(opened.call_count, 2)
+        iterdir.assert_not_called()
+
+        # An archive written before the index existed is indexed on first use
+        os.remove(os.path.join(self.root, INDEX_NAME))
+        self.assertEqual(ArchiveReader().aggregate("A001")["count"], 6)
+        self.assertTrue(os.path.exists(os.path.join(self.root, INDEX_NAME)))
+
+    def test_ids_cannot_leave_the_archive(self):
+        """Test that ids such as '..' are encoded into directory names inside the archive root."""
+        reader = ArchiveReader()
+        day = datetime_utc("2024-10-30T00:00:00")
+        for asset_id in ("..", ".", ".index.jsonl", "a/../.."):
+            path = reader.segment_path(asset_id, "..", day)
+            self.assertEqual(path.resolve().parent.parent.parent, Path(self.root).resolve())
+            self.assertFalse(path.parent.parent.name.startswith("."))
+        with self.assertRaises(ValueError):
+            reader.segment_path("", "output_Temp", day)
+
+
+def datetime_utc(value):
+    return datetime.fromisoformat(value).replace(tzinfo=timezone.utc)
+
+
+class RetentionTests(APITestCase):
+    """
+    Tests for retention policies and the batched purge.
+    """
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root, ignore_errors=True)
+        settings_override = override_settings(EVALUATION_ARCHIVE_DIR=self.root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.now = datetime_utc("2024-11-10T12:00:00")
+
+    def create_logs(self, asset_id, days_ago):
+        EvaluationLog.objects.bulk_create([
+            EvaluationLog(asset_id=asset_id, attribute_id="output_Temp",
+                          timestamp=self.now - timedelta(days=age, minutes=1), result=age)
+            for age in days_ago
+        ])
+
+    def test_most_specific_policy_wins(self):
+        """Test policy resolution from exact match down to the catch-all."""
+        policies = PolicySet([
+            RetentionPolicy(raw_days=30),
+            RetentionPolicy(asset_id="A001", raw_days=7),
+            RetentionPolicy(asset_id="A001", attribute_id="output_Temp", raw_days=1),
+            RetentionPolicy(attribute_id="output_Hum", raw_days=14),
+        ])
+        self.assertEqual(policies.resolve("A001", "output_Temp").raw_days, 1)
+        self.assertEqual(policies.resolve("A001", "output_Hum").raw_days, 7)
+        self.assertEqual(policies.resolve("A002", "output_Hum").raw_days, 14)
+        self.assertEqual(policies.resolve("A002", "output_Temp").raw_days, 30)
+        self.assertIsNone(PolicySet([]).resolve("A001", "output_Temp"))
+
+    def test_purge_keeps_rollups_of_expired_rows(self):
+        """Test that expired raw rows go in small batches after being rolled up, and rollups expire later."""
+        RetentionPolicy.objects.create(raw_days=2, minute_days=5)
+        RetentionPolicy.objects.create(asset_id="A002")
+        RollupBuilder().build()
+        self.create_logs("A001", [0, 1, 3, 4, 6])
+        self.create_logs("A002", [6])
+
+        deleted = Purger(batch_size=1, now=self.now, dry_run=True).purge()
+        self.assertEqual(deleted["raw"], 3)
+        self.assertEqual(EvaluationLog.objects.count(), 6)
+
+        deleted = Purger(batch_size=1, now=self.now).purge()
+        self.assertEqual((deleted["raw"], deleted["minute"], deleted["hour"]), (3, 1, 0))
+        self.assertEqual(sorted(EvaluationLog.objects.filter(asset_id="A001").values_list("result", flat=True)),
+                         [0.0, 1.0])
+        self.assertEqual(EvaluationLog.objects.filter(asset_id="A002").count(), 1)
+        self.assertEqual(EvaluationRollup.objects.filter(asset_id="A001", resolution="hour").count(), 5)
+        self.assertEqual(EvaluationRollup.objects.filter(asset_id="A001", resolution="minute").count(), 4)
+
+    def test_purge_does_not_start_rollups(self):
+        """Test that purging a deployment without rollups deletes raw rows without building any."""
+        RetentionPolicy.objects.create(raw_days=2)
+        self.create_logs("A001", [0, 3])
+        deleted = Purger(now=self.now).purge()
+        self.assertEqual(deleted["raw"], 1)
+        self.assertFalse(EvaluationRollup.objects.exists())
+        self.assertFalse(RollupWatermark.objects.exists())
+
+    def test_purge_command_drops_expired_segments(self):
+        """Test that archived days past the raw retention are removed as whole files."""
+        self.create_logs("A001", [3, 10])
+        Archiver().archive(self.now)
+        RetentionPolicy.objects.create(raw_days=5)
+        out = io.StringIO()
+        with mock.patch("kpi_app.core.retention.timezone.now", return_value=self.now):
+            call_command("purge_evaluations", "--no-rollups", stdout=out)
+        self.assertIn("Deleted 0 evaluation rows", out.getvalue())
+        self.assertIn("1 archived segments", out.getvalue())
+        self.assertEqual(ArchiveReader().aggregate("A001")["sum"], 3.0)
+
+    def test_policy_api(self):
+        """Test creating policies through the API and rejecting duplicate scopes."""
+        url = reverse('retentionpolicy-list')
+        response = self.client.post(url, {"raw_days": 30, "hour_days": 365}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual((response.data["asset_id"], response.data["day_days"]), ("", None))
+        response = self.client.post(url, {"raw_days": 7}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class DeadLetterTests(TestCase):
+    """
+    Tests for the dead-letter store and the replay_dead_letters command.
+    """
+
+    def setUp(self):
+        self.kpi = KPI.objects.create(name="Temp KPI", expression="ATTR*2")
+        self.asset = Asset.objects.create(asset_id="Asset123", name="Sensor")
+        AssetKPI.objects.create(asset=self.asset, kpi=self.kpi, attribute_id="Temp")
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def write_messages(self, lines):
+        path = os.path.join(self.directory, "messages.txt")
+        with open(path, 'w', encoding='utf-8') as file:
+            file.write("\n".join(lines) + "\n")
+        return path
+
+    def run_command(self, name, *args):
+        out = io.StringIO()
+        call_command(name, *args, stdout=out)
+        return out.getvalue()
+
+    def test_records_skipped_and_malformed_messages(self):
+        """Test that skipped messages and undecodable lines are recorded instead of dropped."""
+        path = self.write_messages([
+            '{"asset_id": "Asset123", "attribute_id": "Temp", "timestamp": "2024-10-31T10:00:00Z", "value": "20"}',
+            '{"asset_id": "Pump7", "attribute_id": "Temp", "timestamp": "2024-10-31T10:05:00Z", "value": "30"}',
+            '{"asset_id": "Asset123", "attribute_id": "Temp", "value": "30"}',
+            '{"asset_id": "Asset123", "attribute_id"',
+        ])
+        self.run_command('process_messages', path, '--dead-letters', 'db')
+        letters = {letter.error_class: letter for letter in DeadLetter.objects.all()}
+        self.assertEqual(set(letters), {'NoRoute', 'MissingFields', 'MalformedJSON'})
+        self.assertEqual(letters['NoRoute'].stage, DeadLetter.ROUTE)
+        self.assertEqual(json.loads(letters['NoRoute'].message)['asset_id'], "Pump7")
+        self.assertIn("timestamp", letters['MissingFields'].reason)
+        self.assertEqual(letters['MalformedJSON'].message, '{"asset_id": "Asset123", "attribute_id"')
+        self.assertEqual(EvaluationLog.objects.count(), 1)
+
+    def test_records_failed_evaluations_with_their_output_attribute(self):
+        """Test that a KPI that raises is dead-lettered for its own output attribute only."""
+        self.kpi.expression = "ATTR/0"
+        self.kpi.save()
+        path = self.write_messages([
+            '{"asset_id": "Asset123", "attribute_id": "Temp", "timestamp": "2024-10-31T10:00:00Z", "value": "20"}',
+        ])
+        output = self.run_command('process_messages', path, '--dead-letters', 'db')
+        self.assertIn("failed: 1", output)
+        letter = DeadLetter.objects.get()
+        self.assertEqual((letter.error_class, letter.stage, letter.output_attribute_id),
+                         ('ValueError', DeadLetter.EVALUATE, 'output_Temp'))
+
+    def test_replays_after_the_missing_link_is_added(self):
+        """Test that replaying NoRoute letters writes their results and removes them."""
+        path = self.write_messages([
+            '{"asset_id": "Pump7", "attribute_id": "Temp", "timestamp": "2024-10-31T10:05:00Z", "value": "30"}',
+            '{"asset_id": "Pump8", "attribute_id": "Temp", "timestamp": "2024-10-31T10:05:00Z", "value": "40"}',
+        ])
+        self.run_command('process_messages', path, '--dead-letters', 'db')
+        self.assertIn("NoRoute: 2", self.run_command('replay_dead_letters', '--list'))
+
+        pump = Asset.objects.create(asset_id="Pump7", name="Pump")
+        AssetKPI.objects.create(asset=pump, kpi=self.kpi, attribute_id="Temp")
+        output = self.run_command('replay_dead_letters', '--error-class', 'NoRoute')
+        self.assertIn("NoRoute: 1 replayed, 1 still failing", output)
+        self.assertEqual(list(EvaluationLog.objects.values_list('asset_id', 'result')), [("Pump7", 60.0)])
+        remaining = DeadLetter.objects.get()
+        self.assertEqual(json.loads(remaining.message)['asset_id'], "Pump8")
+        self.assertEqual(remaining.attempts, 1)
+        self.assertIsNotNone(remaining.last_replayed_at)
+
+    def test_file_store_is_replayed_and_rewritten(self):
+        """Test that --dead-letters file:PATH appends JSON lines that can be replayed from the file."""
+        path = self.write_messages([
+            '{"asset_id": "Pump7", "attribute_id": "Temp", "timestamp": "2024-10-31T10:05:00Z", "value": "30"}',
+            'not json',
+        ])
+        letters_path = os.path.join(self.directory, "dead", "letters.ndjson")
+        self.run_command('process_messages', path, '--dead-letters', f'file:{letters_path}')
+        self.assertFalse(DeadLetter.objects.exists())
+        entries = read_dead_letter_file(letters_path)
+        self.assertEqual(sorted(entry['error_class'] for entry in entries), ['MalformedJSON', 'NoRoute'])
+
+        pump = Asset.objects.create(asset_id="Pump7", name="Pump")
+        AssetKPI.objects.create(asset=pump, kpi=self.kpi, attribute_id="Temp")
+        output = self.run_command('replay_dead_letters', '--file', letters_path)
+        self.assertIn("NoRoute: 1 replayed, 0 still failing", output)
+        self.assertIn("MalformedJSON: 0 replayed, 1 still failing", output)
+        self.assertEqual(EvaluationLog.objects.get().result, 60.0)
+        entries = read_dead_letter_file(letters_path)
+        self.assertEqual([(entry['error_class'], entry['attempts']) for entry in entries], [('MalformedJSON', 1)])
+
+    def test_store_buffers_until_flushed(self):
+        """Test that the file store writes nothing until a batch is due."""
+        letters_path = os.path.join(self.directory, "letters.ndjson")
+        store = FileDeadLetterStore(letters_path, batch_size=2, max_latency=60)
+        store.add({"asset_id": "A"}, 'NoRoute', "no link", DeadLetter.ROUTE)
+        store.flush_if_due()
+        self.assertFalse(os.path.exists(letters_path))
+        store.add_malformed(b"{", ValueError("bad"))
+        store.flush_if_due()
+        store.close()
+        self.assertEqual([entry['message'] for entry in read_dead_letter_file(letters_path)], ['{"asset_id": "A"}', '{'])
+
+    def test_rows_rejected_by_a_flush_are_dead_lettered_with_their_message(self):
+        """Test that a row the backend refuses at flush time is recorded against the message it came from."""
+        bulk_create = EvaluationLog.objects.bulk_create
+
+        def refuse_sixty(rows, **kwargs):
+            if any(row.result == 60 for row in rows):
+                raise DataError("value out of range")
+            return bulk_create(rows, **kwargs)
+
+        store = DatabaseDeadLetterStore()
+        processor = MessageProcessor(RoutingIndex().load(), BufferedDatabaseDataSink(batch_size=3), store)
+        with mock.patch.object(EvaluationLog.objects, 'bulk_create', side_effect=refuse_sixty):
+            for minute, value in enumerate((10, 30, 20)):
+                processor.process({"asset_id": "Asset123", "attribute_id": "Temp",
+                                   "timestamp": f"2024-10-31T10:0{minute}:00Z", "value": value})
+            processor.close()
+        self.assertEqual(sorted(EvaluationLog.objects.values_list('result', flat=True)), [20.0, 40.0])
+        letter = DeadLetter.objects.get()
+        self.assertEqual((letter.error_class, letter.stage), ("DataError", DeadLetter.WRITE))
+        self.assertEqual(json.loads(letter.message)["value"], 30)
+        self.assertEqual(processor.report()['failures'], {"DataError": 1})
+
+    def test_dead_letters_are_off_by_default(self):
+        """Test that unrouted messages are only recorded when a store is chosen."""
+        path = self.write_messages([
+            '{"asset_id": "Pump7", "attribute_id": "Temp", "timestamp": "2024-10-31T10:05:00Z", "value": "30"}',
+        ])
+        self.run_command('process_messages', path)
+        self.assertFalse(DeadLetter.objects.exists())
+
+    def test_purge_removes_expired_dead_letters(self):
+        """Test that purge_evaluations deletes dead letters older than DEAD_LETTER_RETENTION_DAYS."""
+        now = datetime_utc("2024-11-10T12:00:00")
+        DeadLetter.objects.create(message="{}", error_class="NoRoute", stage=DeadLetter.ROUTE,
+                                  created_at=now - timedelta(days=31))
+        recent = DeadLetter.objects.create(message="{}", error_class="NoRoute", stage=DeadLetter.ROUTE,
+                                           created_at=now - timedelta(days=29))
+        with override_settings(DEAD_LETTER_RETENTION_DAYS=30):
+            deleted = Purger(now=now).purge()
+        self.assertEqual(deleted['dead_letters'], 1)
+        self.assertEqual(list(DeadLetter.objects.values_list('id', flat=True)), [recent.id])
+
+    def test_replay_only_fails_entries_whose_rows_were_not_written(self):
+        """Test that rows committed before the sink failed are not replayed a second time."""
+        sink = PartiallyFailingSink(batch_size=2, max_latency=60)
+        replayer = Replayer(MessageProcessor(RoutingIndex().load(), sink))
+        entries = [
+            (number, json.dumps({"asset_id": "Asset123", "attribute_id": "Temp",
+                                 "timestamp": "2024-10-31T10:00:00Z", "value": number}), '')
+            for number in (1, 2, 3)
+        ]
+        replayed, failed = replayer.replay(entries)
+        self.assertEqual(replayed, [1, 2])
+        self.assertEqual(list(failed), [3])
+        self.assertEqual([row[3] for row in sink.written], [2, 4])
+        self.assertEqual(sink.pending(), 0)
+
+    def test_rejects_unknown_store(self):
+        """Test that an unknown --dead-letters spec is a command error."""
+        path = self.write_messages(['{}'])
+        with self.assertRaises(CommandError):
+            self.run_command('process_messages', path, '--dead-letters', 'kafka:topic')
+
+class PartiallyFailingSink(BufferedSink):
+    """Flushes after every full batch of a write_many call and fails every flush after the first."""
+
+    def __init__(self, batch_size, max_latency):
+        super().__init__(batch_size, max_latency)
+        self.written = []
+
+    def build_row(self, asset_id, attribute_id, timestamp, result):
+        return (asset_id, attribute_id, timestamp, result)
+
+    def write_many(self, rows, sources=None):
+        failures = []
+        for index, row in enumerate(rows):
+            failures.extend(super().write_many([row], None if sources is None else [sources[index]]))
+        return failures
+
+    def write_batch(self, batch):
+        if self.written:
+            raise ConnectionError("connection lost")
+        self.written.extend(batch)
+
+
+class RollupTests(APITestCase):
+    """
+    Tests for incremental rollups and the rollup API.
+    """
+
+    def write(self, *rows):
+        sink = BufferedDatabaseDataSink(batch_size=100, max_latency=60, rollups=True)
+        for timestamp, result in rows:
+            sink.write_data("A001", "output_Temp", timestamp, result)
+        sink.close()
+
+    def test_incremental_rollups_from_sink(self):
+        """Test that each flush folds only its new rows into the buckets."""
+        self.write(("2024-10-31T10:00:10Z", 1), ("2024-10-31T10:00:50Z", 3), ("2024-10-31T10:01:00Z", 5))
+        self.write(("2024-10-31T10:00:30Z", -1))
+
+        minute = EvaluationRollup.objects.get(resolution="minute", bucket_start="2024-10-31T10:00:00Z")
+        self.assertEqual((minute.count, minute.min, minute.max, minute.avg), (3, -1, 3, 1))
+        hour = EvaluationRollup.objects.get(resolution="hour")
+        self.assertEqual((hour.count, hour.sum), (4, 8))
+
+        # Re-running the builder does not count rows twice
+        self.assertEqual(RollupBuilder().build(), 0)
+        self.assertEqual(EvaluationRollup.objects.get(resolution="day").count, 4)
+
+    def test_build_rollups_command_and_api(self):
+        """Test building rollups with the command and reading the series."""
+        EvaluationLog.objects.bulk_create([
+            EvaluationLog(asset_id="A001", attribute_id="output_Temp",
+                          timestamp=f"2024-10-31T{hour:02d}:30:00Z", result=hour)
+            for hour in range(3)
+        ])
+        out = io.StringIO()
+        call_command('build_rollups', '--chunk-size', '2', stdout=out)
+        self.assertIn("Folded 3 evaluation rows", out.getvalue())
+
+        url = reverse('evaluationrollup-list')
+        response = self.client.get(url, {"asset_id": "A001", "attribute_id": "output_Temp", "resolution": "hour"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([row["avg"] for row in response.data["results"]], [0.0, 1.0, 2.0])
+        self.assertEqual(self.client.get(url, {"asset_id": "A001"}).status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class ListDataSink(DataSink):
+    """In-memory sink that rejects rows whose result is negative."""
+
+    def __init__(self):
+        self.rows = []
+        self.closed = False
+
+    def write_data(self, asset_id, attribute_id, timestamp, result):
+        if result < 0:
+            raise ValueError("negative result")
+        self.rows.append((asset_id, attribute_id, timestamp, result))
+
+    def close(self):
+        self.closed = True
+
+
+class ListDataSource(DataSource):
+    """In-memory source over a list of messages."""
+
+    def __init__(self, messages):
+        self.messages = messages
+
+    def read_data(self):
+        yield from self.messages
+
+
+class AsyncPipelineTests(TestCase):
+    """
+    Tests for the asyncio ingest pipeline.
+    """
+
+    def setUp(self):
+        kpi = KPI.objects.create(name="Temp KPI", expression="ATTR - 10")
+        asset = Asset.objects.create(asset_id="Asset123", name="Sensor")
+        AssetKPI.objects.create(asset=asset, kpi=kpi, attribute_id="Temp")
+        self.routing = RoutingIndex().load()
+
+    def test_stages_process_every_message(self):
+        """Test that all messages flow through and write failures are counted."""
+        messages = [
+            {"asset_id": "Asset123", "attribute_id": "Temp", "timestamp": f"2024-10-31T10:00:{i:02d}Z", "value": i}
+            for i in range(50)
+        ]
+        messages.append({"asset_id": "Asset123"})
+        sink = ListDataSink()
+        pipeline = AsyncPipeline(MessageProcessor(self.routing, sink), evaluators=3, queue_size=4,
+                                 write_batch_size=8)
+        with self.assertLogs('kpi_app.core.pipeline', level='WARNING') as logs:
+            report = asyncio.run(pipeline.run(ListDataSource(messages)))
+        self.assertEqual(len(logs.output), 10)
+
+        self.assertEqual(report['counts'], {'processed': 40, 'skipped': 1, 'failed': 10})
+        self.assertEqual(report['failures'], {'ValueError': 10})
+        self.assertEqual(sorted(row[3] for row in sink.rows), list(range(40)))
+        self.assertTrue(sink.closed)
+
+
+class StreamingDataSourceTests(TestCase):
+    """
+    Tests for the stdin, TCP and tail streaming sources.
+    """
+
+    def collect(self, source, count, timeout=5):
+        """Reads from a source on a thread until `count` messages arrived, then stops it."""
+        messages = []
+
+        def consume():
+            for batch in source.read_batches():
+                messages.extend(batch)
+                if len(messages) >= count:
+                    return
+
+        thread = threading.Thread(target=consume, daemon=True)
+        thread.start()
+        thread.join(timeout)
+        source.stop()
+        return messages
+
+    def test_stdin_source_batches_until_eof(self):
+        """Test reading a pipe in batches and counting malformed lines."""
+        stream = io.BytesIO(b"".join(b'{"value": %d}\n' % i for i in range(5)) + b"oops\n")
+        source = StdinDataSource(stream=stream, batch_size=2)
+        messages = list(source.read_data())
+        self.assertEqual([m["value"] for m in messages], [0, 1, 2, 3, 4])
+        self.assertEqual(source.malformed, 1)
+
+    def test_async_reads_hand_on_each_batch_without_waiting_for_more(self):
+        """Test that aread_data yields a message while the stream stays open and idle."""
+        read_end, write_end = os.pipe()
+        source = StdinDataSource(stream=os.fdopen(read_end, 'rb'), idle_timeout=0.05)
+        writer = os.fdopen(write_end, 'wb', buffering=0)
+        writer.write(b'{"value": 1}\n')
+
+        async def first_then_rest():
+            messages = source.aread_data()
+            first = await asyncio.wait_for(anext(messages), 5)
+            writer.write(b'{"value": 2}\n')
+            writer.close()
+            return [first] + [message async for message in messages]
+
+        try:
+            messages = asyncio.run(first_then_rest())
+        finally:
+            source.stop()
+            if not writer.closed:
+                writer.close()
+        self.assertEqual([m["value"] for m in messages], [1, 2])
+
+    def test_tcp_source_reads_client_lines(self):
+        """Test that newline-delimited JSON sent by a client is received."""
+        source = TCPDataSource('127.0.0.1', 0, idle_timeout=0.1)
+        source.start()
+        self.assertTrue(source.ready.wait(5))
+        with socket.create_connection(('127.0.0.1', source.port)) as client:
+            client.sendall(b'{"value": 1}\n{"value": 2}\n')
+        self.assertEqual([m["value"] for m in self.collect(source, 2)], [1, 2])
+
+    def test_tail_source_follows_appends_and_rotation(self):
+        """Test following a directory through appends, partial lines, rotation and new files."""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, "messages.jsonl")
+        with open(path, "w") as f:
+            f.write('{"value": "old"}\n')
+
+        source = TailDataSource(directory, pattern="*.jsonl", poll_interval=0.05, idle_timeout=0.05)
+        source.start()
+        time.sleep(0.3)
+        with open(path, "a") as f:
+            f.write('{"value": 1}\n{"val')
+        time.sleep(0.3)
+        with open(path, "a") as f:
+            f.write('ue": 2}\n')
+        time.sleep(0.3)
+        os.rename(path, path + ".1")
+        with open(path, "w") as f:
+            f.write('{"value": 3}\n')
+        with open(os.path.join(directory, "other.jsonl"), "w") as f:
+            f.write('{"value": 4}\n')
+
+        values = sorted(m["value"] for m in self.collect(source, 4))
+        self.assertEqual(values, [1, 2, 3, 4])
+
+    def test_open_source_parses_uris(self):
+        """Test selecting a source class from a URI."""
+        self.assertIsInstance(open_source("-"), StdinDataSource)
+        self.assertIsInstance(open_source("tcp://127.0.0.1:9000"), TCPDataSource)
+        tail = open_source("tail:///var/log/kpi?pattern=*.jsonl&from_start=1")
+        self.assertEqual((tail.path, tail.pattern, tail.from_start), ("/var/log/kpi", "*.jsonl", True))
+        self.assertIsInstance(open_source("file:///tmp/messages.txt", mmap=True), MappedFileDataSource)
+        with self.assertRaises(ValueError):
+            open_source("ftp://example.com/messages")
+
+
+class BenchmarkTests(TestCase):
+    """
+    Tests for the synthetic workload generator and the ingest benchmark.
+    """
+
+    def test_workload_is_reproducible(self):
+        """Test that a seed always yields the same stream with the requested shape."""
+        workload = Workload(messages=2000, assets=10, attributes=4, regex_ratio=0.5, malformed_ratio=0.1, seed=7)
+        lines = list(workload.lines())
+        self.assertEqual(lines, list(workload.lines()))
+        messages = []
+        for line in lines:
+            try:
+                messages.append(json.loads(line))
+            except ValueError:
+                pass
+        self.assertTrue(150 < len(lines) - len(messages) < 250)
+        self.assertLessEqual({m["asset_id"] for m in messages}, {workload.asset_id(i) for i in range(10)})
+        regex_values = [m["value"] for m in messages if workload.is_regex(int(m["attribute_id"][4:]))]
+        self.assertTrue(regex_values and not any(value.replace('.', '').isdigit() for value in regex_values))
+
+    def test_interpreter_benchmark_never_evals_given_expressions(self):
+        """Test that the eval baseline only runs the built-in expressions."""
+        with self.assertRaises(ValueError):
+            legacy_evaluate("__import__('os').getpid()", 1)
+        output = io.StringIO()
+        call_command('benchmark_interpreter', 'ATTR * 3', '(ATTR - 32) * 5 / 9', number=10, repeat=1, stdout=output)
+        lines = output.getvalue().splitlines()
+        self.assertIn("n/a", lines[1])
+        self.assertNotIn("n/a", lines[2])
+
+    def test_benchmark_reports_every_stage_and_rolls_back(self):
+        """Test that the command prints a JSON report and leaves no rows behind."""
+        output = io.StringIO()
+        call_command('benchmark_ingest', messages=300, assets=5, kpis_per_attribute=2, stdout=output)
+        report = json.loads(output.getvalue())
+        self.assertEqual(set(report["stages"]), {'decode', 'interpreter', 'routing', 'sink', 'end_to_end'})
+        for stage in report["stages"].values():
+            self.assertGreater(stage["operations"], 0)
+            self.assertIn("p99", stage["latency_us"])
+            self.assertIn("rss_delta_bytes", stage)
+            self.assertNotIn("peak_rss_bytes", stage)
+        self.assertIn("peak_rss_bytes", report)
+        self.assertEqual(sum(report["stages"]["end_to_end"]["counts"].values()), 300 - report["stages"]["decode"]["malformed"])
+        self.assertEqual(Asset.objects.count(), 0)
+        self.assertEqual(EvaluationLog.objects.count(), 0)
+
+    def test_benchmark_reuses_existing_fixtures_and_keeps_them(self):
+        """Test that fixtures from an earlier run are reused and only the benchmark's own data is removed."""
+        workload = Workload(messages=50, assets=3, attributes=2)
+        with transaction.atomic():
+            workload.create_fixtures()
+        kept = EvaluationLog.objects.create(asset_id="BENCH000000", attribute_id="output_attr1",
+                                            timestamp=datetime(2024, 1, 1, tzinfo=timezone.utc), result=1)
+        counts = (KPI.objects.count(), Asset.objects.count(), AssetKPI.objects.count())
+        bigger = Workload(messages=200, assets=5, attributes=2)
+        call_command('benchmark_ingest', messages=200, assets=5, attributes=2, stages=['end_to_end'],
+                     stdout=io.StringIO())
+        self.assertEqual((KPI.objects.count(), Asset.objects.count(), AssetKPI.objects.count()), counts)
+        self.assertEqual(list(EvaluationLog.objects.all()), [kept])
+        with transaction.atomic():
+            created = bigger.create_fixtures()
+        self.assertEqual((len(created['kpis']), len(created['assets'])), (0, 2))
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -78,14 +79,92 @@ WSGI_APPLICATION = 'kpi_project.wsgi.application'
 
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
+# SQLite by default. Set POSTGRES_DB (plus POSTGRES_USER, POSTGRES_PASSWORD,
+# POSTGRES_HOST and POSTGRES_PORT as needed) to use PostgreSQL, which needs
+# psycopg (`pip install "psycopg[binary]"`). Connections are kept open for
+# DB_CONN_MAX_AGE seconds; setting DB_POOL_MAX_SIZE switches to a psycopg 3
+# connection pool instead (`pip install "psycopg[pool]"`).
+
+if os.environ.get('POSTGRES_DB'):
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ['POSTGRES_DB'],
+            'USER': os.environ.get('POSTGRES_USER', ''),
+            'PASSWORD': os.environ.get('POSTGRES_PASSWORD', ''),
+            'HOST': os.environ.get('POSTGRES_HOST', ''),
+            'PORT': os.environ.get('POSTGRES_PORT', ''),
+            'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', 60)),
+            'CONN_HEALTH_CHECKS': True,
+        }
+    }
+    if os.environ.get('DB_POOL_MAX_SIZE'):
+        # A pool replaces persistent connections; Django rejects using both
+        DATABASES['default']['CONN_MAX_AGE'] = 0
+        DATABASES['default']['OPTIONS'] = {
+            'pool': {
+                'min_size': int(os.environ.get('DB_POOL_MIN_SIZE', 1)),
+                'max_size': int(os.environ['DB_POOL_MAX_SIZE']),
+            },
+        }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / 'db.sqlite3',
+            # process_messages --workers reopens the database in each worker, so test on disk too
+            'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'},
+        }
+    }
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+# Holds the KPI, asset and AssetKPI API responses. The local-memory backend is
+# per process: with several server processes, use a shared backend (Redis,
+# Memcached) so that a change made through one process invalidates all of them.
 
-DATABASES = {
+CACHES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
     }
 }
 
+# Seconds a cached API response (and its ETag version) is kept
+API_CACHE_TIMEOUT = 300
+
+
+# Directory of the columnar EvaluationLog archive written by `archive_evaluations`
+EVALUATION_ARCHIVE_DIR = BASE_DIR / 'archive'
+
+# Days `purge_evaluations` keeps dead letters for; None keeps them until they are replayed
+DEAD_LETTER_RETENTION_DAYS = 30
+
+
+# Logging
+# https://docs.djangoproject.com/en/5.1/topics/logging/
+# The pipeline logs skipped messages and every written result at DEBUG, failures
+# at WARNING and its periodic metrics summary at INFO. Set KPI_LOG_LEVEL=DEBUG
+# to trace each message, or WARNING to silence the summaries.
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'simple': {'format': '%(asctime)s %(levelname)s %(name)s: %(message)s'},
+    },
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler', 'formatter': 'simple'},
+    },
+    'loggers': {
+        'kpi_app': {
+            'handlers': ['console'],
+            'level': os.environ.get('KPI_LOG_LEVEL', 'INFO'),
+            'propagate': False,
+        },
+    },
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
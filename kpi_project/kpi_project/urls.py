@@ -19,6 +19,7 @@ from django.urls import path, include
 from rest_framework import permissions
 from drf_yasg.views import get_schema_view
 from drf_yasg import openapi
+from kpi_app.api.views import metrics
 
 schema_view = get_schema_view(
     openapi.Info(
@@ -38,4 +39,5 @@ urlpatterns = [
     path('api/', include('kpi_app.api.urls')),
     path('swagger/', schema_view.with_ui('swagger', cache_timeout=0), name='schema-swagger-ui'),
     path('redoc/', schema_view.with_ui('redoc', cache_timeout=0), name='schema-redoc'),
+    path('metrics', metrics, name='metrics'),
 ]